@@ -0,0 +1,49 @@
+"""Cold-start time of `import schelling_graph`, measured in fresh interpreters.
+
+Also checks that the plotting and optional dependencies (matplotlib, IPython,
+scipy) are not imported by the simulation core.
+
+    python benchmarks/cold_start.py [--repeat 10]
+"""
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+HEAVY_MODULES = ("matplotlib", "matplotlib.pyplot", "IPython", "scipy")
+
+PROBE = f"""
+import json, sys, time
+t = time.perf_counter()
+import schelling_graph
+elapsed = time.perf_counter() - t
+print(json.dumps({{"seconds": elapsed, "loaded": [m for m in {HEAVY_MODULES!r} if m in sys.modules]}}))
+"""
+
+
+def measure(repeat: int = 10) -> dict:
+    """Median import time over repeat fresh interpreters, and the heavy modules they loaded."""
+    runs = []
+    for _ in range(repeat):
+        out = subprocess.run([sys.executable, "-c", PROBE], cwd=ROOT, check=True,
+                             capture_output=True, text=True).stdout
+        runs.append(json.loads(out))
+    return {
+        "median_seconds": statistics.median(r["seconds"] for r in runs),
+        "min_seconds": min(r["seconds"] for r in runs),
+        "heavy_modules_loaded": sorted({m for r in runs for m in r["loaded"]}),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=10)
+    result = measure(parser.parse_args().repeat)
+    print(f"import schelling_graph: median {result['median_seconds'] * 1000:.0f} ms, "
+          f"min {result['min_seconds'] * 1000:.0f} ms")
+    if result["heavy_modules_loaded"]:
+        print(f"heavy modules loaded: {', '.join(result['heavy_modules_loaded'])}")
+        sys.exit(1)
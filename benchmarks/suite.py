@@ -0,0 +1,243 @@
+"""Benchmarks of the construction, simulation and rendering hot paths.
+
+Runs offline on synthetic graphs: the 10 node graph of graph_definition.py and
+triangular graphs with arrows from auto_arrows, at several sizes s and chip
+densities. The results are written as JSON, and can be compared with the
+results of an earlier run: the cases that got slower by more than the
+threshold are reported as regressions (and the exit status is 1).
+
+    python benchmarks/suite.py [--quick] [--only run_rounds] [--output results.json]
+    python benchmarks/suite.py --compare baseline.json [--threshold 0.2]
+    python benchmarks/suite.py --compare baseline.json --against results.json
+"""
+import argparse
+import json
+import platform
+import statistics
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+import numpy as np  # noqa: E402
+import schelling_graph as sg  # noqa: E402
+from schelling_graph import Schelling_Graph, Schelling_Node  # noqa: E402
+
+FORMAT = "schelling_graph benchmarks"
+COLORS = ["black", "red", "orange", "purple", "blue", "cyan", "green"]
+TAU = 0.6
+SEED = 0
+
+# (sizes s of the triangular graphs, mean chips per node, maximum rounds of a run, repetitions)
+FULL = {"sizes": (10, 20, 40), "densities": (0.5, 2.0), "rounds": 5000, "repeat": 5}
+QUICK = {"sizes": (10, 20), "densities": (0.5, 2.0), "rounds": 2000, "repeat": 3}
+
+
+# %% GRAPHS =====================================================
+
+def definition_graph() -> Schelling_Graph:
+    """The nodes of graph_definition.py.
+
+    graph_definition.py is written for an older version of add_arrow, so its
+    arrows are derived with auto_arrows.
+    """
+    layout = [(0, 3, "black"), (0, 2, "red"), (0, 1, "red"), (0, 0, "orange"), (1, 2, "purple"),
+              (1, 1, "blue"), (1, 0, "cyan"), (2, 1, "green"), (2, 0, "cyan"), (3, 0, "black")]
+    g = Schelling_Graph([Schelling_Node(x=x, y=y, color=c) for x, y, c in layout], seed=SEED)
+    sg.auto_arrows(g, TAU)
+    return g
+
+
+def triangle_nodes(s: int) -> list[Schelling_Node]:
+    """The nodes (a, b) with a+b <= s, colored in a fixed pattern."""
+    return [Schelling_Node(x=a, y=b, color=COLORS[(3 * a + b) % len(COLORS)])
+            for a in range(s + 1) for b in range(s + 1 - a)]
+
+
+def triangle_graph(s: int) -> Schelling_Graph:
+    g = Schelling_Graph(triangle_nodes(s), seed=SEED)
+    sg.auto_arrows(g, TAU)
+    return g
+
+
+def with_chips(graph: Schelling_Graph, density: float) -> Schelling_Graph:
+    """A copy of graph with uniform random chips, density per node on average."""
+    g = graph.copy()
+    g.seed(SEED)
+    g.init_chips_uniform(0, round(2 * density))
+    return g
+
+
+# %% TIMING =====================================================
+
+def timed(fn, repeat: int, setup=None) -> tuple[list[float], object]:
+    """Seconds taken by fn(setup()) in each of repeat calls, and its last result."""
+    seconds = []
+    result = None
+    for _ in range(repeat):
+        arg = setup() if setup is not None else None
+        t = time.perf_counter()
+        result = fn(arg) if setup is not None else fn()
+        seconds.append(time.perf_counter() - t)
+    return seconds, result
+
+
+def summary(seconds: list[float], **metrics) -> dict:
+    return {"seconds": statistics.median(seconds), "min_seconds": min(seconds), **metrics}
+
+
+# %% CASES =====================================================
+
+def bench_construction(config, results):
+    for s in config["sizes"]:
+        seconds, _ = timed(Schelling_Graph, config["repeat"], setup=lambda: triangle_nodes(s))
+        results[f"init/s={s}"] = summary(seconds)
+
+        seconds, _ = timed(lambda g: sg.auto_arrows(g, TAU), config["repeat"],
+                           setup=lambda: Schelling_Graph(triangle_nodes(s)))
+        results[f"auto_arrows/s={s}"] = summary(seconds)
+
+        g = triangle_graph(s)
+        seconds, _ = timed(g.copy, config["repeat"])
+        results[f"copy/s={s}"] = summary(seconds, n_arrows=g.compile().n_arrows)
+
+        seconds, _ = timed(lambda: g.chips_matrix, config["repeat"] * 20)
+        results[f"chips_matrix/s={s}"] = summary(seconds)
+
+    for s in (max(config["sizes"]), 10 * max(config["sizes"])):
+        seconds, _ = timed(lambda: sg.calc_multinomial_pvals(0.3, 0.4, s), config["repeat"])
+        results[f"calc_multinomial_pvals/s={s}"] = summary(seconds)
+
+
+def bench_run_rounds(config, results):
+    graphs = {"definition": definition_graph()}
+    graphs.update({f"s={s}": triangle_graph(s) for s in config["sizes"]})
+    for name, graph in graphs.items():
+        for density in config["densities"]:
+            python_seconds = None
+            for engine in ("python", "array", "kmc"):
+                seconds, result = timed(
+                    lambda g: g.run_rounds(max_rounds=config["rounds"], engine=engine, record=False,
+                                         stop_on_absorbing=False),
+                    config["repeat"], setup=lambda: with_chips(graph, density))
+                t = statistics.median(seconds)
+                python_seconds = python_seconds or t
+                # speedup over the python engine, on the same rounds
+                results[f"run_rounds/{engine}/{name}/density={density}"] = summary(
+                    seconds, rounds=result.rounds, n_moves=result.n_moves,
+                    rounds_per_s=result.rounds / t, moves_per_s=result.n_moves / t,
+                    speedup=python_seconds / t)
+
+
+def bench_render(config, results):
+    import matplotlib
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+    from schelling_graph.visualization import Chips_Renderer
+
+    for s in config["sizes"]:
+        g = with_chips(triangle_graph(s), 2.0)
+        matrix = g.chips_matrix
+        fig, ax = plt.subplots()
+        renderer = Chips_Renderer(ax, matrix.shape)
+        fig.canvas.draw()
+
+        def frame():
+            renderer.update(matrix)
+            fig.canvas.draw()
+
+        seconds, _ = timed(frame, config["repeat"])
+        results[f"render_frame/s={s}"] = summary(seconds, labels=bool(renderer.texts))
+        plt.close(fig)
+
+
+CASES = {"construction": bench_construction, "run_rounds": bench_run_rounds, "render": bench_render}
+
+
+# %% RESULTS =====================================================
+
+def environment() -> dict:
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], cwd=ROOT, capture_output=True,
+                                text=True).stdout.strip() or None
+    except OSError:
+        commit = None
+    return {"python": platform.python_version(), "numpy": np.__version__,
+            "platform": platform.platform(), "machine": platform.machine(), "commit": commit}
+
+
+def run(quick: bool = False, only: list[str] | None = None) -> dict:
+    """Run the benchmarks, returns {"format", "environment", "config", "results"}."""
+    config = QUICK if quick else FULL
+    results = {}
+    for name, case in CASES.items():
+        if only and name not in only:
+            continue
+        print(f"{name}...", file=sys.stderr)
+        case(config, results)
+    return {"format": FORMAT, "environment": environment(), "config": config, "results": results}
+
+
+def compare(baseline: dict, current: dict, threshold: float = 0.2) -> list[dict]:
+    """Cases present in both runs, with the ratio of their median times.
+
+    A case is a regression when it is slower than in baseline by more than
+    threshold (0.2 = 20%).
+    """
+    rows = []
+    for name, result in current["results"].items():
+        base = baseline["results"].get(name)
+        if base is None:
+            continue
+        ratio = result["seconds"] / base["seconds"] if base["seconds"] > 0 else float("inf")
+        rows.append({"case": name, "baseline": base["seconds"], "current": result["seconds"],
+                     "ratio": ratio, "regression": ratio > 1 + threshold})
+    return rows
+
+
+def load(path: str) -> dict:
+    with open(path) as f:
+        data = json.load(f)
+    assert data.get("format") == FORMAT, f"{path} is not a benchmark result file."
+    return data
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--quick", action="store_true", help="smaller graphs and fewer repetitions")
+    parser.add_argument("--only", nargs="+", choices=list(CASES), help="run only these groups of cases")
+    parser.add_argument("--output", help="write the results to this JSON file")
+    parser.add_argument("--compare", metavar="BASELINE", help="compare with the results in this JSON file")
+    parser.add_argument("--against", metavar="RESULTS",
+                        help="with --compare, compare these stored results instead of running the benchmarks")
+    parser.add_argument("--threshold", type=float, default=0.2,
+                        help="relative slowdown reported as a regression (default 0.2)")
+    args = parser.parse_args()
+
+    if args.against:
+        assert args.compare, "--against requires --compare."
+        current = load(args.against)
+    else:
+        current = run(args.quick, args.only)
+        if args.output:
+            with open(args.output, "w") as f:
+                json.dump(current, f, indent=1)
+
+    if not args.compare:
+        for name, result in current["results"].items():
+            extra = "".join(f", {k} {v:.4g}" for k, v in result.items()
+                            if k.endswith("_per_s") or k == "speedup")
+            print(f"{name:55} {result['seconds'] * 1000:10.3f} ms{extra}")
+        sys.exit(0)
+
+    rows = compare(load(args.compare), current, args.threshold)
+    for row in rows:
+        flag = "REGRESSION" if row["regression"] else ""
+        print(f"{row['case']:55} {row['baseline'] * 1000:10.3f} ms -> {row['current'] * 1000:10.3f} ms "
+              f"x{row['ratio']:.2f} {flag}")
+    regressions = [row for row in rows if row["regression"]]
+    print(f"{len(regressions)} regression(s) in {len(rows)} cases (threshold {args.threshold:.0%})")
+    sys.exit(1 if regressions else 0)
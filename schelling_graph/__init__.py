@@ -1,4 +1,24 @@
-from .structures import Schelling_Node, Schelling_Arrow, VALID_COLORS
+from .structures import Schelling_Node, Schelling_Arrow
 from .graph import Schelling_Graph
-from .tools import get_nodes_by_color, create_vertex_matrix, get_vertex_at_position, load_nodes_from_csv, calc_multinomial_pvals, auto_arrows
-from .visualization import draw_graph, draw_matrix
+from .tools import get_nodes_by_color, create_vertex_matrix, get_vertex_at_position, load_nodes_from_csv, calc_multinomial_pvals, node_multinomial_pvals, auto_arrows, arrow_table, add_arrow_table
+from .engine import Compiled_Graph
+from .stopping import Stop_Condition, Segregated, Absorbing, No_Progress, Time_Budget, Checkpoint, Callback
+from .instrument import Run_Stats
+from .ensemble import run_ensemble, Ensemble_Result
+from .batch import run_lockstep
+from .sweep import run_sweep, Sweep_Result, Sweep_Cache
+from .graph_file import save_graph, load_graph
+from .exact import solve_exact, Exact_Result
+from .meanfield import run_mean_field, Mean_Field_Trajectory
+from .trajectory import Trajectory, Trajectory_File, Run_Result
+
+
+def __getattr__(name):
+    # the plotting functions and VALID_COLORS need matplotlib, they are loaded on first use
+    if name in ("draw_graph", "draw_matrix", "export_animation"):
+        from . import visualization
+        return getattr(visualization, name)
+    if name == "VALID_COLORS":
+        from . import structures
+        return structures.VALID_COLORS
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -0,0 +1,255 @@
+import time
+import numpy as np
+from schelling_graph.ensemble import Ensemble_Result, _portable_stop_when
+from schelling_graph.stopping import Absorbing, No_Progress, Segregated, Time_Budget, as_stop_conditions
+
+# draws of an arrow per replica and step before falling back to the padded table
+REJECTION_TRIES = 4
+
+
+class Padded_Arrows:
+    """Arrow tables of a Compiled_Graph padded to the maximum out-degree.
+
+    Row i holds the arrows of node i, the slots past its degree are masked by
+    valid. This allows gathering the arrows of one node per replica at once.
+    """
+
+    def __init__(self, compiled):
+        n = compiled.n_nodes
+        degree = np.diff(compiled.arrow_ptr)
+        width = max(int(degree.max()) if n else 0, 1)
+        slot = np.arange(compiled.n_arrows) - \
+            np.repeat(compiled.arrow_ptr[:-1], degree)
+
+        self.valid = np.zeros((n, width), dtype=bool)
+        self.neighbor = np.zeros((n, width), dtype=np.int64)
+        self.out_node = np.zeros((n, width), dtype=np.int64)
+        self.out_neighbor = np.full((n, width), -1, dtype=np.int64)
+        src = compiled.arrow_source
+        self.valid[src, slot] = True
+        self.neighbor[src, slot] = compiled.arrow_neighbor
+        self.out_node[src, slot] = compiled.arrow_out_node
+        self.out_neighbor[src, slot] = compiled.arrow_out_neighbor
+
+
+def _nth_true(mask: np.ndarray, n: np.ndarray) -> np.ndarray:
+    """Column of the n-th (0-based) True value of each row of mask."""
+    return np.argmax(np.cumsum(mask, axis=1) > n[:, None], axis=1)
+
+
+class _Replica_Rows:
+    """Occupied_Index and candidate arrows of every row of a chips matrix,
+    updated with one batched operation per phase of the moves.
+
+    items[r, :count[r]] are the nodes with chips of row r, in any order, and
+    pos[r, i] is the slot of node i in items[r], -1 if it has no chips.
+    candidates[r, i] is the number of arrows of node i whose out node has
+    chips in row r (the last column absorbs the padding of the updates).
+    """
+
+    def __init__(self, compiled, chips: np.ndarray):
+        n = compiled.n_nodes
+        source, out_node = compiled.arrow_source, compiled.arrow_out_node
+        occupied = chips > 0
+        self.count = occupied.sum(axis=1)
+        self.items = np.argsort(~occupied, axis=1, kind="stable")
+        self.pos = np.full(chips.shape, -1, dtype=np.int64)
+        self.pos[np.arange(len(chips))[:, None], self.items] = np.arange(n)
+        self.pos[~occupied] = -1
+
+        # for every out node, the sources of its arrows with their
+        # multiplicity, padded with the extra column n
+        keys, counts = np.unique(out_node * n + source, return_counts=True)
+        to, source = keys // n, keys % n
+        width = max(int(np.bincount(to, minlength=n).max()) if len(keys) else 0, 1)
+        slot = np.arange(len(keys)) - np.searchsorted(to, to)
+        self.rev_source = np.full((n, width), n, dtype=np.int64)
+        self.rev_count = np.zeros((n, width), dtype=np.int64)
+        self.rev_source[to, slot] = source
+        self.rev_count[to, slot] = counts
+        # number of arrows of each node whose out node is the node itself
+        self.n_self_arrows = np.bincount(
+            compiled.arrow_source[out_node == compiled.arrow_source], minlength=n)
+
+        arrows_to = np.zeros((n, n + 1))
+        arrows_to[to, source] = counts
+        self.candidates = np.rint(occupied @ arrows_to).astype(np.int64)
+
+    def keep(self, rows: np.ndarray):
+        self.count, self.items, self.pos = self.count[rows], self.items[rows], self.pos[rows]
+        self.candidates = self.candidates[rows]
+
+    def remove(self, r: np.ndarray, node: np.ndarray):
+        """Remove node from row r, for each pair (r, node); r without duplicates."""
+        slot = self.pos[r, node]
+        self.count[r] -= 1
+        last = self.items[r, self.count[r]]
+        self.items[r, slot] = last
+        self.pos[r, last] = slot
+        self.pos[r, node] = -1
+        # the padding of every row adds 0 to its last column
+        self.candidates[r[:, None], self.rev_source[node]] -= self.rev_count[node]
+
+    def add(self, r: np.ndarray, node: np.ndarray):
+        """Add node to row r, for each pair (r, node); r without duplicates."""
+        self.items[r, self.count[r]] = node
+        self.pos[r, node] = self.count[r]
+        self.count[r] += 1
+        self.candidates[r[:, None], self.rev_source[node]] += self.rev_count[node]
+
+    def absorbing(self, rows: np.ndarray, chips: np.ndarray) -> np.ndarray:
+        """Whether no round of the rows (chips are their chips) can end with a
+        move; the self arrows of a node with a single chip are rejected."""
+        valid = self.candidates[rows, :-1] - np.where(chips == 1, self.n_self_arrows, 0)
+        return ~((chips > 0) & (valid > 0)).any(axis=1)
+
+
+def run_lockstep(graph, n_replicas: int | None = None, chips: np.ndarray | None = None, stop_when=None,
+                 max_rounds: int = 1000, stop_on_absorbing: bool = True) -> Ensemble_Result:
+    """Advance many replicas of graph together, one round of every replica per step.
+
+    The chips of the replicas are held in an (n_replicas, n_nodes) array and
+    every step of run_round (node sampling, candidate arrows, move_chips) is
+    done with batched NumPy operations over the running replicas. Replicas
+    start from chips, or from the chips of graph repeated n_replicas times.
+
+    Each replica keeps, like the graph of a serial run, its nodes with chips
+    and its number of chips off the x=0/y=0 boundary, and also the number of
+    candidate arrows of every node (see _Replica_Rows). The arrow of a round
+    is drawn among the arrows of the node until one is a candidate, so a step
+    does not scan the arrows of the nodes or the chips of the replicas, and
+    the stopped replicas are dropped from the arrays. As in a serial run, the
+    absorbing states are checked at the start and after an idle round that
+    follows a move.
+
+    stop_when can be graph.is_segregated or the Segregated, No_Progress,
+    Absorbing and Time_Budget conditions (see the stopping module). Replicas
+    that satisfy it stop, the others go on until max_rounds. The random
+    numbers are drawn from graph.rng.
+    """
+    compiled = graph.compile()
+    arrows = Padded_Arrows(compiled)
+    arrow_ptr, degree = compiled.arrow_ptr[:-1], np.diff(compiled.arrow_ptr)
+    arrow_neighbor, arrow_out_node = compiled.arrow_neighbor, compiled.arrow_out_node
+    arrow_out_neighbor = compiled.arrow_out_neighbor
+    rng = graph.rng
+
+    if chips is None:
+        assert n_replicas is not None, "Either n_replicas or chips must be given."
+        chips = np.tile(graph.chips_array, (n_replicas, 1))
+    else:
+        chips = np.array(chips, dtype=np.int64)
+    n_replicas = len(chips)
+    assert chips.shape == (n_replicas, compiled.n_nodes), \
+        f"chips must have shape (n_replicas, {compiled.n_nodes}), got {chips.shape}."
+
+    conditions = as_stop_conditions(_portable_stop_when(graph, stop_when))
+    if stop_on_absorbing:
+        conditions.append(Absorbing())
+    for c in conditions:
+        if not isinstance(c, (Segregated, No_Progress, Absorbing, Time_Budget)):
+            raise ValueError(f"{c} is not supported by the lockstep engine.")
+
+    inside = ((compiled.x != 0) & (compiled.y != 0)).astype(np.int64)
+    rounds = np.zeros(n_replicas, dtype=np.int64)
+    moves = np.zeros(n_replicas, dtype=np.int64)
+    reasons: list[str | None] = [None] * n_replicas
+    start_time = time.perf_counter()
+
+    # state of the running replicas, row k is replica ids[k]; the rows of the
+    # stopped replicas are copied to the results and dropped
+    ids = np.arange(n_replicas)
+    c = chips
+    replicas = _Replica_Rows(compiled, c)
+    n_not_segregated = c @ inside
+    n_rounds = np.zeros(n_replicas, dtype=np.int64)
+    n_moves = np.zeros(n_replicas, dtype=np.int64)
+    last_move = np.zeros(n_replicas, dtype=np.int64)
+    # replicas whose state has been found non-absorbing since their last move
+    checked = np.zeros(n_replicas, dtype=bool)
+    first = True
+
+    while True:
+        done = np.zeros(len(ids), dtype=bool)
+        # stop conditions, in the order of Run_State.should_stop
+        for cond in conditions:
+            if isinstance(cond, Segregated):
+                hit = n_not_segregated == 0
+            elif isinstance(cond, No_Progress):
+                hit = n_rounds - last_move >= cond.k
+            elif isinstance(cond, Time_Budget):
+                hit = np.full(len(ids), time.perf_counter() - start_time >= cond.seconds)
+            else:
+                hit = np.zeros(len(ids), dtype=bool)
+                test = np.flatnonzero(~done & ~checked & (first | (n_rounds > last_move) | (n_rounds >= max_rounds)))
+                if len(test):
+                    absorbing = test[replicas.absorbing(test, c[test])]
+                    checked[test] = True
+                    hit[absorbing] = True
+                    # the idle round that revealed the state is not counted
+                    n_rounds[absorbing] = last_move[absorbing]
+            for k in np.flatnonzero(hit & ~done).tolist():
+                reasons[ids[k]] = cond.reason
+            done |= hit
+        for k in np.flatnonzero(~done & (n_rounds >= max_rounds)).tolist():
+            reasons[ids[k]] = "maximum number of rounds reached"
+            done[k] = True
+        first = False
+
+        if done.any():
+            stopped = ids[done]
+            rounds[stopped], moves[stopped], chips[stopped] = n_rounds[done], n_moves[done], c[done]
+            keep = np.flatnonzero(~done)
+            ids, c, n_not_segregated = ids[keep], c[keep], n_not_segregated[keep]
+            n_rounds, n_moves, last_move, checked = n_rounds[keep], n_moves[keep], last_move[keep], checked[keep]
+            replicas.keep(keep)
+        if len(ids) == 0:
+            break
+
+        n_rounds += 1
+        rows = np.arange(len(ids))
+
+        # sample a node with chips with uniform distribution
+        node = replicas.items[rows, (rng.random(len(ids)) * replicas.count).astype(np.int64)]
+
+        # choose an arrow among the ones whose out node has chips: arrows of
+        # node are drawn uniformly until one is a candidate, a few times, then
+        # the remaining replicas choose among the candidates of the padded table
+        first_arrow = arrow_ptr[node]
+        arrow = np.full(len(ids), -1)
+        pending = np.flatnonzero(replicas.candidates[rows, node] > 0)
+        for _ in range(REJECTION_TRIES):
+            drawn = first_arrow[pending] + (rng.random(len(pending)) * degree[node[pending]]).astype(np.int64)
+            ok = c[pending, arrow_out_node[drawn]] > 0
+            arrow[pending[ok]] = drawn[ok]
+            pending = pending[~ok]
+        if len(pending):
+            out_nodes = arrows.out_node[node[pending]]
+            candidates = arrows.valid[node[pending]] & (c[pending[:, None], out_nodes] > 0)
+            slot = _nth_true(candidates, (rng.random(len(pending)) * candidates.sum(axis=1)).astype(np.int64))
+            arrow[pending] = first_arrow[pending] + slot
+
+        # reject if there are no candidates, or if out_node is node with a single chip
+        out_node = arrow_out_node[arrow]
+        move = (arrow >= 0) & ((out_node != node) | (c[rows, node] >= 2))
+        r, node, arrow, out_node = rows[move], node[move], arrow[move], out_node[move]
+        neighbor = arrow_neighbor[arrow]
+        out_neighbor = arrow_out_neighbor[arrow]
+        paired = out_neighbor >= 0
+
+        # move_chips: every replica appears once in each update
+        for rr, nodes, delta in ((r, node, -1), (r, neighbor, 1),
+                                 (r[paired], out_node[paired], -1), (r[paired], out_neighbor[paired], 1)):
+            c[rr, nodes] += delta
+            changed = c[rr, nodes] == (0 if delta < 0 else 1)
+            if delta < 0:
+                replicas.remove(rr[changed], nodes[changed])
+            else:
+                replicas.add(rr[changed], nodes[changed])
+            n_not_segregated[rr] += delta * inside[nodes]
+
+        n_moves[r] += 1
+        last_move[r] = n_rounds[r]
+        checked[r] = False
+
+    return Ensemble_Result(rounds=rounds, moves=moves, chips=chips, reasons=reasons)
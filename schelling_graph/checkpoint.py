@@ -0,0 +1,98 @@
+import json
+import os
+import numpy as np
+from schelling_graph.rng import Random_Stream
+from schelling_graph.trajectory import Trajectory_Writer
+
+FORMAT = "schelling_graph checkpoint"
+VERSION = 1
+
+
+def save_checkpoint(graph, path: str, run=None):
+    """Write the state of graph (and of run, a Run_State, if given) to path.
+
+    The checkpoint holds the chips vector, the order of the occupied-node
+    index, the state of the random generator and of its stream, the counters
+    of run and, if run streams its trajectory to a file, the position reached
+    in that file. The topology is not stored: it is referenced by the
+    fingerprint of the compiled graph, which must match on resume. The file
+    is written next to path and renamed, so an interrupted save leaves the
+    previous checkpoint intact.
+    """
+    stream = graph._stream
+    seed_seq = graph._seed_seq
+    meta = {
+        "format": FORMAT,
+        "version": VERSION,
+        "topology": graph.compile().fingerprint,
+        "bit_generator": stream.generator.bit_generator.state,
+        "stream_block": stream.block,
+        "stream_pos": stream._pos,
+        "seed_seq": {
+            "entropy": seed_seq.entropy,
+            "spawn_key": list(seed_seq.spawn_key),
+            "pool_size": seed_seq.pool_size,
+            "n_children_spawned": seed_seq.n_children_spawned,
+        },
+        "round_count": 0,
+        "n_moves": 0,
+        "last_move_round": 0,
+        "record_to": None,
+    }
+    if run is not None:
+        meta["round_count"] = run.round_count
+        meta["n_moves"] = run.n_moves
+        meta["last_move_round"] = run.last_move_round
+        if isinstance(run.trajectory, Trajectory_Writer):
+            offset, n_written = run.trajectory.cursor()
+            meta["record_to"] = {"path": os.path.abspath(run.trajectory.path),
+                                 "offset": offset, "n_moves": n_written}
+
+    tmp = f"{path}.tmp"
+    with open(tmp, 'wb') as f:
+        np.savez(f,
+                 meta=np.frombuffer(json.dumps(meta, default=np.ndarray.tolist).encode(), dtype=np.uint8),
+                 chips=graph.chips_array,
+                 occupied=np.array(graph._occupied.items, dtype=np.int64),
+                 stream_buffer=np.array(stream._buffer, dtype=np.float64))
+    os.replace(tmp, path)
+
+
+def load_checkpoint(path: str) -> dict:
+    """Read a checkpoint written by save_checkpoint.
+
+    Returns its metadata, with the arrays chips, occupied and stream_buffer.
+    """
+    with np.load(path, allow_pickle=False) as data:
+        checkpoint = json.loads(data["meta"].tobytes().decode())
+        assert checkpoint.get("format") == FORMAT, f"{path} is not a schelling_graph checkpoint."
+        for key in ("chips", "occupied", "stream_buffer"):
+            checkpoint[key] = data[key]
+    return checkpoint
+
+
+def restore_checkpoint(graph, checkpoint: dict):
+    """Put graph in the state of checkpoint (see load_checkpoint).
+
+    The topology of graph must be the one the checkpoint was saved from.
+    """
+    assert checkpoint["topology"] == graph.compile().fingerprint, \
+        "The checkpoint was saved from a graph with a different topology."
+
+    graph.untrack_enabled_moves()
+    graph._assign_chips(checkpoint["chips"])
+    # the order of the occupied index determines the nodes sampled next
+    graph._occupied.reset(checkpoint["occupied"].tolist())
+    graph.last_result = None
+
+    state = checkpoint["bit_generator"]
+    bit_generator = getattr(np.random, state["bit_generator"])()
+    bit_generator.state = state
+    seed_seq = checkpoint["seed_seq"]
+    graph._seed_seq = np.random.SeedSequence(seed_seq["entropy"], spawn_key=tuple(seed_seq["spawn_key"]),
+                                             pool_size=seed_seq["pool_size"],
+                                             n_children_spawned=seed_seq["n_children_spawned"])
+    graph.rng = np.random.Generator(bit_generator)
+    graph._stream = Random_Stream(graph.rng, checkpoint["stream_block"])
+    graph._stream._buffer = checkpoint["stream_buffer"].tolist()
+    graph._stream._pos = checkpoint["stream_pos"]
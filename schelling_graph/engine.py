@@ -0,0 +1,503 @@
+from array import array
+import hashlib
+from itertools import compress
+import math
+from operator import itemgetter
+import time
+import numpy as np
+from schelling_graph.instrument import NO_CANDIDATES, SELF_REJECTED
+from schelling_graph.stopping import Run_State
+from schelling_graph.structures import Sum_Tree
+
+# arrow lists up to this length are filtered in Python rather than with numpy
+SHORT_ARROW_LIST = 32
+
+
+class Compiled_Graph:
+    """Flat integer-array representation of the topology of a Schelling_Graph.
+
+    Nodes are identified by their position in graph.nodes. Arrows are stored in
+    CSR layout: the arrows of node i are the entries arrow_ptr[i]:arrow_ptr[i+1]
+    of the arrow_* arrays, in the same order as node.arrows.
+    """
+
+    def __init__(self, graph, arrows: tuple | None = None):
+        """arrows is the (arrow_ptr, arrow_neighbor, arrow_out_node) table of
+        graph if it is already known (e.g. read from a file, see graph_file)."""
+        nodes = graph.nodes
+        n = self.n_nodes = len(nodes)
+        self.shape = graph.shape
+        self.x = graph._coords.x
+        self.y = graph._coords.y
+        # color code of each node in graph.palette
+        self.color = np.array([node._color_code for node in nodes], dtype=np.int64)
+
+        if arrows is None:
+            ptr = np.cumsum([0] + [len(node.arrows) for node in nodes], dtype=np.int64)
+            neighbor = np.array([a.neighbor._index for node in nodes for a in node.arrows], dtype=np.int64)
+            out_node = np.array([a.out_edge_node._index for node in nodes for a in node.arrows], dtype=np.int64)
+        else:
+            ptr, neighbor, out_node = (np.asarray(a, dtype=np.int64) for a in arrows)
+        self.arrow_ptr = ptr
+        self.arrow_source = np.repeat(np.arange(n, dtype=np.int64), np.diff(ptr))
+        self.arrow_neighbor = neighbor
+        self.arrow_out_node = out_node
+
+        # first arrow of each node for a given color, used to pair the moves:
+        # the arrow of out_node with the same color as the source node, -1 if
+        # out_node has none (in that case only half of the move is done)
+        n_colors = int(self.color.max()) + 1 if n else 1
+        keys, first = np.unique(self.arrow_source * n_colors + self.color[out_node], return_index=True)
+        wanted = out_node * n_colors + self.color[self.arrow_source]
+        pos = np.minimum(np.searchsorted(keys, wanted), max(len(keys) - 1, 0))
+        found = keys[pos] == wanted if len(keys) else np.zeros(len(wanted), dtype=bool)
+        self.arrow_out_arrow = np.where(found, first[pos] if len(keys) else -1, -1).astype(np.int64)
+        self.arrow_out_neighbor = np.where(
+            self.arrow_out_arrow >= 0,
+            self.arrow_neighbor[self.arrow_out_arrow] if len(neighbor) else -1,
+            -1)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        # rebuilt on first use, see candidate_arrows
+        state.pop('_filters', None)
+        return state
+
+    @property
+    def n_arrows(self) -> int:
+        return len(self.arrow_neighbor)
+
+    def candidate_arrows(self, node: int, values, chips: np.ndarray):
+        """Indices of the arrows of node whose out_edge_node has chips, in order.
+
+        values and chips are the chips of the nodes, as an array('q') and a
+        numpy view of it: short arrow lists are filtered in Python on values,
+        long ones with numpy on chips.
+        """
+        if not hasattr(self, '_filters'):
+            ptr = self.arrow_ptr.tolist()
+            out_node = self.arrow_out_node.tolist()
+            # per node, its arrows and either a function returning the chips of
+            # their out nodes (padded to a tuple of at least 2 items), or the
+            # out nodes as an array
+            self._filters = [
+                (range(lo, hi), itemgetter(*(out_node[lo:hi] + [0, 0])[:max(hi - lo, 2)]))
+                if hi - lo <= SHORT_ARROW_LIST else (lo, self.arrow_out_node[lo:hi])
+                for lo, hi in zip(ptr, ptr[1:])]
+        arrows, out_chips = self._filters[node]
+        if isinstance(arrows, range):
+            return list(compress(arrows, out_chips(values)))
+        return ((chips[out_chips] > 0).nonzero()[0] + arrows).tolist()
+
+    @property
+    def fingerprint(self) -> str:
+        """Hash of the topology, used to check that saved states belong to it."""
+        if not hasattr(self, '_fingerprint'):
+            h = hashlib.sha1()
+            for a in (self.x, self.y, self.arrow_ptr, self.arrow_neighbor, self.arrow_out_node,
+                      self.arrow_out_neighbor):
+                h.update(np.ascontiguousarray(a, dtype='<i8').tobytes())
+            self._fingerprint = h.hexdigest()
+        return self._fingerprint
+
+    def enabled_arrows(self, chips: np.ndarray, arrows: np.ndarray | None = None) -> np.ndarray:
+        """Mask of the arrows (all of them, or the indices arrows) along which
+        a round can end with a move, for each chips vector (last axis of chips)."""
+        src = self.arrow_source if arrows is None else self.arrow_source[arrows]
+        out = self.arrow_out_node if arrows is None else self.arrow_out_node[arrows]
+        enabled = (chips[..., src] > 0) & (chips[..., out] > 0)
+        enabled &= (out != src) | (chips[..., src] > 1)
+        return enabled
+
+
+class Enabled_Moves:
+    """Incrementally maintained weights of the moves enabled by a chips vector.
+
+    With the sampling rule of run_round (a node with chips, then an arrow whose
+    out_edge_node has chips, both uniformly), a round on node i ends with a
+    move with probability weight[i]: the fraction of the candidate arrows of i
+    that are not rejected. n_enabled counts the nodes with a positive weight;
+    the weights are also kept in a Sum_Tree, to sample a node in proportion to
+    its weight. chips is the chips array of the graph, chips_changed must be
+    called after every update of it. values is the array('q') of which chips
+    is a view, if there is one: the updates of single nodes read it, and keep
+    candidates and weight in arrays of which they are views, as the scalar
+    accesses are faster there than on numpy.
+    """
+
+    def __init__(self, compiled: Compiled_Graph, chips: np.ndarray, values=None):
+        n = compiled.n_nodes
+        source = compiled.arrow_source
+        out_node = compiled.arrow_out_node
+        self.chips = chips
+        self.values = chips if values is None else values
+
+        # number of arrows of each node whose out_edge_node is the node itself
+        self.n_self_arrows = np.bincount(
+            source[out_node == source], minlength=n)
+        self._n_self_arrows = self.n_self_arrows.tolist()
+
+        # for every out node, the sources of its arrows with their multiplicity
+        keys, counts = np.unique(out_node * n + source, return_counts=True)
+        self.rev_ptr = np.searchsorted(keys // n, np.arange(n + 1))
+        self.rev_source = keys % n
+        self.rev_count = counts
+        # the same as lists for the out nodes with few sources, updated in
+        # Python, None for the others, updated with numpy
+        ptr = self.rev_ptr.tolist()
+        self._short_rev = [
+            (self.rev_source[lo:hi].tolist(), self.rev_count[lo:hi].tolist())
+            if hi - lo < SHORT_ARROW_LIST else None
+            for lo, hi in zip(ptr, ptr[1:])]
+
+        self._candidate_values = array('q', np.bincount(
+            source, weights=chips[out_node] > 0, minlength=n).astype(np.int64).tobytes())
+        self.candidates = np.frombuffer(self._candidate_values, dtype=np.int64)
+        self._weight_values = array('d', self._weights(np.arange(n)).tobytes())
+        self.weight = np.frombuffer(self._weight_values)
+        self.n_enabled = int(np.count_nonzero(self.weight))
+        self.tree = Sum_Tree(self.weight)
+
+    def _weights(self, nodes: np.ndarray) -> np.ndarray:
+        """Weights of nodes, from their chips and candidate arrows."""
+        chips = self.chips[nodes]
+        candidates = self.candidates[nodes]
+        # the self arrows of a node are rejected when it has a single chip
+        valid = candidates - np.where(chips == 1, self.n_self_arrows[nodes], 0)
+        return np.where((chips > 0) & (candidates > 0),
+                        valid / np.maximum(candidates, 1), 0.0)
+
+    def _update(self, nodes: np.ndarray):
+        """Recompute the weights of nodes (sorted, without duplicates)."""
+        weight = self._weights(nodes)
+        self.n_enabled += int(np.count_nonzero(weight)) - \
+            int(np.count_nonzero(self.weight[nodes]))
+        self.weight[nodes] = weight
+        self.tree.set_many(nodes, weight)
+
+    def _update_node(self, node: int):
+        chips = self.values[node]
+        candidates = self._candidate_values[node]
+        if chips > 0 and candidates > 0:
+            valid = candidates - (self._n_self_arrows[node] if chips == 1 else 0)
+            weight = valid / candidates
+        else:
+            weight = 0.0
+        self.n_enabled += (weight > 0) - (self._weight_values[node] > 0)
+        self._weight_values[node] = weight
+        self.tree.set(node, weight)
+
+    def chips_changed(self, node: int, old: int, new: int):
+        if (old > 0) == (new > 0):
+            self._update_node(node)
+            return
+        short = self._short_rev[node]
+        if short is not None:
+            candidates = self._candidate_values
+            sources, counts = short
+            sign = 1 if new > 0 else -1
+            for i, count in zip(sources, counts):
+                candidates[i] += sign * count
+        else:
+            lo, hi = self.rev_ptr[node], self.rev_ptr[node+1]
+            sources = self.rev_source[lo:hi]
+            if new > 0:
+                self.candidates[sources] += self.rev_count[lo:hi]
+            else:
+                self.candidates[sources] -= self.rev_count[lo:hi]
+        # node is among the sources if it has self arrows
+        if self._n_self_arrows[node] == 0:
+            self._update_node(node)
+        if short is not None:
+            for i in sources:
+                self._update_node(i)
+        else:
+            self._update(sources)
+
+    @property
+    def total(self) -> float:
+        return self.tree.total
+
+    def sample(self, u: float) -> int:
+        """Node of the next move for u uniform in [0, 1), given that there is one."""
+        return self.tree.find(u * self.tree.total)
+
+
+def _items(a: np.ndarray) -> memoryview:
+    """int64 view of a whose items are read as Python ints, without the copy of
+    tolist, which costs more than short runs on large graphs."""
+    return np.ascontiguousarray(a, dtype=np.int64).data
+
+
+def run_rounds_array(graph, run: Run_State):
+    """Run rounds of the simulation on the compiled arrays of graph.
+
+    Follows the same transition rules and draws from the random stream of the
+    graph in the same way as run_round, so it gives the same trajectory.
+
+    The loop does not go through the nodes or _set_node_chips: it updates the
+    chips array, the occupied index and the segregation counter of the graph
+    in place, and reads the uniform doubles directly from the block of the
+    random stream, so they are all up to date whenever the stop conditions
+    are evaluated. The candidate arrows of a node only change when a node
+    gains its first chip or loses its last one, so they are kept per node
+    until the occupied index changes. With stats, the instrumented loop of
+    _run_rounds_array_stats is used instead.
+
+    Every round is still a step of this Python loop, which bounds the gain
+    over run_round: about 3 times on the 10 node example graph and 4 to 9
+    times on triangular graphs of size 10 to 40 (benchmarks/suite.py). Going
+    further would take a compiled loop (e.g. numba) over the same arrays,
+    with the random doubles of the stream passed in blocks.
+    """
+    if run.stats is not None:
+        return _run_rounds_array_stats(graph, run, run.stats)
+    compiled = graph.compile()
+
+    candidate_arrows = compiled.candidate_arrows
+    arrow_neighbor = _items(compiled.arrow_neighbor)
+    arrow_out_node = _items(compiled.arrow_out_node)
+    arrow_out_neighbor = _items(compiled.arrow_out_neighbor)
+
+    values = graph._chip_values
+    chips = graph._chips
+    occupied = graph._occupied
+    items, pos = occupied.items, occupied.pos
+    inside = graph._not_segregated
+    stream = graph._stream
+    generator, block = stream.generator, stream.block
+    buffer, k = stream._buffer, stream._pos
+    should_stop = run.should_stop
+    moved = run.moved
+
+    # candidate arrows of each node, valid while occupied.changes == stamp[node]
+    n = len(values)
+    cache = [None] * n
+    stamp = [-1] * n
+
+    while True:
+        stream._pos = k
+        if should_stop():
+            break
+        run.round_count += 1
+        changes = occupied.changes
+
+        if k == len(buffer):
+            buffer = stream._buffer = generator.random(block).tolist()
+            k = 0
+        node = items[int(buffer[k] * len(items))]
+        k += 1
+        if stamp[node] == changes:
+            candidates = cache[node]
+        else:
+            candidates = cache[node] = candidate_arrows(node, values, chips)
+            stamp[node] = changes
+        if not candidates:
+            continue
+
+        if k == len(buffer):
+            buffer = stream._buffer = generator.random(block).tolist()
+            k = 0
+        arrow = candidates[int(buffer[k] * len(candidates))]
+        k += 1
+        out_node = arrow_out_node[arrow]
+        if out_node == node and values[node] < 2:
+            continue
+
+        # the chips move in the order of move_chips, which determines the
+        # order of the occupied index
+        neighbor = arrow_neighbor[arrow]
+        out_neighbor = arrow_out_neighbor[arrow]
+        c = values[node] - 1
+        values[node] = c
+        if c == 0:
+            i = pos[node]
+            last = items.pop()
+            if last != node:
+                items[i] = last
+                pos[last] = i
+            pos[node] = -1
+            occupied.changes += 1
+        c = values[neighbor] + 1
+        values[neighbor] = c
+        if c == 1:
+            pos[neighbor] = len(items)
+            items.append(neighbor)
+            occupied.changes += 1
+        segregation = inside[neighbor] - inside[node]
+        if out_neighbor >= 0:
+            c = values[out_node] - 1
+            values[out_node] = c
+            if c == 0:
+                i = pos[out_node]
+                last = items.pop()
+                if last != out_node:
+                    items[i] = last
+                    pos[last] = i
+                pos[out_node] = -1
+                occupied.changes += 1
+            c = values[out_neighbor] + 1
+            values[out_neighbor] = c
+            if c == 1:
+                pos[out_neighbor] = len(items)
+                items.append(out_neighbor)
+                occupied.changes += 1
+            segregation += inside[out_neighbor] - inside[out_node]
+        else:
+            out_node = -1
+        if segregation:
+            graph._n_not_segregated += segregation
+        moves = graph._enabled_moves
+        if moves is not None:
+            _enabled_moves_changed(moves, values, node, neighbor, out_node, out_neighbor)
+        moved(node, neighbor, out_node, out_neighbor)
+
+    return run.finish()
+
+
+def _enabled_moves_changed(moves: Enabled_Moves, values, *nodes: int):
+    """Update moves after a move of run_rounds_array, nodes are its four nodes
+    in the order of move_chips (the last two -1 if only half of it was done)."""
+    for i, delta in zip(nodes, (-1, 1, -1, 1)):
+        if i >= 0:
+            moves.chips_changed(i, values[i] - delta, values[i])
+
+
+def _run_rounds_array_stats(graph, run: Run_State, stats):
+    """run_rounds_array with the phases of the rounds timed in stats."""
+    compiled = graph.compile()
+
+    ptr = _items(compiled.arrow_ptr)
+    arrow_neighbor = _items(compiled.arrow_neighbor)
+    arrow_out_node = _items(compiled.arrow_out_node)
+    arrow_out_neighbor = _items(compiled.arrow_out_neighbor)
+
+    values = graph._chip_values
+    set_chips = graph._set_node_chips
+    occupied = graph._occupied.items
+
+    def add(i, delta):
+        set_chips(i, values[i] + delta)
+
+    clock = time.perf_counter
+    randbelow = graph._stream.below
+    while not run.should_stop():
+        run.round_count += 1
+        t = clock()
+
+        node = occupied[randbelow(len(occupied))]
+        t = stats.lap("sample", t)
+        candidates = [a for a in range(ptr[node], ptr[node+1]) if values[arrow_out_node[a]] > 0]
+        if len(candidates) == 0:
+            stats.lap("candidates", t)
+            stats.count_idle(NO_CANDIDATES)
+            continue
+
+        arrow = candidates[randbelow(len(candidates))]
+        out_node = arrow_out_node[arrow]
+        if out_node == node and values[node] < 2:
+            stats.lap("candidates", t)
+            stats.count_idle(SELF_REJECTED)
+            continue
+        t = stats.lap("candidates", t)
+
+        _move(run, stats, add, node, arrow_neighbor[arrow], out_node, arrow_out_neighbor[arrow], t)
+
+    return run.finish()
+
+
+def _move(run: Run_State, stats, add, node: int, neighbor: int, out_node: int, out_neighbor: int, t):
+    """Move the chips of a move and record it, timing both with stats."""
+    add(node, -1)
+    add(neighbor, 1)
+    if out_neighbor >= 0:
+        add(out_node, -1)
+        add(out_neighbor, 1)
+    else:
+        out_node = -1
+    if stats is not None:
+        t = stats.lap("move", t)
+    run.moved(node, neighbor, out_node, out_neighbor)
+    if stats is not None:
+        t = stats.lap("record", t)
+        if out_node < 0:
+            stats.half_moves += 1
+    return t
+
+
+def run_rounds_kmc(graph, run: Run_State):
+    """Rejection-free version of run_rounds_array.
+
+    Instead of sampling rounds that may be idle, the move of the next
+    successful round is sampled directly, with the probabilities it has under
+    run_round. The number of idle rounds before it follows the geometric
+    distribution with success probability Enabled_Moves.total / number of
+    occupied nodes, so the round counts and the idle runs are statistically
+    the same as with the other engines, but the trajectory is not. Stop
+    conditions are evaluated after each move, and at the round given by
+    Run_State.stop_round during idle rounds.
+
+    It is meant for runs in which most rounds are idle: a move that empties a
+    node or occupies an empty one changes the weights of all the sources of
+    arrows pointing to it (hundreds of nodes on the triangular graphs of size
+    20 and more), so on runs in which most rounds are moves it does fewer
+    moves per second than run_rounds_array, whose rounds cost the same moving
+    or not.
+    """
+    compiled = graph.compile()
+
+    candidate_arrows = compiled.candidate_arrows
+    arrow_neighbor = _items(compiled.arrow_neighbor)
+    arrow_out_node = _items(compiled.arrow_out_node)
+    arrow_out_neighbor = _items(compiled.arrow_out_neighbor)
+
+    occupied = graph._occupied.items
+    # updated by set_chips
+    moves = graph.track_enabled_moves()
+    chips = graph._chips
+    values = graph._chip_values
+    set_chips = graph._set_node_chips
+
+    def add(i, delta):
+        set_chips(i, values[i] + delta)
+
+    stats = run.stats
+    clock = time.perf_counter
+    t = 0.0
+    uniform = graph._stream.random
+    while not run.should_stop():
+        if stats is not None:
+            t = clock()
+        p = moves.total / len(occupied) if len(occupied) > 0 else 0.0
+
+        # idle rounds before the next move
+        if p <= 0:
+            idle = math.inf
+        elif p < 1:
+            idle = math.floor(math.log(1.0 - uniform()) / math.log1p(-p))
+        else:
+            idle = 0
+        stop_round = run.stop_round()
+        if run.round_count + idle >= stop_round:
+            if stats is not None:
+                stats.lap("sample", t)
+                stats.skipped_rounds += stop_round - run.round_count
+            run.round_count = stop_round
+            continue
+        run.round_count += idle + 1
+
+        node = moves.sample(uniform())
+        if stats is not None:
+            t = stats.lap("sample", t)
+            stats.skipped_rounds += idle
+        candidates = candidate_arrows(node, values, chips)
+        if values[node] < 2:
+            candidates = [a for a in candidates if arrow_out_node[a] != node]
+        arrow = candidates[int(uniform() * len(candidates))]
+        if stats is not None:
+            t = stats.lap("candidates", t)
+
+        t = _move(run, stats, add, node, arrow_neighbor[arrow], arrow_out_node[arrow],
+                  arrow_out_neighbor[arrow], t)
+
+    return run.finish()
@@ -0,0 +1,137 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable
+import numpy as np
+from schelling_graph.graph import Schelling_Graph
+from schelling_graph.stopping import Segregated, Stop_Condition
+
+# graph of the worker process, received once by _init_worker
+_worker_graph: Schelling_Graph | None = None
+_worker_chips: np.ndarray | None = None
+
+
+class Ensemble_Result:
+    """Summaries of the replicas of run_ensemble, in replica order.
+
+    rounds: number of rounds of each replica
+    moves: number of successful moves of each replica
+    chips: final chips vector of each replica, shape (n_replicas, n_nodes)
+    reasons: why each replica stopped
+    """
+
+    def __init__(self, rounds: np.ndarray, moves: np.ndarray, chips: np.ndarray, reasons: list[str]):
+        self.rounds = rounds
+        self.moves = moves
+        self.chips = chips
+        self.reasons = reasons
+
+    def reason_counts(self) -> dict[str, int]:
+        counts = {}
+        for r in self.reasons:
+            counts[r] = counts.get(r, 0) + 1
+        return counts
+
+    def __len__(self):
+        return len(self.rounds)
+
+    def __repr__(self):
+        return f"Ensemble_Result with {len(self)} replicas, mean rounds {self.rounds.mean():.1f}."
+
+
+class _Method_Condition(Stop_Condition):
+    """Calls a method of the replica graph, like is_segregated."""
+
+    def __init__(self, name: str):
+        self.name = name
+
+    def check(self, graph, run):
+        return getattr(graph, self.name)()
+
+
+def _portable_stop_when(graph, stop_when):
+    """Replace the bound methods of graph in stop_when by the same methods of
+    the replicas, and graph.is_segregated by Segregated (same reason in every engine)."""
+    if isinstance(stop_when, (list, tuple)):
+        return [_portable_stop_when(graph, s) for s in stop_when]
+    if getattr(stop_when, '__self__', None) is graph:
+        if stop_when.__name__ == "is_segregated":
+            return Segregated()
+        return _Method_Condition(stop_when.__name__)
+    return stop_when
+
+
+def _init_worker(graph: Schelling_Graph):
+    global _worker_graph, _worker_chips
+    _worker_graph = graph
+    _worker_chips = graph.chips_array.copy()
+    # the replicas share the topology, compile it once per worker
+    graph.compile()
+
+
+def _run_replicas(task):
+    replicas, init, stop_when, max_rounds, engine = task
+    g = _worker_graph
+    results = []
+    for replica, seed in replicas:
+        g.seed(seed)
+        g.set_chips(_worker_chips.copy())
+        if init is not None:
+            init(g)
+        result = g.run_rounds(stop_when=stop_when, max_rounds=max_rounds,
+                              engine=engine, record=False)
+        results.append((replica, result.rounds, result.n_moves,
+                        g.chips_array.copy(), result.reason))
+    return results
+
+
+def run_ensemble(graph: Schelling_Graph, n_replicas: int, init: Callable | None = None, stop_when=None,
+                 max_rounds: int = 1000, engine: str = "array", workers: int | None = None,
+                 seed: int | None = None, chunksize: int | None = None) -> Ensemble_Result:
+    """Run n_replicas independent simulations of graph over a pool of processes.
+
+    Every replica starts from the chips of graph, then init(replica_graph) is
+    called, if given (e.g. functools.partial(Schelling_Graph.init_chips_uniform, min=0, max=3)).
+    init and stop_when must be picklable; the methods of graph itself (like
+    graph.is_segregated) are evaluated on the replicas. The graph is sent once
+    to each worker. Each replica gets its own random generator, spawned from
+    seed or, if seed is None, from graph (see Schelling_Graph.spawn_seeds), so
+    the result does not depend on the number of workers.
+
+    workers is the number of processes (default: number of CPUs), with
+    workers=1 the replicas run in this process.
+    """
+    workers = workers or os.cpu_count() or 1
+    stop_when = _portable_stop_when(graph, stop_when)
+
+    if seed is None:
+        seeds = graph.spawn_seeds(n_replicas)
+    else:
+        seeds = np.random.SeedSequence(seed).spawn(n_replicas)
+    if chunksize is None:
+        chunksize = max(1, n_replicas // (4 * workers))
+    replicas = list(enumerate(seeds))
+    tasks = [(replicas[i:i+chunksize], init, stop_when, max_rounds, engine)
+             for i in range(0, n_replicas, chunksize)]
+
+    # the replicas run on a copy, which also leaves out the state of past runs
+    # the replicas are seeded, the copy does not need a stream of its own
+    topology = graph.copy(same_stream=True)
+    if workers == 1:
+        global _worker_graph, _worker_chips
+        _init_worker(topology)
+        try:
+            results = [r for task in tasks for r in _run_replicas(task)]
+        finally:
+            # do not keep the copy alive in this process
+            _worker_graph = _worker_chips = None
+    else:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(topology,)) as pool:
+            results = [r for chunk in pool.map(_run_replicas, tasks) for r in chunk]
+
+    results.sort(key=lambda r: r[0])
+    return Ensemble_Result(
+        rounds=np.array([r[1] for r in results], dtype=np.int64),
+        moves=np.array([r[2] for r in results], dtype=np.int64),
+        chips=np.array([r[3] for r in results], dtype=np.int64).reshape(
+            n_replicas, len(graph.nodes)),
+        reasons=[r[4] for r in results])
@@ -0,0 +1,172 @@
+import numpy as np
+
+
+class Exact_Result:
+    """Exact outcome of the simulation of a graph, from every reachable chips vector.
+
+    states: (n_states, n_nodes) array of the chips vectors reachable from the
+        initial one, which is states[0]
+    stopped: states where run_rounds stops: no move is possible or, with
+        stop_on_segregated, the graph is segregated
+    segregated: segregated states (chips only on the x=0 or y=0 boundary)
+    p_segregated: probability, from each state, of stopping in a segregated state
+    p_stuck: probability of stopping in a state that is not segregated
+    p_never: probability of never stopping (the chips cycle forever)
+    expected_rounds: expected number of rounds before stopping, inf from the
+        states with p_never > 0
+    transitions: sparse matrix of the probabilities of going from state i to
+        state j in one round (the stopped states have none)
+    """
+
+    def __init__(self, states: np.ndarray, stopped: np.ndarray, segregated: np.ndarray,
+                 p_segregated: np.ndarray, p_stuck: np.ndarray, expected_rounds: np.ndarray, transitions):
+        self.states = states
+        self.stopped = stopped
+        self.segregated = segregated
+        self.p_segregated = p_segregated
+        self.p_stuck = p_stuck
+        self.p_never = np.clip(1.0 - p_segregated - p_stuck, 0.0, 1.0)
+        self.expected_rounds = expected_rounds
+        self.transitions = transitions
+        self._index = {s: i for i, s in enumerate(map(tuple, states.tolist()))}
+
+    def __len__(self):
+        return len(self.states)
+
+    def index(self, chips) -> int:
+        """Index of the state with chips vector chips, KeyError if it is not reachable."""
+        return self._index[tuple(np.asarray(chips).tolist())]
+
+    def at(self, chips) -> dict:
+        """Outcome from the state chips: p_segregated, p_stuck, p_never and expected_rounds."""
+        i = self.index(chips)
+        return {"p_segregated": float(self.p_segregated[i]), "p_stuck": float(self.p_stuck[i]),
+                "p_never": float(self.p_never[i]), "expected_rounds": float(self.expected_rounds[i])}
+
+    def __repr__(self):
+        return (f"Exact_Result with {len(self)} states: P(segregated) = {self.p_segregated[0]:.6g}, "
+                f"expected rounds = {self.expected_rounds[0]:.6g}.")
+
+
+def _transitions(compiled, chips: tuple) -> dict[tuple, float]:
+    """Chips vectors after one round from chips and their probabilities, as in run_round."""
+    ptr, out_node, neighbor, out_neighbor = compiled
+    occupied = [i for i, c in enumerate(chips) if c > 0]
+    result = {}
+    for node in occupied:
+        arrows = [a for a in range(ptr[node], ptr[node + 1]) if chips[out_node[a]] > 0]
+        if not arrows:
+            result[chips] = result.get(chips, 0.0) + 1 / len(occupied)
+            continue
+        p = 1 / (len(occupied) * len(arrows))
+        for a in arrows:
+            o = out_node[a]
+            if o == node and chips[node] < 2:
+                after = chips
+            else:
+                moved = list(chips)
+                moved[node] -= 1
+                moved[neighbor[a]] += 1
+                if out_neighbor[a] >= 0:
+                    moved[o] -= 1
+                    moved[out_neighbor[a]] += 1
+                after = tuple(moved)
+            result[after] = result.get(after, 0.0) + p
+    return result
+
+
+def _can_reach(adjacency, targets: np.ndarray) -> np.ndarray:
+    """States from which one of targets can be reached (adjacency[i, j] != 0 for a transition i -> j)."""
+    reach = targets.copy()
+    while True:
+        new = reach | (adjacency @ reach.astype(np.float64) > 0)
+        if (new == reach).all():
+            return reach
+        reach = new
+
+
+def solve_exact(graph, stop_on_segregated: bool = True, max_states: int = 100_000) -> Exact_Result:
+    """Solve exactly the Markov chain of the chips of graph, from its current chips.
+
+    The chips vectors reachable from the current one are enumerated with the
+    transition rules of run_round, up to the states where run_rounds(stop_when=
+    graph.is_segregated) stops (with stop_on_segregated, otherwise only the
+    states without enabled moves stop the simulation). The absorption
+    probabilities and the expected number of rounds are the solutions of
+    sparse linear systems (this needs scipy). A ValueError is raised when more
+    than max_states states are reachable.
+    """
+    from scipy import sparse
+    from scipy.sparse.linalg import spsolve
+
+    compiled = graph.compile()
+    arrays = (compiled.arrow_ptr.tolist(), compiled.arrow_out_node.tolist(),
+              compiled.arrow_neighbor.tolist(), compiled.arrow_out_neighbor.tolist())
+    inside = [bool(v) for v in (compiled.x != 0) & (compiled.y != 0)]
+
+    start = tuple(graph.chips_array.tolist())
+    index = {start: 0}
+    states = [start]
+    rows, cols, probs = [], [], []
+    stopped, segregated = [], []
+    i = 0
+    while i < len(states):
+        chips = states[i]
+        is_segregated = not any(c > 0 and inside_ for c, inside_ in zip(chips, inside))
+        segregated.append(is_segregated)
+        moves = _transitions(arrays, chips) if not (stop_on_segregated and is_segregated) else {}
+        # no enabled move: every round is idle
+        stops = not moves or moves.get(chips, 0.0) >= 1.0 - 1e-12
+        stopped.append(stops)
+        if not stops:
+            for after, p in moves.items():
+                j = index.get(after)
+                if j is None:
+                    j = index[after] = len(states)
+                    states.append(after)
+                    if len(states) > max_states:
+                        raise ValueError(f"More than {max_states} chips states are reachable, "
+                                         f"increase max_states to solve this graph.")
+                rows.append(i)
+                cols.append(j)
+                probs.append(p)
+        i += 1
+
+    n = len(states)
+    stopped = np.array(stopped)
+    segregated = np.array(segregated)
+    P = sparse.csr_matrix((probs, (rows, cols)), shape=(n, n))
+    transient = np.flatnonzero(~stopped)
+
+    # states that can stop, and those that can end up cycling forever
+    adjacency = P.copy()
+    adjacency.setdiag(0)
+    adjacency.eliminate_zeros()
+    can_stop = _can_reach(adjacency, stopped)
+    can_cycle = _can_reach(adjacency, ~can_stop)
+
+    p_segregated = (stopped & segregated).astype(np.float64)
+    p_stuck = (stopped & ~segregated).astype(np.float64)
+    expected_rounds = np.where(stopped, 0.0, np.inf)
+
+    # P(stop in a set) = P[i, :] @ P(stop in the set), on the states that can stop
+    solvable = transient[can_stop[transient]]
+    if len(solvable):
+        Q = P[solvable][:, solvable]
+        to_stopped = P[solvable][:, stopped]
+        system = (sparse.identity(len(solvable)) - Q).tocsc()
+        rhs = np.column_stack([to_stopped @ segregated[stopped].astype(np.float64),
+                               to_stopped @ (~segregated[stopped]).astype(np.float64)])
+        solution = spsolve(system, rhs).reshape(len(solvable), 2)
+        p_segregated[solvable] = solution[:, 0]
+        p_stuck[solvable] = solution[:, 1]
+
+    # expected rounds = 1 + P[i, :] @ expected rounds, finite where the chips can not cycle forever
+    finite = transient[~can_cycle[transient]]
+    if len(finite):
+        Q = P[finite][:, finite]
+        system = (sparse.identity(len(finite)) - Q).tocsc()
+        expected_rounds[finite] = spsolve(system, np.ones(len(finite)))
+
+    return Exact_Result(np.array(states, dtype=np.int64).reshape(n, len(start)), stopped, segregated,
+                        p_segregated, p_stuck, expected_rounds, P)
@@ -1,82 +1,275 @@
 
-from typing import Callable, MutableSequence, Sequence, Tuple, Type
+from array import array
+import copy
+import time
+from typing import MutableSequence, Tuple
 import numpy as np
-import random
-from matplotlib import pyplot as plt
-from schelling_graph.visualization import _draw_graph, _draw_matrix, animate_chips_matrices
-from schelling_graph.structures import Schelling_Node
-from schelling_graph.tools import create_vertex_matrix, get_nodes_by_color, node_matrix_2_int_matrix
-import termcolor as tc
+from schelling_graph.structures import Coordinate_Index, Occupied_Index, Palette, Schelling_Arrow, Schelling_Node
+from schelling_graph.tools import create_vertex_matrix, get_nodes_by_color
+from schelling_graph.engine import Compiled_Graph, Enabled_Moves, run_rounds_array, run_rounds_kmc
+from schelling_graph.instrument import NO_CANDIDATES, SELF_REJECTED, Run_Stats
+from schelling_graph.stopping import Run_State
+from schelling_graph.trajectory import Run_Result
+from schelling_graph.rng import Random_Stream, seed_sequence_of
+from schelling_graph.checkpoint import load_checkpoint, restore_checkpoint, save_checkpoint
+from schelling_graph.graph_file import load_graph, save_graph
+from schelling_graph.exact import Exact_Result, solve_exact
+from schelling_graph.meanfield import run_mean_field
 
 
 class Schelling_Graph:
-    def __init__(self, nodes: list[Schelling_Node]):
+    def __init__(self, nodes: list[Schelling_Node], seed=None):
+        """seed (None, an int, a SeedSequence or a numpy Generator) seeds the
+        random generator used by every random operation on the graph."""
+        shared = [n for n in nodes if n._graph is not None]
+        assert not shared, f"The node at ({shared[0].x}, {shared[0].y}) already belongs to a graph, " \
+            "use the copy() of that graph to build another one."
         self.nodes = nodes
-        self.matrix: np.ndarray[Schelling_Node] = create_vertex_matrix(  # type: ignore
-            nodes)  # type: ignore
+        # node index by coordinates, see get_node
+        self._coords = Coordinate_Index([n.x for n in nodes], [n.y for n in nodes])
 
         self.nbc = get_nodes_by_color(nodes)
-        self._animation_frames = []
+        # the colors of the nodes are interned once, the simulations compare codes
+        self.palette = Palette(self.nbc)
+
+        # chips of every node, node.chips reads and writes this array, _chips
+        # is a numpy view of it (the scalar accesses are faster on the array)
+        self._chip_values = array('q', [n.chips for n in nodes])
+        self._chips = np.frombuffer(self._chip_values, dtype=np.int64) if nodes \
+            else np.zeros(0, dtype=np.int64)
+        # kept up to date by _set_node_chips:
+        # the index of the nodes with chips, the number of chips off the
+        # x=0/y=0 boundary and, when tracked, the enabled moves
+        inside = (self._coords.x != 0) & (self._coords.y != 0)
+        self._not_segregated: list[bool] = inside.tolist()
+        self._occupied = Occupied_Index(len(nodes))
+        self._occupied.reset(np.flatnonzero(self._chips > 0).tolist())
+        self._n_not_segregated = int(self._chips[inside].sum())
+        self._enabled_moves: Enabled_Moves | None = None
+        self._compiled: Compiled_Graph | None = None
+        # (arrow_ptr, arrow_neighbor, arrow_out_node) of the arrows added in
+        # bulk (see add_arrow_table), None once they are Schelling_Arrow objects
+        self._arrow_table: tuple[np.ndarray, np.ndarray, np.ndarray] | None = None
+        # first arrow of each node for each color code, set by freeze and
+        # filled on first use (see _arrows_by_color)
+        self._arrow_by_color: list[dict[int, Schelling_Arrow] | None] | None = None
+        self.last_result: Run_Result | None = None  # result of the last simulation
+        self.seed(seed)
+        for i, node in enumerate(nodes):
+            node._graph = self
+            node._index = i
+            node._color_code = self.palette.code(node.color)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        # views of _chip_values, rebuilt by __setstate__
+        del state['_chips']
+        state['_enabled_moves'] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._chips = np.frombuffer(self._chip_values, dtype=np.int64) if self.nodes \
+            else np.zeros(0, dtype=np.int64)
+
+    def _set_node_chips(self, i: int, new: int):
+        """Set the chips of node i, used by the chips setter of the nodes and the engines."""
+        values = self._chip_values
+        old = values[i]
+        values[i] = new
+        if old <= 0 < new:
+            self._occupied.add(i)
+        elif new <= 0 < old:
+            self._occupied.remove(i)
+        if self._not_segregated[i]:
+            self._n_not_segregated += new - old
+        if self._enabled_moves is not None:
+            self._enabled_moves.chips_changed(i, old, new)
+
+    def _set_node_color(self, i: int, color: str):
+        assert not self.frozen, "The graph is frozen, call unfreeze() before changing its colors."
+        node = self.nodes[i]
+        node._color_code = self.palette.code(color)
+        node._color = color
+        self.nbc = get_nodes_by_color(self.nodes)
+        self._topology_changed()
+
+    def seed(self, seed=None):
+        """Reset the random generator of the graph (see __init__)."""
+        self._seed_seq = seed_sequence_of(seed)
+        self.rng = seed if isinstance(
+            seed, np.random.Generator) else np.random.default_rng(self._seed_seq)
+        # scalar draws of the simulation loops
+        self._stream = Random_Stream(self.rng)
+
+    def spawn_seeds(self, n: int) -> list[np.random.SeedSequence]:
+        """Return n independent seeds, e.g. for replicas of this graph."""
+        return self._seed_seq.spawn(n)
+
+    def spawn(self, n: int) -> list[np.random.Generator]:
+        """Return n independent random generators, e.g. for replicas of this graph."""
+        return [np.random.default_rng(s) for s in self.spawn_seeds(n)]
+
+    def sample_node_with_chips(self) -> Schelling_Node:
+        """Return a node with chips, chosen uniformly at random."""
+        return self.nodes[self._occupied.sample(self._stream)]
+
+    @property
+    def shape(self) -> tuple[int, int]:
+        """Shape of the matrices indexed by node coordinates, like chips_matrix."""
+        return self._coords.shape
+
+    @property
+    def matrix(self) -> np.ndarray:
+        """Matrix of the nodes indexed by their coordinates (0 where there is no node)."""
+        return create_vertex_matrix(self.nodes)
 
     @property
     def chips_matrix(self) -> np.ndarray:
-        return node_matrix_2_int_matrix(self.matrix)
+        return self._coords.scatter(self._chips)
 
     @property
     def nodes_with_chips(self) -> list[Schelling_Node]:
-        return [n for n in self.nodes if n.chips > 0]
+        return [self.nodes[i] for i in np.flatnonzero(self._chips > 0).tolist()]
 
     @property
     def chips(self) -> list[int]:
-        return [n.chips for n in self.nodes]
+        return self._chips.tolist()
+
+    @property
+    def chips_array(self) -> np.ndarray:
+        """Read-only view of the chips of the nodes, in the order of self.nodes."""
+        view = self._chips.view()
+        view.flags.writeable = False
+        return view
 
     def add_arrow(self, from_node: Schelling_Node, to_vertex: Schelling_Node, out_edge_node: Schelling_Node):
         from_node.add_arrow(to=to_vertex, out_edge_node=out_edge_node)
 
-    # def is_coherent(self) -> bool:
-    #     max_x = max(v.x for v in self.nodes)
-    #     max_y = max(v.y for v in self.nodes)
-    #     # A graph is coherent for all arrows if
-    #     # for very node n, all the nodes linked to the arrows originating from n
-    #     # have at least one arrow of the same color of n
-    #     # unless the neighbor is at the boundary (x=0, x=max_x, y=0, y=max_y)
-    #     for node in self.nodes:
-    #         for arrow in node.arrows:
-    #             neighbor = arrow.neighbor
-    #             if neighbor.x == max_x or neighbor.y == max_y:
-    #                 continue
-    #             for out_node in arrow.out_edge_nodes:
-    #                 if not any(a.color == node.color for a in out_node.arrows):
-    #                     print(
-    #                         f"Graph is not coherent at node ({node.x},{node.y}) with arrow to ({neighbor.x},{neighbor.y}) of color {arrow.color}")
-    #                     return False
-
-    #     return True
+    def coherence_issues(self) -> list[str]:
+        """Describe the arrows of the graph that can only move half of the chips.
+
+        A graph is coherent if, for every node n, the out_edge_node of every
+        arrow of n has at least one arrow of the color of n, unless the
+        neighbor of the arrow is at the boundary (x=max_x or y=max_y).
+        """
+        compiled = self.compile()
+        if compiled.n_arrows == 0:
+            return []
+        neighbor = compiled.arrow_neighbor
+        incoherent = (compiled.arrow_out_arrow < 0) & \
+            (compiled.x[neighbor] != compiled.x.max()) & (compiled.y[neighbor] != compiled.y.max())
+        issues = []
+        for a in np.flatnonzero(incoherent).tolist():
+            node = self.nodes[compiled.arrow_source[a]]
+            to = self.nodes[neighbor[a]]
+            out_node = self.nodes[compiled.arrow_out_node[a]]
+            issues.append(f"arrow ({node.x},{node.y}) --{out_node.color}--> ({to.x},{to.y}): out node "
+                          f"({out_node.x},{out_node.y}) has no arrow of color {node.color}")
+        return issues
+
+    def is_coherent(self) -> bool:
+        return len(self.coherence_issues()) == 0
+
+    @property
+    def frozen(self) -> bool:
+        return self._arrow_by_color is not None
+
+    def freeze(self, check: bool = True):
+        """Fix the topology of the graph and precompute the tables used by the simulations.
+
+        The graph is compiled once (see compile) and the out arrow of every
+        (node, color) pair is looked up in a table. If check is True, a
+        ValueError listing the incoherent arrows (see coherence_issues) is
+        raised instead. The arrows of a frozen graph can not be changed until
+        unfreeze is called.
+        """
+        self.unfreeze()
+        self.compile()
+        if check:
+            issues = self.coherence_issues()
+            if issues:
+                listed = "\n  ".join(issues[:20])
+                more = f"\n  ... and {len(issues) - 20} more" if len(issues) > 20 else ""
+                raise ValueError(f"Graph is not coherent, {len(issues)} arrows can only move half "
+                                 f"of the chips:\n  {listed}{more}")
+        self._freeze_arrows()
+
+    def _freeze_arrows(self):
+        self._arrow_by_color = [None] * len(self.nodes)
+        if self._arrow_table is None:
+            for node in self.nodes:
+                node._arrows = tuple(node._arrows)
+
+    def _arrows_by_color(self, i: int) -> dict[int, Schelling_Arrow]:
+        """First arrow of node i for each color code, on a frozen graph."""
+        by_color = self._arrow_by_color[i]
+        if by_color is None:
+            by_color = self._arrow_by_color[i] = {}
+            for arrow in self.nodes[i].arrows:
+                by_color.setdefault(arrow.out_edge_node._color_code, arrow)
+        return by_color
+
+    def unfreeze(self):
+        """Allow changing the arrows again, the precomputed tables are dropped."""
+        if not self.frozen:
+            return
+        if self._arrow_table is None:
+            for node in self.nodes:
+                node._arrows = list(node._arrows)
+        # the topology is unchanged, its compiled form is kept
+        self._arrow_by_color = None
+
+    def _set_arrow_table(self, table: tuple):
+        """Make the arrow table (arrow_ptr, arrow_neighbor, arrow_out_node) the arrows of the graph."""
+        self._arrow_table = table
+        for node in self.nodes:
+            node._arrows = None
+        self._topology_changed()
+
+    def _table_arrows(self, i: int) -> tuple[Schelling_Arrow, ...]:
+        """Schelling_Arrow objects of the arrows of node i in the arrow table."""
+        ptr, neighbor, out_node = self._arrow_table
+        lo, hi = int(ptr[i]), int(ptr[i + 1])
+        nodes = self.nodes
+        return tuple(Schelling_Arrow(nodes[j], nodes[k])
+                     for j, k in zip(neighbor[lo:hi].tolist(), out_node[lo:hi].tolist()))
+
+    def _detach_arrow_table(self):
+        """Turn the arrow table into lists of Schelling_Arrow objects, before an arrow is edited."""
+        if self._arrow_table is None:
+            return
+        for node in self.nodes:
+            node._arrows = list(node.arrows)
+        self._arrow_table = None
 
     def reset_chips(self):
-        for n in self.nodes:
-            n.chips = 0
-        self._animation_frames = []
+        self._assign_chips(0)
+        self.last_result = None
 
     def reset_arrows(self):
+        assert not self.frozen, "The graph is frozen, call unfreeze() before changing its arrows."
+        self._arrow_table = None
         for n in self.nodes:
-            n.arrows = []
+            n._arrows = []
+        self._topology_changed()
 
     def count_chips_not_segregated(self) -> int:
-        count = 0
-        for n in self.nodes_with_chips:
-            if n.x != 0 and n.y != 0:
-                count += n.chips
-        return count
+        return self._n_not_segregated
 
     def get_node(self, x: int, y: int) -> Schelling_Node:
-        return self.matrix[x][y]
+        i = self._coords.get(x, y)
+        if i < 0:
+            raise KeyError(f"No node at position {(x, y)}.")
+        return self.nodes[i]
 
     def __getitem__(self, idx) -> Schelling_Node:
         x, y = idx
-        return self.matrix[x][y]  # type: ignore
+        return self.get_node(x, y)
 
     def plot_all(self, show=True):
+        from matplotlib import pyplot as plt
+        from schelling_graph.visualization import _draw_graph, _draw_matrix
         fig, ax = plt.subplots(1, 2, figsize=(10, 5))
         _draw_graph(self.nodes, ax=ax[0])
         _draw_matrix(self.chips_matrix, ax=ax[1])
@@ -87,6 +280,8 @@ class Schelling_Graph:
         return fig, ax
 
     def plot_chips(self, show=True, ax=None):
+        from matplotlib import pyplot as plt
+        from schelling_graph.visualization import _draw_matrix
         fig = None
         if ax is None:
             fig, ax = plt.subplots(figsize=(5, 5))
@@ -96,6 +291,8 @@ class Schelling_Graph:
         return fig, ax
 
     def plot(self, show=True, ax=None):
+        from matplotlib import pyplot as plt
+        from schelling_graph.visualization import _draw_graph
         fig = None
         if ax is None:
             fig, ax = plt.subplots(figsize=(5, 5))
@@ -107,42 +304,213 @@ class Schelling_Graph:
     def run_one_round(self):
         run_round(self)
 
-    def run_rounds(self, stop_when: Callable = lambda: False, max_rounds: int = 1000):
-        idlecount = 0
-        round_count = 0
-        logs = []
-        self._animation_frames = []
-        while not stop_when() and round_count < max_rounds:
-            round_count += 1
-            done, s = run_round(self)
-            if not done:
-                idlecount += 1
+    def compile(self) -> Compiled_Graph:
+        """Return the flat integer-array representation of the graph topology.
+
+        It is computed once and kept until the arrows or the colors change
+        (through add_arrow, add_arrow_table, auto_arrows, reset_arrows or an
+        assignment to node.arrows; edit the list node.arrows in place only on
+        a graph that was never compiled, or call _topology_changed after; the
+        arrows added by add_arrow_table are tuples, which can not be edited in
+        place). It is computed from the arrow table of the graph when there is
+        one. It only depends on the topology, so it can be shared by copies of
+        the graph.
+        """
+        if self._compiled is None:
+            self._compiled = Compiled_Graph(self, self._arrow_table)
+        return self._compiled
+
+    def _topology_changed(self):
+        """Drop the compiled topology and what depends on it."""
+        self._compiled = None
+        self._enabled_moves = None
+
+    def track_enabled_moves(self) -> Enabled_Moves:
+        """Start keeping the enabled moves up to date (see Enabled_Moves)."""
+        if self._enabled_moves is None:
+            self._enabled_moves = Enabled_Moves(self.compile(), self._chips, self._chip_values)
+        return self._enabled_moves
+
+    def untrack_enabled_moves(self):
+        self._enabled_moves = None
+
+    def has_enabled_moves(self) -> bool:
+        """Check if at least one round can end with a move."""
+        moves = self._enabled_moves
+        if moves is None:
+            return bool(self.compile().enabled_arrows(self._chips).any())
+        return moves.n_enabled > 0
+
+    def run_rounds(self, stop_when=None, max_rounds: int = 1000, engine: str = "python", stop_on_absorbing: bool = True,
+                   record: bool = True, keyframe_every: int = 1000, record_to: str | None = None,
+                   resume_from: str | None = None, stats: bool = False) -> Run_Result:
+        """Run rounds of the simulation until stop_when is satisfied or max_rounds is reached.
+
+        stop_when is a function without arguments (like self.is_segregated), a
+        Stop_Condition (see the stopping module) or a list of them. Unless
+        stop_on_absorbing is False, the simulation also stops as soon as no
+        move is possible. The returned Run_Result tells why the simulation
+        stopped and, if record is True, holds the Trajectory of the run, with
+        a keyframe every keyframe_every moves. With record_to, the trajectory
+        is streamed to that file instead of kept in memory, and returned as a
+        memory-mapped Trajectory_File.
+
+        resume_from is the path of a checkpoint (see save_checkpoint): the
+        graph is put back in its state and the run continues from it, with the
+        same random trajectory as the run that saved it.
+
+        With stats, the engine counts the idle rounds by cause and times each
+        phase of the rounds, in the Run_Stats of the result (result.stats).
+        Without it, the rounds are not instrumented at all. To follow a run
+        while it goes, add a Callback(fn, rounds=n) to stop_when.
+
+        engine selects the implementation: "python" walks the node objects,
+        "array" runs on the compiled arrays of the graph (see Compiled_Graph):
+        it gives the same trajectory, a few times faster (see
+        run_rounds_array). "kmc" is the rejection-free
+        version of "array": it samples the next move directly and draws the
+        number of idle rounds before it, which is much faster when most
+        rounds are idle (sparse chips, states close to absorbing). It gives
+        the same statistics, not the same trajectory. Each of its moves
+        reweights the nodes whose candidate arrows changed, so on runs where
+        most rounds are moves "array" is faster.
+        """
+        assert engine in ("python", "array", "kmc"), \
+            f"Unknown engine '{engine}', expected 'python', 'array' or 'kmc'."
+
+        # the topology can not change during a run
+        self.compile()
+        run = None
+        try:
+            checkpoint = None
+            if resume_from is not None:
+                checkpoint = load_checkpoint(resume_from)
+                restore_checkpoint(self, checkpoint)
+            run = Run_State(self, stop_when, max_rounds, stop_on_absorbing, record=record,
+                            keyframe_every=keyframe_every, record_to=record_to, checkpoint=checkpoint,
+                            stats=stats)
+            if engine == "array":
+                result = run_rounds_array(self, run)
+            elif engine == "kmc":
+                result = run_rounds_kmc(self, run)
             else:
-                if idlecount > 0:
-                    logs.append(
-                        f"Idle ({idlecount} round{'s' if idlecount > 1 else ''}).")
-                    idlecount = 0
-                logs.append(s)
-                self._animation_frames.append(self.chips_matrix.copy())
+                result = self._run_rounds_python(run)
+        except BaseException:
+            if run is not None:
+                # keep the moves recorded so far in record_to
+                run.finish()
+            raise
+        self.last_result = result
+        return result
+
+    def save(self, path: str):
+        """Save the nodes, chips and arrows of the graph to path, in a binary
+        format that Schelling_Graph.load reads back (see graph_file)."""
+        save_graph(self, path)
+
+    @staticmethod
+    def load(path: str, seed=None) -> 'Schelling_Graph':
+        """Load a graph saved by save, with its arrows; seed as in Schelling_Graph()."""
+        return load_graph(path, seed)
+
+    def solve_exact(self, stop_on_segregated: bool = True, max_states: int = 100_000) -> Exact_Result:
+        """Exact probability of segregation and expected number of rounds of the
+        simulation from the current chips, for small graphs (see exact.solve_exact)."""
+        return solve_exact(self, stop_on_segregated, max_states)
+
+    def run_mean_field(self, max_rounds: int = 1000, densities: np.ndarray | None = None, **kwargs) -> Run_Result:
+        """Deterministic run of the expected chips of the nodes, from densities
+        (default: the current chips), for comparison with run_rounds (see
+        meanfield.run_mean_field). The chips are not changed; the result is
+        kept in last_result, so animate shows the expected chips."""
+        self.last_result = run_mean_field(self, max_rounds, densities, **kwargs)
+        return self.last_result
+
+    def save_checkpoint(self, path: str, run: Run_State | None = None):
+        """Save the chips and the random state of the graph to path.
+
+        With run, the Run_State of a simulation in progress (stop conditions
+        receive it, see the Checkpoint condition), its round counters and the
+        position of its trajectory file are saved too. The topology is only
+        referenced: the checkpoint can be resumed on this graph or a copy.
+        """
+        save_checkpoint(self, path, run)
+
+    def resume(self, path: str, **kwargs) -> Run_Result:
+        """Continue the simulation saved in the checkpoint path.
+
+        kwargs are the arguments of run_rounds, max_rounds counts the rounds
+        done before the checkpoint.
+        """
+        return self.run_rounds(resume_from=path, **kwargs)
+
+    def _run_rounds_python(self, run: Run_State) -> Run_Result:
+        stats = run.stats
+        if stats is not None:
+            return self._run_rounds_python_stats(run, stats)
+        while not run.should_stop():
+            run.round_count += 1
+            done, move = run_round(self)
+            if done:
+                run.moved(*move)
+
+        return run.finish()
+
+    def _run_rounds_python_stats(self, run: Run_State, stats: Run_Stats) -> Run_Result:
+        while not run.should_stop():
+            run.round_count += 1
+            done, move = run_round(self, stats)
+            if done:
+                t = time.perf_counter()
+                run.moved(*move)
+                stats.lap("record", t)
+                if move[2] < 0:
+                    stats.half_moves += 1
+            else:
+                stats.count_idle(move)
 
-        return logs + [f"Condition satisfied, stopping simulation after {round_count} rounds."]
+        return run.finish()
 
-    def animate(self, interval=200, repeat_delay=1000):
+    def animate(self, interval=200, repeat_delay=1000, every: int = 1, labels: bool | None = None):
+        """Animate the chips after every move (or one move in every) of the last simulation."""
+        from schelling_graph.visualization import animate_chips_matrices
+        trajectory = self.last_result.trajectory if self.last_result is not None else None
         ani = animate_chips_matrices(
-            self._animation_frames, interval, repeat_delay)
+            trajectory.frames[::every] if trajectory is not None else [], interval, repeat_delay,
+            labels=labels)
         return ani
 
+    def export_animation(self, path: str, fps: int = 10, every: int = 1, **kwargs) -> str:
+        """Write the animation of the last simulation to a video or GIF file.
+
+        The frames are streamed to the writer (see visualization.export_animation).
+        """
+        from schelling_graph.visualization import export_animation
+        assert self.last_result is not None and self.last_result.trajectory is not None, \
+            "No trajectory available. Please run 'run_rounds()' with record=True before exporting."
+        return export_animation(self.last_result.trajectory.frames, path, fps=fps, every=every, **kwargs)
+
+    def _assign_chips(self, chips: np.ndarray):
+        """Set the chips of all the nodes at once, chips is aligned with self.nodes."""
+        self._chips[:] = chips
+        # the derived state is rebuilt at once
+        self._occupied.reset(np.flatnonzero(self._chips > 0).tolist())
+        self._n_not_segregated = int(
+            self._chips[(self._coords.x != 0) & (self._coords.y != 0)].sum())
+        if self._enabled_moves is not None:
+            self._enabled_moves = Enabled_Moves(self.compile(), self._chips, self._chip_values)
+
     def init_chips_uniform(self, min=0, max=5):
         """Initialize chips uniformly between a and b (inclusive)."""
-        chips = []
-        for n in self.nodes:
-            n.chips = random.randint(min, max)
-            chips.append(n.chips)
+        self._assign_chips(self.rng.integers(
+            min, max, size=len(self.nodes), endpoint=True))
 
-    def init_chips_multinomial(self, total_number_of_chips: int, probabilities: dict[Tuple[int, int], float]):
+    def init_chips_multinomial(self, total_number_of_chips: int, probabilities: dict[Tuple[int, int], float] | np.ndarray):
         """Initialize chips using a multinomial distribution with given probabilities.
 
-        probabilities is a dictionary mapping node coordinates (x,y) of the nodes to their probability.
+        probabilities is an array with the probability of every node, aligned
+        with self.nodes (see tools.node_multinomial_pvals), or a dictionary mapping
+        node coordinates (x,y) of the nodes to their probability.
         The length of probabilities must be equal to the number of nodes.
         The sum of probabilities must be 1.
         """
@@ -150,17 +518,23 @@ class Schelling_Graph:
         assert len(probabilities) == len(
             self.nodes), f"The length of pvals ({len(probabilities)}) must be equal to the number of nodes ({len(self.nodes)})."
 
-        coords = list(probabilities.keys())
-        pvals = list(probabilities.values())
-        chips = np.random.multinomial(n=total_number_of_chips, pvals=pvals)
+        if isinstance(probabilities, dict):
+            nodes = np.array([self._coords.get(x, y)
+                              for x, y in probabilities.keys()], dtype=np.int64)
+            assert (nodes >= 0).all(), "The keys of probabilities must be the coordinates of the nodes."
+            pvals = np.array(list(probabilities.values()), dtype=np.float64)
+        else:
+            nodes = np.arange(len(self.nodes))
+            pvals = np.asarray(probabilities, dtype=np.float64)
 
         assert abs(
-            sum(pvals) - 1.0) < 1e-8, f"The sum of pvals must be 1 (with precision > 1e-8), got {sum(pvals):.8f}."
+            pvals.sum() - 1.0) < 1e-8, f"The sum of pvals must be 1 (with precision > 1e-8), got {pvals.sum():.8f}."
+        # rounding errors within the precision would make numpy's multinomial reject the pvals
+        pvals = pvals / pvals.sum()
 
-        for i in range(len(coords)):
-            x, y = coords[i]
-            node = self.get_node(x, y)
-            node.chips = chips[i]
+        chips = np.zeros(len(self.nodes), dtype=np.int64)
+        chips[nodes] = self.rng.multinomial(n=total_number_of_chips, pvals=pvals)
+        self._assign_chips(chips)
 
     def set_chips(self, chips: MutableSequence[int], randomize: bool = False):
         """Initialize chips assigning values from the given list.
@@ -173,59 +547,91 @@ class Schelling_Graph:
             self.nodes), "The length of samples must be equal to the number of nodes"
 
         if randomize:
-            random.shuffle(chips)
+            self.rng.shuffle(chips)
 
-        for i, n in enumerate(self.nodes):
-            n.chips = chips[i]
+        self._assign_chips(np.asarray(chips))
 
     def is_segregated(self) -> bool:
         """Check if the graph is segregated.
         A graph is segregated if chips are only on boundary nodes (0,n) or (n,0).
         """
-        for n in self.nodes_with_chips:
-            if n.x != 0 and n.y != 0:
-                return False
-        return True
+        return self._n_not_segregated == 0
 
     def __repr__(self) -> str:
         return f"Schelling_Graph with {len(self.nodes)} nodes."
 
-    def copy(self):
-        """Create a deep copy of the graph."""
+    def copy(self, same_stream: bool = False):
+        """Create a deep copy of the graph.
+
+        The copy gets its own random generator, spawned from the seed of the
+        graph, so successive copies run independent simulations. With
+        same_stream, it continues the random stream of the graph from its
+        current state instead, and draws the same numbers (e.g. to compare two
+        engines on the same trajectory).
+        """
         node_map = {}
         new_nodes = []
         for node in self.nodes:
             new_node: Schelling_Node = Schelling_Node(
                 x=node.x, y=node.y, color=node.color)
-            new_node.chips = node.chips
             node_map[node] = new_node
             new_nodes.append(new_node)
 
         new_graph = Schelling_Graph(new_nodes)
-
-        for node in self.nodes:
-            new_node = node_map[node]
-            for arrow in node.arrows:
-                neighbor = node_map[arrow.neighbor]
-                out_edge_node = node_map[arrow.out_edge_node]
-                new_node.add_arrow(to=neighbor, out_edge_node=out_edge_node)
+        # same codes as this graph, they are in the shared compiled graph
+        new_graph.palette = Palette(self.palette.names)
+        for node, new_node in zip(self.nodes, new_nodes):
+            new_node._color_code = node._color_code
+        new_graph._assign_chips(self._chips)
+        # the order of the occupied index determines the nodes sampled next
+        new_graph._occupied.reset(self._occupied.items)
+        if same_stream:
+            new_graph._seed_seq = copy.deepcopy(self._seed_seq)
+            new_graph._stream = self._stream.copy()
+            new_graph.rng = new_graph._stream.generator
+        else:
+            new_graph.seed(self.spawn_seeds(1)[0])
+
+        if self._arrow_table is not None:
+            # the arrays of the table are never modified, they are shared
+            new_graph._set_arrow_table(self._arrow_table)
+        else:
+            for node in self.nodes:
+                new_node = node_map[node]
+                for arrow in node.arrows:
+                    neighbor = node_map[arrow.neighbor]
+                    out_edge_node = node_map[arrow.out_edge_node]
+                    new_node.add_arrow(to=neighbor, out_edge_node=out_edge_node)
+        new_graph._compiled = self._compiled
+        if self.frozen:
+            new_graph._freeze_arrows()
 
         return new_graph
 
 
 def move_chips(node, arrow, out_node):
-    """Move chips from node to arrow.neighbor and from out_node to out_arrow.neighbor"""
+    """Move chips from node to arrow.neighbor and from out_node to out_arrow.neighbor
+
+    Returns out_arrow, None if out_node has no arrow of the color of node (in
+    that case only the chip of node is moved).
+    """
     # move chip of node
     node.chips -= 1
     arrow.neighbor.chips += 1
 
     # chose an arrow from out_node with the same color as node
-    out_arrow = [v for v in out_node.arrows if v.color == node.color]
-    if len(out_arrow) == 0:
+    graph = out_node._graph
+    if graph is not None and graph.frozen:
+        by_color = graph._arrow_by_color[out_node._index]
+        if by_color is None:
+            by_color = graph._arrows_by_color(out_node._index)
+        out_arrow = by_color.get(node._color_code)
+    else:
+        out_arrow = next(
+            (v for v in out_node.arrows if v.color_code == node._color_code), None)
+    if out_arrow is None:
         # out_node must have exactly one arrow with the same color as node
-        return
-
-    out_arrow = out_arrow[0]
+        return None
 
     # move chip along the arrow
     out_node.chips -= 1
@@ -238,12 +644,24 @@ def move_chips(node, arrow, out_node):
     #      tc.colored(f" ---> ", out_arrow.color) +
     #      f"({out_arrow.neighbor.x},{out_arrow.neighbor.y}).")
 
-    return ""
+    return out_arrow
 
 
-def run_round(schelling_graph: Schelling_Graph):
-    # sample a node with uniform distribution, if it has no chips, sample again
-    node = random.choice(schelling_graph.nodes_with_chips)
+def run_round(schelling_graph: Schelling_Graph, stats: Run_Stats | None = None):
+    """Run one round of the simulation.
+
+    Returns (True, (source, destination, out_node, out_destination)) with the
+    indices of the nodes whose chips moved (-1 for the out nodes if only half
+    of the move was done), or (False, cause) with the cause of the idle round
+    (NO_CANDIDATES or SELF_REJECTED). With stats, the phases of the round
+    are timed in it.
+    """
+    if stats is not None:
+        t = time.perf_counter()
+    # sample a node with chips with uniform distribution
+    node = schelling_graph.sample_node_with_chips()
+    if stats is not None:
+        t = stats.lap("sample", t)
 
     # choose an arrow with uniform distribution
     # candidate arrows have out_nodes with chips > 0
@@ -251,9 +669,12 @@ def run_round(schelling_graph: Schelling_Graph):
 
     # assert len(candidate_arrows) > 0, "No candidate arrows with out_nodes having chips > 0"
     if len(candidate_arrows) == 0:
-        return (False, "idle")
+        if stats is not None:
+            stats.lap("candidates", t)
+        return (False, NO_CANDIDATES)
 
-    arrow = random.choice(candidate_arrows)
+    arrow = candidate_arrows[schelling_graph._stream.below(
+        len(candidate_arrows))]
 
     out_node = None
     if arrow.out_edge_node.chips > 0:
@@ -262,9 +683,15 @@ def run_round(schelling_graph: Schelling_Graph):
     # if out_node is the same as node and node has less than 2 chips, re-sample
     if out_node == node and node.chips < 2:
         out_node = None
+    if stats is not None:
+        t = stats.lap("candidates", t)
 
     if out_node is not None:
-        s = move_chips(node, arrow, out_node)
-        return (True, s)
-
-    return (False, "idle")
+        out_arrow = move_chips(node, arrow, out_node)
+        if stats is not None:
+            stats.lap("move", t)
+        if out_arrow is None:
+            return (True, (node._index, arrow.neighbor._index, -1, -1))
+        return (True, (node._index, arrow.neighbor._index, out_node._index, out_arrow.neighbor._index))
+
+    return (False, SELF_REJECTED)
@@ -0,0 +1,113 @@
+import json
+import os
+import struct
+import numpy as np
+from schelling_graph.structures import Schelling_Node
+
+# graph files: MAGIC, header length (uint64), JSON header, then the arrays,
+# each at an offset aligned to 8 bytes given by the header
+MAGIC = b"SGGRAPH1"
+FORMAT = "schelling_graph graph"
+VERSION = 1
+ALIGN = 8
+
+
+def _smallest_int(a: np.ndarray) -> str:
+    """Little-endian int32 if the values of a fit in it, int64 otherwise."""
+    if len(a) == 0 or (a.min() >= np.iinfo(np.int32).min and a.max() <= np.iinfo(np.int32).max):
+        return '<i4'
+    return '<i8'
+
+
+def save_graph(graph, path: str):
+    """Write the nodes, colors, chips and arrows of graph to path.
+
+    The arrows are stored as a table in CSR layout (see Compiled_Graph): the
+    arrows of node i are arrow_neighbor/arrow_out_node[arrow_ptr[i]:arrow_ptr[i+1]],
+    in the order of node.arrows. The colors are stored as codes in the palette
+    of the header. The file is written next to path and renamed.
+    """
+    nodes = graph.nodes
+    compiled = graph.compile()
+    arrays = {
+        "x": graph._coords.x,
+        "y": graph._coords.y,
+        "color": compiled.color,
+        "chips": graph.chips_array,
+        "arrow_ptr": compiled.arrow_ptr,
+        "arrow_neighbor": compiled.arrow_neighbor,
+        "arrow_out_node": compiled.arrow_out_node,
+    }
+    arrays = {name: a.astype(_smallest_int(a)) for name, a in arrays.items()}
+
+    # the offsets are relative to the end of the header
+    layout = {}
+    offset = 0
+    for name, a in arrays.items():
+        layout[name] = {"offset": offset, "dtype": a.dtype.str, "count": len(a)}
+        offset += -(-a.nbytes // ALIGN) * ALIGN
+    header = json.dumps({
+        "format": FORMAT,
+        "version": VERSION,
+        "n_nodes": len(nodes),
+        "n_arrows": compiled.n_arrows,
+        "palette": graph.palette.names,
+        "frozen": graph.frozen,
+        "arrays": layout,
+    }).encode()
+    header += b" " * (-(len(MAGIC) + 8 + len(header)) % ALIGN)
+
+    tmp = f"{path}.tmp"
+    with open(tmp, 'wb') as f:
+        f.write(MAGIC + struct.pack('<Q', len(header)) + header)
+        start = f.tell()
+        for name, a in arrays.items():
+            f.seek(start + layout[name]["offset"])
+            f.write(a.tobytes())
+        f.truncate(start + offset)
+    os.replace(tmp, path)
+
+
+def load_graph_arrays(path: str) -> tuple[dict, dict[str, np.ndarray]]:
+    """Header and arrays of a graph file written by save_graph.
+
+    The arrays are read-only memory maps of the file, in the integer type
+    they were stored with.
+    """
+    with open(path, 'rb') as f:
+        assert f.read(len(MAGIC)) == MAGIC, f"{path} is not a schelling_graph graph file."
+        (header_length,) = struct.unpack('<Q', f.read(8))
+        header = json.loads(f.read(header_length))
+        start = f.tell()
+    assert header.get("format") == FORMAT, f"{path} is not a schelling_graph graph file."
+    assert header["version"] <= VERSION, \
+        f"{path} was written by a newer version of schelling_graph (format {header['version']})."
+    arrays = {}
+    for name, spec in header["arrays"].items():
+        if spec["count"] == 0:
+            arrays[name] = np.zeros(0, dtype=spec["dtype"])
+        else:
+            arrays[name] = np.memmap(path, dtype=spec["dtype"], mode='r', offset=start + spec["offset"],
+                                     shape=(spec["count"],))
+    return header, arrays
+
+
+def load_graph(path: str, seed=None):
+    """Schelling_Graph saved to path by save_graph, frozen if it was frozen when saved."""
+    # graph imports this module
+    from schelling_graph.graph import Schelling_Graph
+
+    header, arrays = load_graph_arrays(path)
+    palette = header["palette"]
+    colors = [palette[c] for c in arrays["color"].tolist()]
+    nodes = [Schelling_Node(x=x, y=y, chips=c, color=color) for x, y, c, color in
+             zip(arrays["x"].tolist(), arrays["y"].tolist(), arrays["chips"].tolist(), colors)]
+    graph = Schelling_Graph(nodes, seed=seed)
+
+    # the arrows stay in the memory-mapped table, the graph is compiled from
+    # it and the arrow objects of a node are created when they are accessed
+    graph._set_arrow_table((arrays["arrow_ptr"], arrays["arrow_neighbor"], arrays["arrow_out_node"]))
+    if header["frozen"]:
+        # the graph was checked when it was frozen, it is compiled on first use
+        graph._freeze_arrows()
+    return graph
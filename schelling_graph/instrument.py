@@ -0,0 +1,83 @@
+import time
+
+# phases of a round, in the order the engines go through them
+PHASES = ("stop", "sample", "candidates", "move", "record")
+
+# causes of the idle rounds
+NO_CANDIDATES = "no candidate arrow"
+SELF_REJECTED = "self arrow with a single chip"
+
+
+class Run_Stats:
+    """Counters and timers of a simulation, filled in by the engines when
+    Schelling_Graph.run_rounds is called with stats=True.
+
+    seconds[phase] and calls[phase] are the time spent in each phase of the
+    rounds and the number of times it ran:
+        stop: evaluation of the stop conditions
+        sample: choice of the node (for "kmc", of the next move and of the
+            number of idle rounds before it)
+        candidates: filtering of the arrows of the node
+        move: update of the chips
+        record: recording of the move in the trajectory
+    idle[cause] counts the idle rounds by cause (NO_CANDIDATES or
+    SELF_REJECTED). The "kmc" engine does not sample the idle rounds, it
+    counts them in skipped_rounds. half_moves counts the moves in which the
+    out node had no arrow of the color of the node.
+    """
+
+    def __init__(self):
+        self.seconds = dict.fromkeys(PHASES, 0.0)
+        self.calls = dict.fromkeys(PHASES, 0)
+        self.idle = {NO_CANDIDATES: 0, SELF_REJECTED: 0}
+        self._last_idle: str | None = None
+        self.skipped_rounds = 0
+        self.half_moves = 0
+        self.rounds = 0
+        self.moves = 0
+        self.wall_seconds = 0.0
+
+    def count_idle(self, cause: str):
+        self.idle[cause] += 1
+        self._last_idle = cause
+
+    def uncount_idle(self):
+        """Forget the last idle round counted by count_idle."""
+        self.idle[self._last_idle] -= 1
+        self._last_idle = None
+
+    def lap(self, phase: str, t: float) -> float:
+        """Add the time elapsed since t to phase, return the current time."""
+        now = time.perf_counter()
+        self.seconds[phase] += now - t
+        self.calls[phase] += 1
+        return now
+
+    @property
+    def overhead_seconds(self) -> float:
+        """Time of the run outside the phases (the loop, and the timers themselves)."""
+        return self.wall_seconds - sum(self.seconds.values())
+
+    def as_dict(self) -> dict:
+        return {"rounds": self.rounds, "moves": self.moves, "half_moves": self.half_moves,
+                "idle": dict(self.idle), "skipped_rounds": self.skipped_rounds,
+                "seconds": dict(self.seconds), "calls": dict(self.calls),
+                "wall_seconds": self.wall_seconds}
+
+    def summary(self) -> str:
+        lines = [f"{self.rounds} rounds, {self.moves} moves ({self.half_moves} half) "
+                 f"in {self.wall_seconds:.3f} s"]
+        for cause, n in self.idle.items():
+            lines.append(f"  idle, {cause}: {n}")
+        if self.skipped_rounds:
+            lines.append(f"  idle, skipped: {self.skipped_rounds}")
+        for phase in PHASES:
+            seconds, calls = self.seconds[phase], self.calls[phase]
+            if calls:
+                share = seconds / self.wall_seconds if self.wall_seconds > 0 else 0.0
+                lines.append(f"  {phase:<10} {seconds:9.4f} s {share:6.1%} "
+                             f"{seconds / calls * 1e6:9.2f} us x {calls}")
+        return "\n".join(lines)
+
+    def __repr__(self):
+        return f"Run_Stats({self.rounds} rounds, {self.moves} moves, {self.wall_seconds:.3f} s)"
@@ -0,0 +1,190 @@
+import numpy as np
+from schelling_graph.structures import Coordinate_Index
+from schelling_graph.trajectory import Run_Result, Trajectory_Frames
+
+
+class Mean_Field_Trajectory:
+    """Expected chips of every node, recorded every few rounds by run_mean_field.
+
+    densities[i] is the expected chips vector at round rounds[i]. Like
+    Trajectory, it has chips(i), chips_matrix, chips_at_round and frames, so
+    the two can be compared or animated in the same way.
+    """
+
+    def __init__(self, x: np.ndarray, y: np.ndarray, shape: tuple, rounds: list[float], densities: list[np.ndarray]):
+        self.x = np.asarray(x)
+        self.y = np.asarray(y)
+        self.shape = tuple(shape)
+        self.rounds = np.array(rounds, dtype=np.float64)
+        self.densities = np.array(densities, dtype=np.float64).reshape(len(rounds), len(self.x))
+
+    def __len__(self):
+        return len(self.rounds)
+
+    def chips(self, i: int) -> np.ndarray:
+        """Expected chips vector of record i."""
+        return self.densities[i]
+
+    def chips_at_round(self, r: float) -> np.ndarray:
+        """Expected chips vector at round r, interpolated between the records."""
+        i = int(np.searchsorted(self.rounds, r, side='right'))
+        if i == 0:
+            return self.densities[0].copy()
+        if i == len(self):
+            return self.densities[-1].copy()
+        r0, r1 = self.rounds[i - 1], self.rounds[i]
+        t = (r - r0) / (r1 - r0)
+        return (1 - t) * self.densities[i - 1] + t * self.densities[i]
+
+    def chips_matrix(self, chips: np.ndarray) -> np.ndarray:
+        """Scatter an expected chips vector into a matrix indexed by node coordinates."""
+        if not hasattr(self, '_coords'):
+            self._coords = Coordinate_Index(self.x, self.y)
+        return self._coords.scatter(np.asarray(chips, dtype=np.float64))
+
+    @property
+    def frames(self) -> 'Mean_Field_Frames':
+        """Expected chips matrices of the records."""
+        return Mean_Field_Frames(self)
+
+
+class Mean_Field_Frames(Trajectory_Frames):
+    def __iter__(self):
+        t = self.trajectory
+        for i in self.indices:
+            yield t.chips_matrix(t.densities[i])
+
+
+def _occupancy(c: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """With Poisson chips of mean c: P(chips > 0) and P(chips > 1 | chips > 0)."""
+    occupied = -np.expm1(-c)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        two = np.where(c > 1e-12, 1 - c / np.expm1(np.maximum(c, 1e-12)), 0.0)
+    return occupied, np.clip(two, 0.0, 1.0)
+
+
+def _rates(compiled):
+    """Functions of the compiled graph: flows(c), the expected flow of chips
+    along each arrow in one round with expected chips c, and change(flow), the
+    change of the chips of every node under these flows."""
+    n = compiled.n_nodes
+    source = compiled.arrow_source
+    neighbor = compiled.arrow_neighbor
+    out_node = compiled.arrow_out_node
+    is_self = out_node == source
+    paired = compiled.arrow_out_neighbor >= 0
+    out_neighbor = compiled.arrow_out_neighbor[paired]
+    paired_out = out_node[paired]
+
+    def flows(c: np.ndarray) -> np.ndarray:
+        occupied, two = _occupancy(c)
+        n_occupied = occupied.sum()
+        if n_occupied <= 0:
+            return np.zeros(len(source))
+        # a node is chosen with the probability it has chips, an arrow with the
+        # probability its out node has chips (certain for the self arrows, the
+        # node has chips) among the arrows of the node
+        weight = np.where(is_self, 1.0, occupied[out_node])
+        total = np.bincount(source, weights=weight, minlength=n)
+        accept = np.where(is_self, two[source], 1.0)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return np.where(total[source] > 0,
+                            occupied[source] / n_occupied * weight / total[source] * accept, 0.0)
+
+    def loss(flow: np.ndarray) -> np.ndarray:
+        return np.bincount(source, weights=flow, minlength=n) + \
+            np.bincount(paired_out, weights=flow[paired], minlength=n)
+
+    def change(flow: np.ndarray) -> np.ndarray:
+        return np.bincount(neighbor, weights=flow, minlength=n) + \
+            np.bincount(out_neighbor, weights=flow[paired], minlength=n) - loss(flow)
+
+    def limit(flow: np.ndarray, c: np.ndarray) -> np.ndarray:
+        """flow scaled down on the arrows whose source or out node would lose
+        more than its chips c, so that the chips stay positive and their sum
+        is kept."""
+        lost = loss(flow)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            scale = np.where(lost > c, c / lost, 1.0)
+        return flow * np.minimum(scale[source], np.where(paired, scale[out_node], 1.0))
+
+    return flows, change, limit
+
+
+def run_mean_field(graph, max_rounds: int = 1000, densities: np.ndarray | None = None, step: float = 1.0,
+                   method: str = "rk4", record_every: float | None = None, stop_on_segregated: bool = True,
+                   segregated_below: float = 0.5, tolerance: float = 1e-9) -> Run_Result:
+    """Deterministic approximation of run_rounds for large numbers of chips.
+
+    Follows the expected chips of every node (densities, by default the chips
+    of graph, e.g. total * node_multinomial_pvals(graph, p, q) for a
+    multinomial initialization) under the move rule of run_round, on the
+    compiled topology of graph: the chips of each node are taken as
+    independent Poisson variables with these means, which gives the
+    probability that a node is chosen, that an arrow is a candidate and that a
+    self arrow is rejected, hence the expected flow of chips along each arrow
+    in one round. The densities are advanced step rounds at a time, with
+    method "rk4" (fourth-order Runge-Kutta) or "euler" (expected-update steps);
+    the flows out of a node are capped at its chips, so the total is kept.
+
+    The run stops when fewer than segregated_below chips are expected off the
+    x=0/y=0 boundary (with stop_on_segregated), when the densities change by
+    less than tolerance per round (stationary state), or after max_rounds.
+    Returns a Run_Result whose n_moves is the expected number of moves and
+    whose trajectory is a Mean_Field_Trajectory, recorded every record_every
+    rounds (default: every step). The chips of graph are not changed.
+    """
+    assert method in ("rk4", "euler"), f"Unknown method '{method}', expected 'rk4' or 'euler'."
+    assert step > 0, f"step must be positive, got {step}."
+    compiled = graph.compile()
+    flows, change, limit = _rates(compiled)
+    inside = (compiled.x != 0) & (compiled.y != 0)
+    c = np.array(graph.chips_array if densities is None else densities, dtype=np.float64)
+    assert c.shape == (compiled.n_nodes,), \
+        f"densities must have one value per node ({compiled.n_nodes}), got shape {c.shape}."
+    record_every = record_every or step
+
+    rounds = 0.0
+    n_steps = 0
+    n_moves = 0.0
+    recorded_rounds = [0.0]
+    recorded = [c.copy()]
+    next_record = record_every
+    reason = "maximum number of rounds reached"
+    while True:
+        if stop_on_segregated and c[inside].sum() < segregated_below:
+            reason = "graph segregated"
+            break
+        if rounds >= max_rounds:
+            break
+        # from the step count, the sum of fractional steps would drift
+        next_rounds = min((n_steps + 1) * step, max_rounds)
+        dt = next_rounds - rounds
+        f1 = flows(c)
+        if method == "euler":
+            flow = f1
+        else:
+            f2 = flows(c + change(limit(dt / 2 * f1, c)))
+            f3 = flows(c + change(limit(dt / 2 * f2, c)))
+            f4 = flows(c + change(limit(dt * f3, c)))
+            flow = (f1 + 2 * f2 + 2 * f3 + f4) / 6
+        if np.abs(change(flow)).max(initial=0.0) < tolerance:
+            reason = "stationary state"
+            break
+        # without the limit, a node out node of many arrows could lose more
+        # chips than it has in a step
+        flow = limit(dt * flow, c)
+        c = np.maximum(c + change(flow), 0)
+        rounds = next_rounds
+        n_steps += 1
+        n_moves += flow.sum()
+        if rounds >= next_record or rounds >= max_rounds:
+            recorded_rounds.append(rounds)
+            recorded.append(c.copy())
+            next_record = rounds + record_every
+
+    if recorded_rounds[-1] != rounds:
+        recorded_rounds.append(rounds)
+        recorded.append(c.copy())
+    trajectory = Mean_Field_Trajectory(compiled.x, compiled.y, compiled.shape, recorded_rounds, recorded)
+    return Run_Result(round(rounds), n_moves, reason, trajectory)
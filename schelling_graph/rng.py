@@ -0,0 +1,48 @@
+import copy
+import numpy as np
+
+
+def seed_sequence_of(seed) -> np.random.SeedSequence:
+    """SeedSequence of seed, which can be None, an int, a SeedSequence or a Generator."""
+    if isinstance(seed, np.random.SeedSequence):
+        return seed
+    if isinstance(seed, np.random.Generator):
+        bit_generator = seed.bit_generator
+        return getattr(bit_generator, 'seed_seq', None) or bit_generator._seed_seq
+    return np.random.SeedSequence(seed)
+
+
+class Random_Stream:
+    """Scalar random draws from a numpy Generator, for the simulation loops.
+
+    Drawing numbers one at a time from a Generator costs about a microsecond,
+    so uniform doubles are drawn in blocks and handed out one by one. All the
+    engines draw from the stream of the graph in the same way, so they follow
+    the same trajectory for the same seed.
+    """
+
+    def __init__(self, generator: np.random.Generator, block: int = 1024):
+        self.generator = generator
+        self.block = block
+        self._buffer: list[float] = []
+        self._pos = 0
+
+    def random(self) -> float:
+        """Uniform double in [0, 1)."""
+        if self._pos == len(self._buffer):
+            self._buffer = self.generator.random(self.block).tolist()
+            self._pos = 0
+        u = self._buffer[self._pos]
+        self._pos += 1
+        return u
+
+    def below(self, n: int) -> int:
+        """Uniform integer in [0, n)."""
+        return int(self.random() * n)
+
+    def copy(self) -> 'Random_Stream':
+        """Independent stream in the same state, it draws the same numbers as this one."""
+        stream = Random_Stream(copy.deepcopy(self.generator), self.block)
+        stream._buffer = self._buffer
+        stream._pos = self._pos
+        return stream
@@ -0,0 +1,322 @@
+import os
+import time
+from typing import Callable
+import numpy as np
+from schelling_graph.instrument import Run_Stats
+from schelling_graph.trajectory import Run_Result, Trajectory, Trajectory_Writer
+
+
+def _function_name(fn) -> str:
+    """Qualified name of fn, the same in every process (unlike its repr)."""
+    name = getattr(fn, '__qualname__', type(fn).__qualname__)
+    return f"{getattr(fn, '__module__', None)}.{name}"
+
+
+class Stop_Condition:
+    """Base class of the stop conditions of Schelling_Graph.run_rounds.
+
+    check is called before every round with the graph and the Run_State of the
+    simulation, and returns True when the simulation must stop. The built-in
+    conditions are incremental: check costs O(1).
+    """
+    reason: str = "condition satisfied"
+
+    def start(self, graph):
+        """Called once when a simulation starts."""
+        pass
+
+    def check(self, graph, run: 'Run_State') -> bool:
+        raise NotImplementedError
+
+    def stop_round(self, run: 'Run_State') -> int | None:
+        """Round at which the condition becomes true if no chip moves, None if unknown.
+
+        Used by the rejection-free engine, which skips idle rounds.
+        """
+        return None
+
+    def __repr__(self):
+        return f"{type(self).__name__}()"
+
+
+class Callable_Condition(Stop_Condition):
+    """Wraps a function without arguments, like graph.is_segregated."""
+
+    def __init__(self, fn: Callable[[], bool]):
+        self.fn = fn
+
+    def check(self, graph, run):
+        return self.fn()
+
+    def __repr__(self):
+        return f"Callable_Condition({_function_name(self.fn)})"
+
+
+class Segregated(Stop_Condition):
+    """Stop when all the chips are on the x=0 or y=0 boundary."""
+    reason = "graph segregated"
+
+    def check(self, graph, run):
+        return graph.is_segregated()
+
+
+class Absorbing(Stop_Condition):
+    """Stop when no move is possible: all the following rounds would be idle.
+
+    Such a state can only be entered by a move, and all the rounds after it
+    are idle, so the chips are checked at the start, then only after an idle
+    round (or at max_rounds) if they changed since the last check; the idle
+    round that revealed the state is not counted, in the rounds or in the
+    Run_Stats. A check first tries a few arrows found enabled by the last
+    full scan of the arrows. When the enabled moves are kept up to date (the
+    "kmc" engine), they are used instead.
+    """
+    reason = "no enabled move (absorbing state)"
+    n_witnesses = 64
+
+    def start(self, graph):
+        # number of moves of the run at the last check
+        self._checked_at = None
+        self._witnesses = None
+
+    def _has_enabled_moves(self, graph) -> bool:
+        compiled = graph.compile()
+        if self._witnesses is not None and compiled.enabled_arrows(graph._chips, self._witnesses).any():
+            return True
+        enabled = np.flatnonzero(compiled.enabled_arrows(graph._chips))
+        # spread over the arrows, so that one move does not disable them all
+        step = max(len(enabled) // self.n_witnesses, 1)
+        self._witnesses = enabled[::step]
+        return len(enabled) > 0
+
+    def check(self, graph, run):
+        if graph._enabled_moves is not None:
+            return not graph.has_enabled_moves()
+        first = self._checked_at is None
+        if not first:
+            if self._checked_at == run.n_moves:
+                return False
+            if run.round_count == run.last_move_round and run.round_count < run.max_rounds:
+                return False
+        self._checked_at = run.n_moves
+        if self._has_enabled_moves(graph):
+            return False
+        if not first and run.round_count > run.last_move_round:
+            # the state has been absorbing since the last move, the idle
+            # round that revealed it is not counted
+            run.round_count = run.last_move_round
+            if run.stats is not None:
+                run.stats.uncount_idle()
+        return True
+
+
+class No_Progress(Stop_Condition):
+    """Stop when no chip has moved in the last k rounds."""
+
+    def __init__(self, k: int):
+        self.k = k
+        self.reason = f"no move in {k} rounds"
+
+    def check(self, graph, run):
+        return run.round_count - run.last_move_round >= self.k
+
+    def stop_round(self, run):
+        return run.last_move_round + self.k
+
+    def __repr__(self):
+        return f"No_Progress({self.k})"
+
+
+class Time_Budget(Stop_Condition):
+    """Stop when the simulation has been running for more than seconds."""
+
+    def __init__(self, seconds: float):
+        self.seconds = seconds
+        self.reason = f"time budget of {seconds} s exhausted"
+
+    def check(self, graph, run):
+        return time.perf_counter() - run.start_time >= self.seconds
+
+    def __repr__(self):
+        return f"Time_Budget({self.seconds})"
+
+
+class Checkpoint(Stop_Condition):
+    """Never stops the simulation, saves a checkpoint of it to path every
+    rounds rounds and/or every seconds seconds (see Schelling_Graph.resume)."""
+
+    def __init__(self, path: str, rounds: int | None = None, seconds: float | None = None):
+        assert rounds is not None or seconds is not None, "Either rounds or seconds must be given."
+        self.path = path
+        self.rounds = rounds
+        self.seconds = seconds
+        self._next_round = None
+        self._next_time = None
+
+    def start(self, graph):
+        self._next_round = None
+        self._next_time = None
+
+    def check(self, graph, run):
+        if self._next_round is None:
+            self._next_round = run.round_count + (self.rounds or 0)
+            self._next_time = time.perf_counter() + (self.seconds or 0)
+        due = (self.rounds is not None and run.round_count >= self._next_round) or \
+            (self.seconds is not None and time.perf_counter() >= self._next_time)
+        if due:
+            graph.save_checkpoint(self.path, run)
+            self._next_round = run.round_count + (self.rounds or 0)
+            self._next_time = time.perf_counter() + (self.seconds or 0)
+        return False
+
+    def __repr__(self):
+        return f"Checkpoint({self.path!r}, rounds={self.rounds}, seconds={self.seconds})"
+
+
+class Callback(Stop_Condition):
+    """Never stops the simulation, calls fn(graph, run) every rounds rounds.
+
+    run is the Run_State of the simulation, with its counters and, if
+    run_rounds was called with stats=True, its Run_Stats in run.stats. With
+    the "kmc" engine, the idle rounds are skipped up to the next call.
+    """
+
+    def __init__(self, fn: Callable, rounds: int = 1):
+        assert rounds >= 1, f"rounds must be a positive integer, got {rounds}."
+        self.fn = fn
+        self.rounds = rounds
+        self._next_round = None
+
+    def start(self, graph):
+        self._next_round = None
+
+    def check(self, graph, run):
+        if self._next_round is None:
+            self._next_round = run.round_count + self.rounds
+        elif run.round_count >= self._next_round:
+            self.fn(graph, run)
+            self._next_round = run.round_count + self.rounds
+        return False
+
+    def stop_round(self, run):
+        return self._next_round
+
+    def __repr__(self):
+        return f"Callback({_function_name(self.fn)}, rounds={self.rounds})"
+
+
+def as_stop_conditions(stop_when) -> list[Stop_Condition]:
+    """Normalizes stop_when (None, a callable, a Stop_Condition or a sequence of them)."""
+    if stop_when is None:
+        return []
+    if isinstance(stop_when, Stop_Condition):
+        return [stop_when]
+    if isinstance(stop_when, (list, tuple)):
+        return [c for s in stop_when for c in as_stop_conditions(s)]
+    return [Callable_Condition(stop_when)]
+
+
+class Run_State:
+    """Progress of a simulation, shared by the engines and the stop conditions.
+
+    If record is True, the moves are recorded in a Trajectory, or streamed to
+    the file record_to if it is given. With checkpoint (see load_checkpoint),
+    the counters continue from the checkpoint and, if it was streaming its
+    trajectory to a file, the recording goes on in that file.
+    """
+
+    def __init__(self, graph, stop_when, max_rounds: int, stop_on_absorbing: bool = True,
+                 record: bool = True, keyframe_every: int = 1000, record_to: str | None = None,
+                 checkpoint: dict | None = None, stats: bool = False):
+        self.graph = graph
+        self.max_rounds = max_rounds
+        self.conditions = as_stop_conditions(stop_when)
+        if stop_on_absorbing and not any(isinstance(c, Absorbing) for c in self.conditions):
+            self.conditions.append(Absorbing())
+
+        self.round_count = 0
+        self.n_moves = 0
+        self.last_move_round = 0
+        self.reason = None
+        self.start_time = time.perf_counter()
+        self.stats = None
+        if stats:
+            self.stats = Run_Stats()
+            # replaces the method, so that runs without stats do not pay for the timer
+            self.should_stop = self._timed_should_stop
+
+        append_at = None
+        if checkpoint is not None:
+            self.round_count = checkpoint["round_count"]
+            self.n_moves = checkpoint["n_moves"]
+            self.last_move_round = checkpoint["last_move_round"]
+            recorded = checkpoint["record_to"]
+            if recorded is not None and (record_to is None or os.path.abspath(record_to) == recorded["path"]):
+                record_to = recorded["path"]
+                append_at = (recorded["offset"], recorded["n_moves"])
+        self._first_round = self.round_count
+        self._first_move = self.n_moves
+
+        self.trajectory = None
+        if record_to is not None:
+            compiled = graph.compile()
+            self.trajectory = Trajectory_Writer(record_to, graph.chips_array, compiled.x, compiled.y,
+                                                compiled.shape, keyframe_every=keyframe_every,
+                                                append_at=append_at)
+        elif record:
+            compiled = graph.compile()
+            self.trajectory = Trajectory(graph.chips_array, compiled.x, compiled.y, compiled.shape,
+                                         keyframe_every=keyframe_every)
+
+        self._tracking = graph._enabled_moves is not None
+        for c in self.conditions:
+            c.start(graph)
+
+    def should_stop(self) -> bool:
+        for c in self.conditions:
+            if c.check(self.graph, self):
+                self.reason = c.reason
+                return True
+        if self.round_count >= self.max_rounds:
+            self.reason = "maximum number of rounds reached"
+            return True
+        return False
+
+    def _timed_should_stop(self) -> bool:
+        t = time.perf_counter()
+        stop = Run_State.should_stop(self)
+        self.stats.lap("stop", t)
+        return stop
+
+    def stop_round(self) -> int:
+        """Round at which the simulation stops if no chip moves."""
+        rounds = [r for r in (c.stop_round(self) for c in self.conditions)
+                  if r is not None]
+        return min([self.max_rounds] + rounds)
+
+    def moved(self, source: int, destination: int, out_node: int, out_destination: int):
+        """Called by the engines after each move, with the indices of the nodes
+        (out_node and out_destination are -1 if only half of the move was done)."""
+        idle = self.round_count - self.last_move_round - 1
+        self.n_moves += 1
+        self.last_move_round = self.round_count
+        t = self.trajectory
+        if t is not None:
+            t.record(self.round_count, idle, source,
+                     destination, out_node, out_destination)
+            if self.n_moves % t.keyframe_every == 0:
+                t.add_keyframe(self.graph.chips_array)
+
+    def finish(self) -> Run_Result:
+        """Release the resources of the run and return its result."""
+        if not self._tracking:
+            self.graph.untrack_enabled_moves()
+        trajectory = self.trajectory
+        if isinstance(trajectory, Trajectory_Writer):
+            trajectory = trajectory.close()
+        stats = self.stats
+        if stats is not None:
+            stats.rounds = self.round_count - self._first_round
+            stats.moves = self.n_moves - self._first_move
+            stats.wall_seconds = time.perf_counter() - self.start_time
+        return Run_Result(self.round_count, self.n_moves, self.reason, trajectory, stats)
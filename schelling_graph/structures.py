@@ -1,41 +1,106 @@
-import random
-import string
-import matplotlib.colors as mcolors
+from array import array
+import itertools
+import numpy as np
 
-VALID_COLORS = tuple(mcolors.CSS4_COLORS.keys())
+
+def __getattr__(name):
+    # VALID_COLORS is loaded on first use, matplotlib is not needed by the simulations
+    if name == "VALID_COLORS":
+        import matplotlib.colors as mcolors
+        globals()["VALID_COLORS"] = tuple(mcolors.CSS4_COLORS.keys())
+        return globals()["VALID_COLORS"]
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 
 class Node():
-    def __init__(self, id=None):
-        # Generate a random ID if none is provided
-        self.id = id if id is not None else ''.join(
-            random.choices(string.ascii_letters + string.digits, k=8))
-        self.edges = []
+    __slots__ = ('id',)
+    # sequential ids of the nodes created without one
+    _next_id = itertools.count()
 
-    def add_edge(self, edge):
-        self.edges.append(edge)
+    def __init__(self, id=None):
+        self.id = id if id is not None else next(Node._next_id)
 
 
 class Schelling_Node(Node):
+    __slots__ = ('_graph', '_index', '_chips', '_arrows', 'x', 'y', '_color', '_color_code')
+
     def __init__(self, x: int, y: int, chips: int = 0, id=None, color: str = 'black'):
         super().__init__(id)
 
-        self.chips: int = chips  # Number of chips on the node
-        # List of arrows originating from this node
-        self.arrows: list[Schelling_Arrow] = []
+        self._graph = None  # Graph this node belongs to, set by Schelling_Graph
+        self._index: int = -1  # Position of this node in the graph's nodes list
+        # Number of chips on the node, until it belongs to a graph, which
+        # then holds the chips of all its nodes in one array
+        self._chips: int = chips
+        # List of arrows originating from this node (a tuple once the graph is
+        # frozen), None while they are only in the arrow table of the graph
+        self._arrows: list[Schelling_Arrow] | None = []
         self.x: int = x  # X position
         self.y: int = y  # Y position
-        self.color: str = color  # Color
+        self._color: str = color  # Color
+        # Code of the color in the palette of the graph, set by Schelling_Graph
+        self._color_code: int = -1
+
+    @property
+    def color(self) -> str:
+        return self._color
+
+    @color.setter
+    def color(self, value: str):
+        if self._graph is None:
+            self._color = value
+        else:
+            self._graph._set_node_color(self._index, value)
+
+    @property
+    def arrows(self) -> list['Schelling_Arrow']:
+        arrows = self._arrows
+        if arrows is None:
+            # the arrow objects are created on first access (see add_arrow_table)
+            arrows = self._arrows = self._graph._table_arrows(self._index)
+        return arrows
+
+    @arrows.setter
+    def arrows(self, value: list['Schelling_Arrow']):
+        graph = self._graph
+        if graph is None:
+            self._arrows = value
+            return
+        assert not graph.frozen, "The graph is frozen, call unfreeze() before changing its arrows."
+        graph._detach_arrow_table()
+        self._arrows = value
+        graph._topology_changed()
+
+    @property
+    def chips(self) -> int:
+        if self._graph is None:
+            return self._chips
+        return self._graph._chip_values[self._index]
+
+    @chips.setter
+    def chips(self, value: int):
+        if self._graph is None:
+            self._chips = value
+        else:
+            self._graph._set_node_chips(self._index, int(value))
 
     def add_arrow(self, to: 'Schelling_Node', out_edge_node: 'Schelling_Node'):
+        assert self._graph is None or not self._graph.frozen, \
+            "The graph is frozen, call unfreeze() before changing its arrows."
+        if self._graph is not None:
+            self._graph._detach_arrow_table()
         arrow = Schelling_Arrow(to, out_edge_node)
-        self.arrows.append(arrow)
+        self._arrows.append(arrow)
+        if self._graph is not None:
+            self._graph._topology_changed()
 
     def __repr__(self):
         return f"Schelling_Node ({self.x}, {self.y}) {self.color} c={self.chips} "
 
 
 class Schelling_Arrow():
+    __slots__ = ('neighbor', 'out_edge_node')
+
     def __init__(self, to_node: 'Schelling_Node', out_edge_node: 'Schelling_Node'):
         self.neighbor: 'Schelling_Node' = to_node  # The neighboring node
         # The linked nodes connected by this arrow
@@ -45,5 +110,219 @@ class Schelling_Arrow():
     def color(self) -> str:
         return self.out_edge_node.color
 
+    @property
+    def color_code(self) -> int:
+        """Code of color in the palette of the graph."""
+        return self.out_edge_node._color_code
+
     def __repr__(self):
         return f"Schelling_Arrow to ({self.neighbor.x} --{self.out_edge_node.color}--> {self.neighbor.y}), out_edge_node: {self.out_edge_node}"
+
+
+class Palette():
+    """Interns color names to small integer codes, in order of first use."""
+
+    def __init__(self, names=()):
+        self.names: list[str] = []
+        self.codes: dict[str, int] = {}
+        for name in names:
+            self.code(name)
+
+    def code(self, name: str) -> int:
+        c = self.codes.get(name)
+        if c is None:
+            c = self.codes[name] = len(self.names)
+            self.names.append(name)
+        return c
+
+    def name(self, code: int) -> str:
+        return self.names[code]
+
+    def __len__(self):
+        return len(self.names)
+
+
+class Occupied_Index():
+    """Set of node indices with O(1) insertion, removal and uniform sampling.
+
+    The members are kept in a dense list, removing an index moves the last
+    member into the freed slot. pos maps every index to its slot (-1 if absent).
+    changes counts the changes of the members, to detect them cheaply.
+    """
+
+    def __init__(self, size: int, members=()):
+        self.items: list[int] = []
+        self.pos: list[int] = [-1] * size
+        self.changes = 0
+        for i in members:
+            self.add(i)
+
+    def reset(self, members):
+        """Replace the members by members (without duplicates), in that order."""
+        # in place, the engines hold a reference to items and pos
+        self.items[:] = [int(i) for i in members]
+        pos = np.full(len(self.pos), -1, dtype=np.int64)
+        pos[self.items] = np.arange(len(self.items))
+        self.pos[:] = pos.tolist()
+        self.changes += 1
+
+    def add(self, i: int):
+        if self.pos[i] < 0:
+            self.pos[i] = len(self.items)
+            self.items.append(i)
+            self.changes += 1
+
+    def remove(self, i: int):
+        k = self.pos[i]
+        if k < 0:
+            return
+        last = self.items.pop()
+        if last != i:
+            self.items[k] = last
+            self.pos[last] = k
+        self.pos[i] = -1
+        self.changes += 1
+
+    def sample(self, stream) -> int:
+        """Return a member chosen uniformly at random from a Random_Stream."""
+        return self.items[stream.below(len(self.items))]
+
+    def __contains__(self, i: int) -> bool:
+        return self.pos[i] >= 0
+
+    def __len__(self) -> int:
+        return len(self.items)
+
+    def __iter__(self):
+        return iter(self.items)
+
+
+class Sum_Tree():
+    """Non-negative weights of size indices with O(log size) update and
+    sampling proportional to the weights.
+
+    tree is a binary tree in an array: the leaves, from capacity on, hold the
+    weights and every other node the sum of its two children, total is at 1.
+    It is a numpy view of the array('d') _values, on which set and find do
+    their scalar accesses (faster than on numpy).
+    """
+
+    def __init__(self, weights):
+        weights = np.asarray(weights, dtype=np.float64)
+        self.size = len(weights)
+        self.capacity = 1 << max(self.size - 1, 0).bit_length()
+        self._values = array('d', bytes(16 * self.capacity))
+        self.tree = np.frombuffer(self._values)
+        self.tree[self.capacity:self.capacity + self.size] = weights
+        self._sum_levels()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        # view of _values, rebuilt by __setstate__
+        del state['tree']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.tree = np.frombuffer(self._values)
+
+    def _sum_levels(self):
+        """Recompute all the sums from the leaves."""
+        tree = self.tree
+        level = self.capacity // 2
+        while level:
+            tree[level:2 * level] = tree[2 * level:4 * level:2] + tree[2 * level + 1:4 * level:2]
+            level //= 2
+
+    def set(self, i: int, weight: float):
+        tree = self._values
+        k = i + self.capacity
+        tree[k] = weight
+        k >>= 1
+        while k:
+            # sums recomputed rather than updated, they do not drift
+            tree[k] = tree[2 * k] + tree[2 * k + 1]
+            k >>= 1
+
+    def set_many(self, indices: np.ndarray, weights: np.ndarray):
+        """set for every index of indices (sorted, without duplicates), level by level."""
+        tree = self.tree
+        k = np.asarray(indices, dtype=np.int64) + self.capacity
+        if len(k) == 0:
+            return
+        tree[k] = weights
+        if 32 * len(k) > self.capacity:
+            self._sum_levels()
+            return
+        while k[0] > 1:
+            k >>= 1
+            # the parents of sorted indices are sorted, their duplicates adjacent
+            k = k[np.concatenate(([True], k[1:] != k[:-1]))]
+            tree[k] = tree[2 * k] + tree[2 * k + 1]
+
+    def __getitem__(self, i: int) -> float:
+        return self._values[i + self.capacity]
+
+    @property
+    def total(self) -> float:
+        return self._values[1]
+
+    def find(self, u: float) -> int:
+        """Index i such that the weights before i sum to at most u < those up to i,
+        for 0 <= u < total; never an index of weight 0."""
+        tree = self._values
+        k = 1
+        while k < self.capacity:
+            k *= 2
+            left = tree[k]
+            if u >= left and tree[k + 1] > 0:
+                u -= left
+                k += 1
+        return k - self.capacity
+
+
+class Coordinate_Index():
+    """Map from the (x, y) coordinates of the nodes to their indices.
+
+    The index is a grid sized from the coordinate extents, holding -1 where
+    there is no node, or a dictionary when the grid would be much larger than
+    the number of nodes.
+    """
+
+    def __init__(self, x, y):
+        self.x = np.asarray(x, dtype=np.int64)
+        self.y = np.asarray(y, dtype=np.int64)
+        n = len(self.x)
+        self.shape = (int(self.x.max()) + 1, int(self.y.max()) + 1) if n else (0, 0)
+        assert n == 0 or (self.x.min() >= 0 and self.y.min() >= 0), "Node coordinates must be non-negative."
+
+        self._grid = None
+        self._dict = None
+        if self.shape[0] * self.shape[1] <= max(4 * n, 1 << 16):
+            self._grid = np.full(self.shape, -1, dtype=np.int64)
+            self._grid[self.x, self.y] = np.arange(n)
+            duplicates = n - np.count_nonzero(self._grid >= 0)
+        else:
+            self._dict = dict(zip(zip(self.x.tolist(), self.y.tolist()), range(n)))
+            duplicates = n - len(self._dict)
+        assert duplicates == 0, f"Two vertices cannot occupy the same position {self._first_duplicate()}."
+
+    def _first_duplicate(self) -> tuple[int, int]:
+        keys, counts = np.unique(np.stack([self.x, self.y]), axis=1, return_counts=True)
+        x, y = keys[:, counts > 1][:, 0].tolist()
+        return x, y
+
+    def get(self, x: int, y: int) -> int:
+        """Index of the node at (x, y), -1 if there is none."""
+        if self._grid is not None:
+            if 0 <= x < self.shape[0] and 0 <= y < self.shape[1]:
+                return int(self._grid[x, y])
+            return -1
+        return self._dict.get((x, y), -1)
+
+    def scatter(self, values, fill=0) -> np.ndarray:
+        """Matrix of shape self.shape with values[i] at the coordinates of node i."""
+        values = np.asarray(values)
+        m = np.full(self.shape, fill, dtype=values.dtype)
+        m[self.x, self.y] = values
+        return m
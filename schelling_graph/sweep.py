@@ -0,0 +1,297 @@
+import hashlib
+import inspect
+import itertools
+import json
+import os
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable
+import numpy as np
+from schelling_graph.graph import Schelling_Graph
+from schelling_graph.stopping import as_stop_conditions
+from schelling_graph.structures import Schelling_Node
+from schelling_graph.tools import add_arrow_table, arrow_table, multinomial_pvals_at
+
+# part of every cache key, to be increased when what is cached changes
+VERSION = 1
+PARAMETERS = ("s", "tau", "p", "q", "chips")
+
+
+def content_key(*parts) -> str:
+    """Hash of parts (JSON-serializable values and arrays), used as cache key."""
+    h = hashlib.sha1(str(VERSION).encode())
+    for part in parts:
+        if isinstance(part, np.ndarray):
+            h.update(np.ascontiguousarray(part, dtype='<i8').tobytes())
+        else:
+            h.update(json.dumps(part, sort_keys=True).encode())
+        h.update(b"|")
+    return h.hexdigest()
+
+
+class Sweep_Cache:
+    """Memoizes dictionaries of arrays by content key.
+
+    The entries are kept in memory in least-recently-used order, up to
+    max_bytes, and, if path is given, written to that directory as .npz files,
+    so they survive the process and are shared by the sweeps using the same
+    path. The files are written next to their final name and renamed.
+    """
+
+    def __init__(self, path: str | None = None, max_bytes: int = 256 << 20):
+        self.path = path
+        self.max_bytes = max_bytes
+        self._items: OrderedDict[str, dict[str, np.ndarray]] = OrderedDict()
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+        if path is not None:
+            os.makedirs(path, exist_ok=True)
+
+    def _file(self, key: str) -> str:
+        return os.path.join(self.path, f"{key}.npz")
+
+    def _load(self, key: str) -> dict[str, np.ndarray] | None:
+        if self.path is None or not os.path.exists(self._file(key)):
+            return None
+        with np.load(self._file(key), allow_pickle=False) as data:
+            return {name: data[name] for name in data.files}
+
+    def _remember(self, key: str, value: dict[str, np.ndarray]):
+        self._items[key] = value
+        self._bytes += sum(a.nbytes for a in value.values())
+        while self._bytes > self.max_bytes and len(self._items) > 1:
+            _, old = self._items.popitem(last=False)
+            self._bytes -= sum(a.nbytes for a in old.values())
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._items or (self.path is not None and os.path.exists(self._file(key)))
+
+    def get(self, key: str, compute: Callable[[], dict] | None = None) -> dict[str, np.ndarray] | None:
+        """The entry key; if it is not cached, compute() is cached and returned
+        (None is returned if compute is not given)."""
+        value = self._items.get(key)
+        if value is not None:
+            self._items.move_to_end(key)
+            self.hits += 1
+            return value
+        value = self._load(key)
+        if value is not None:
+            self.hits += 1
+        elif compute is None:
+            return None
+        else:
+            self.misses += 1
+            value = self.put(key, compute())
+            return value
+        self._remember(key, value)
+        return value
+
+    def put(self, key: str, value: dict) -> dict[str, np.ndarray]:
+        value = {name: np.asarray(a) for name, a in value.items()}
+        if self.path is not None:
+            tmp = f"{self._file(key)}.tmp"
+            with open(tmp, 'wb') as f:
+                np.savez(f, **value)
+            os.replace(tmp, self._file(key))
+        self._remember(key, value)
+        return value
+
+    def __repr__(self):
+        return f"Sweep_Cache({self.path!r}, {len(self._items)} entries in memory, {self._bytes} bytes)"
+
+
+# cache of the sweeps run without an explicit cache
+_memory_cache = Sweep_Cache()
+
+
+def _stop_key(stop_when) -> str | None:
+    """Part of the cache keys describing stop_when, None if one of its
+    functions can not be identified by its name (lambdas, local functions,
+    partials...), in which case the results can not be reused."""
+    conditions = as_stop_conditions(stop_when)
+    for c in conditions:
+        fn = getattr(c, 'fn', None)
+        if fn is not None and not (inspect.isfunction(fn) and '<' not in fn.__qualname__):
+            return None
+    return repr(conditions)
+
+
+def sweep_points(grid) -> list[dict]:
+    """Points of grid: a dictionary of lists of values (their cartesian product) or a list of dictionaries."""
+    if isinstance(grid, dict):
+        values = [np.atleast_1d(grid[k]).tolist() if k in grid else [None] for k in PARAMETERS]
+        points = [dict(zip(PARAMETERS, v)) for v in itertools.product(*values)]
+    else:
+        points = [dict(point) for point in grid]
+    for point in points:
+        missing = [k for k in PARAMETERS if point.get(k) is None]
+        assert not missing, f"Missing parameters {missing} in sweep point {point}."
+    return points
+
+
+class Sweep_Result:
+    """Results of run_sweep, one row per point and replica.
+
+    table is a structured array with the columns s, tau, p, q, chips, replica,
+    rounds, moves, not_segregated (number of chips not on the boundary at the
+    end of the run), reason and cached (True if the row was reused from an
+    earlier sweep).
+    """
+
+    def __init__(self, table: np.ndarray):
+        self.table = table
+
+    def __len__(self):
+        return len(self.table)
+
+    def __getitem__(self, column: str) -> np.ndarray:
+        return self.table[column]
+
+    def as_dicts(self) -> list[dict]:
+        names = self.table.dtype.names
+        return [dict(zip(names, row)) for row in self.table.tolist()]
+
+    @property
+    def n_cached(self) -> int:
+        return int(self.table["cached"].sum())
+
+    def __repr__(self):
+        return f"Sweep_Result with {len(self)} rows, {self.n_cached} reused from the cache."
+
+
+def _topology(task):
+    x, y, tau, s = task
+    source, neighbor, out_node = arrow_table(x, y, tau, s)
+    return {"source": source, "neighbor": neighbor, "out_node": out_node}
+
+
+def _run_points(task):
+    x, y, colors, topology, points, stop_when, max_rounds, engine = task
+    g = Schelling_Graph([Schelling_Node(x=a, y=b, color=c) for a, b, c in zip(x, y, colors)])
+    add_arrow_table(g, topology["source"], topology["neighbor"], topology["out_node"])
+    # the points of a task share the topology, it is compiled once
+    g.compile()
+    results = []
+    for row, chips, pvals, seed in points:
+        g.seed(seed)
+        g.init_chips_multinomial(chips, pvals)
+        result = g.run_rounds(stop_when=stop_when, max_rounds=max_rounds, engine=engine, record=False)
+        results.append((row, result.rounds, result.n_moves, g.count_chips_not_segregated(), result.reason))
+    return results
+
+
+def run_sweep(grid, nodes: Callable[[int], list[Schelling_Node]], stop_when=None, max_rounds: int = 1000,
+              n_replicas: int = 1, engine: str = "array", workers: int | None = None, seed: int = 0,
+              cache: Sweep_Cache | str | None = None) -> Sweep_Result:
+    """Run the simulation at every point of a grid of parameters (s, tau, p, q, chips).
+
+    grid is a dictionary of lists of values, whose cartesian product is swept,
+    or a list of points (dictionaries). nodes(s) returns the nodes of the graph
+    of size s; the arrows are created as by auto_arrows(graph, tau), and the
+    chips by init_chips_multinomial(chips, pvals) with the multinomial pvals
+    of (p, q, s) (see node_multinomial_pvals). Each replica of a point runs
+    until stop_when (Stop_Conditions, like Segregated()) or max_rounds, with a
+    random generator derived from seed and the parameters of the point, so
+    its result does not depend on the rest of the grid.
+
+    The arrows of each distinct (s, tau), the pvals of each distinct
+    (p, q, s) and the result of each point are computed once and kept in
+    cache (a Sweep_Cache, or the path of its directory; by default a cache in
+    memory shared by the sweeps of this process): running a sweep again with
+    more points only computes the new ones. The results are only reused if
+    the functions in stop_when are module-level functions, identified by
+    their name. The points run over a pool of workers processes (default:
+    number of CPUs), in this process with workers=1. nodes and stop_when must
+    be picklable.
+    """
+    if not isinstance(cache, Sweep_Cache):
+        cache = _memory_cache if cache is None else Sweep_Cache(cache)
+    workers = workers or os.cpu_count() or 1
+    stop_key = _stop_key(stop_when)
+    points = sweep_points(grid)
+
+    layouts = {}
+    for s in sorted({p["s"] for p in points}):
+        ns = nodes(s)
+        x = np.array([n.x for n in ns], dtype=np.int64)
+        y = np.array([n.y for n in ns], dtype=np.int64)
+        colors = [n.color for n in ns]
+        layouts[s] = (x, y, colors, content_key("nodes", x, y, colors))
+
+    def topology_key(s, tau):
+        x, y, _, _ = layouts[s]
+        return content_key("topology", x, y, float(tau))
+
+    rows = []
+    for point in points:
+        x, y, colors, nodes_key = layouts[point["s"]]
+        params = [point[k] for k in PARAMETERS]
+        for replica in range(n_replicas):
+            key = content_key("point", nodes_key, params, replica, seed, max_rounds, engine, stop_key)
+            rows.append((point, replica, key))
+
+    # results of the points, those already in the cache are taken now, the
+    # entries added during the sweep could push them out of memory
+    results = {}
+    for _, _, key in rows:
+        if key not in results and stop_key is not None:
+            cached = cache.get(key)
+            if cached is not None:
+                results[key] = cached
+    todo = [r for r in rows if r[2] not in results]
+    topologies = {}
+    missing = []
+    for s, tau in sorted({(p["s"], p["tau"]) for p, _, _ in todo}):
+        key = topology_key(s, tau)
+        topologies[s, tau] = cache.get(key)
+        if topologies[s, tau] is None:
+            missing.append((s, tau))
+
+    pool = ProcessPoolExecutor(max_workers=workers) if workers > 1 and todo else None
+    try:
+        tasks = [(layouts[s][0], layouts[s][1], tau, int(max(layouts[s][0].max(), layouts[s][1].max())))
+                 for s, tau in missing]
+        built = pool.map(_topology, tasks) if pool is not None else map(_topology, tasks)
+        for (s, tau), topology in zip(missing, built):
+            topologies[s, tau] = cache.put(topology_key(s, tau), topology)
+
+        groups = {}
+        scheduled = set()
+        for i, (point, replica, key) in enumerate(rows):
+            if key not in results and key not in scheduled:
+                scheduled.add(key)
+                s = point["s"]
+                x, y, _, nodes_key = layouts[s]
+                pvals = cache.get(content_key("pvals", x, y, float(point["p"]), float(point["q"])),
+                                  lambda: {"pvals": multinomial_pvals_at(x, y, point["p"], point["q"])})["pvals"]
+                words = np.frombuffer(bytes.fromhex(key[:16]), dtype='<u4').tolist()
+                seed_seq = np.random.SeedSequence(seed, spawn_key=(*words, replica))
+                groups.setdefault((s, point["tau"]), []).append((i, int(point["chips"]), pvals, seed_seq))
+
+        tasks = []
+        for (s, tau), group in groups.items():
+            x, y, colors, _ = layouts[s]
+            chunk = max(1, len(group) // (2 * workers))
+            tasks += [(x.tolist(), y.tolist(), colors, topologies[s, tau], group[i:i+chunk],
+                       stop_when, max_rounds, engine) for i in range(0, len(group), chunk)]
+        done = pool.map(_run_points, tasks) if pool is not None else map(_run_points, tasks)
+        for i, rounds, moves, not_segregated, reason in (r for chunk in done for r in chunk):
+            result = {"rounds": rounds, "moves": moves, "not_segregated": not_segregated, "reason": reason}
+            results[rows[i][2]] = cache.put(rows[i][2], result) if stop_key is not None else result
+    finally:
+        if pool is not None:
+            pool.shutdown()
+
+    computed = {key for _, _, key in todo}
+    table = np.zeros(len(rows), dtype=[("s", np.int64), ("tau", np.float64), ("p", np.float64),
+                                       ("q", np.float64), ("chips", np.int64), ("replica", np.int64),
+                                       ("rounds", np.int64), ("moves", np.int64),
+                                       ("not_segregated", np.int64), ("reason", "U64"), ("cached", bool)])
+    for i, (point, replica, key) in enumerate(rows):
+        result = results[key]
+        table[i] = (point["s"], point["tau"], point["p"], point["q"], point["chips"], replica,
+                    result["rounds"], result["moves"], result["not_segregated"], str(result["reason"]),
+                    key not in computed)
+    return Sweep_Result(table)
+
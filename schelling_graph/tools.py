@@ -1,14 +1,15 @@
 import csv
+import math
+from concurrent.futures import ThreadPoolExecutor
 import numpy as np
-from schelling_graph.structures import Schelling_Node, VALID_COLORS
-from scipy.special import binom
+from schelling_graph import structures
+from schelling_graph.structures import Schelling_Node
 
 
 def get_nodes_by_color(vertices: list[Schelling_Node]) -> dict[str, list[Schelling_Node]]:
-    vertices_by_color = {
-        color: [v for v in vertices if v.color == color]
-        for color in VALID_COLORS
-    }
+    vertices_by_color = {}
+    for v in vertices:
+        vertices_by_color.setdefault(v.color, []).append(v)
     return vertices_by_color
 
 
@@ -20,13 +21,13 @@ def get_vertex_at_position(x: int, y: int, vertices: list[Schelling_Node]) -> Sc
 
 
 def is_color_valid(color: str) -> bool:
-    return color in VALID_COLORS
+    return color in structures.VALID_COLORS
 
 
 def create_vertex_matrix(nodes: list[Schelling_Node]) -> np.ndarray[Schelling_Node]:
-    dim = np.ceil(np.sqrt(len(nodes))).astype(int) + 1
     # Create a matrix to hold the vertices based on their (x, y) positions
-    m = np.zeros((dim, dim), dtype=Schelling_Node)
+    shape = (max(n.x for n in nodes) + 1, max(n.y for n in nodes) + 1) if nodes else (0, 0)
+    m = np.zeros(shape, dtype=Schelling_Node)
     for node in nodes:
         # Ensure no two vertices occupy the same position
         assert not m[node.x,
@@ -63,75 +64,206 @@ def load_nodes_from_csv(path: str) -> list[Schelling_Node]:
 
 def multinomial(s, a, b):
     """Calculates the multinomial coefficient for given s, a, b."""
-    return binom(s, a)*binom(s-a, b)
+    return float(math.comb(s, a)*math.comb(s-a, b))
+
+
+def _xlog(k, log_p):
+    """k * log_p, 0 where k is 0 (also when log_p is -inf)."""
+    with np.errstate(invalid='ignore'):
+        return np.where(k == 0, 0.0, k * log_p)
+
+
+def log_multinomial_pvals(p, q, s, a, b):
+    """Logarithm of the multinomial probability values of calc_multinomial_pvals at (a, b).
+
+    The coefficient is computed from a table of log factorials (math.lgamma,
+    no scipy needed), so it does not overflow or underflow for large s.
+    """
+    a = np.asarray(a, dtype=np.int64)
+    b = np.asarray(b, dtype=np.int64)
+    c = s - a - b
+    # log_factorial[k] = log(k!)
+    log_factorial = np.array([math.lgamma(k + 1) for k in range(s + 1)])
+    with np.errstate(divide='ignore'):
+        log_p, log_1p, log_q, log_1q = np.log(p), np.log1p(-p), np.log(q), np.log1p(-q)
+    return (log_factorial[s] - log_factorial[a] - log_factorial[b] - log_factorial[c]
+            + _xlog(a, log_p) + _xlog(b, log_1p) + _xlog(c, log_q) + _xlog(a + b, log_1q))
 
 
 def calc_multinomial_pvals(p, q, s):
     """Calculates multinomial probability values for given p, q, s (s=size)."""
-    pvals = dict()
-    for a in range(s+1):
-        for b in range(s+1):
-            if (a+b > s):
-                continue
-            pval = multinomial(s, a, b)*(p**a)*((1-p)**b) * \
-                (q**(s-a-b))*((1-q)**(a+b))
-            pvals[(a, b)] = pval
+    a, b = np.nonzero(np.add.outer(np.arange(s+1), np.arange(s+1)) <= s)
+    pvals = np.exp(log_multinomial_pvals(p, q, s, a, b))
+    return dict(zip(zip(a.tolist(), b.tolist()), pvals.tolist()))
+
+
+def node_multinomial_pvals(graph, p, q, s=None) -> np.ndarray:
+    """Multinomial probability values (see calc_multinomial_pvals) of the nodes of graph.
+
+    Returns an array aligned with graph.nodes, the nodes (a, b) with a+b > s
+    get 0. s defaults to the maximum coordinate of the graph.
+    """
+    return multinomial_pvals_at(graph._coords.x, graph._coords.y, p, q, s)
+
+
+def multinomial_pvals_at(x: np.ndarray, y: np.ndarray, p, q, s=None) -> np.ndarray:
+    """node_multinomial_pvals of the nodes at coordinates (x, y), s defaults to the maximum coordinate.
+
+    The pvals are normalized to sum 1, as numpy's multinomial requires.
+    """
+    x = np.asarray(x, dtype=np.int64)
+    y = np.asarray(y, dtype=np.int64)
+    if s is None:
+        s = int(max(x.max(), y.max())) if len(x) else 0
+    inside = x + y <= s
+    pvals = np.zeros(len(x))
+    pvals[inside] = np.exp(log_multinomial_pvals(p, q, s, x[inside], y[inside]))
+    if pvals.sum() > 0:
+        pvals /= pvals.sum()
     return pvals
 
 
 # %% ARROWS =====================================================
-def auto_arrows(graph, tau, log=False):
+def _arrow_tile(rows, a, b, c, d, cd_ok, r, w, tau, s):
+    """Arrow pairs of the nodes rows (outer loop of auto_arrows) with all the nodes.
+
+    Returns the outer node, inner node and direction (left or down) of each
+    pair, in the order the nested loops of auto_arrows visit the pairs.
+    """
+    ai, bi = a[rows][:, None], b[rows][:, None]
+    total = np.maximum(ai + bi, 1)
+    down = (bi - 1 >= 0) & (d + 1 <= s) & (bi / total < tau) & (bi / total <= r) & cd_ok
+    left = (ai - 1 >= 0) & (c + 1 <= s) & (ai / total < tau) & (ai / total <= w) & cd_ok
+    # the last axis is the direction, down before left as in auto_arrows
+    ii, jj, kk = np.nonzero(np.stack([down, left], axis=2))
+    return rows[ii].astype(np.int32), jj.astype(np.int32), kk.astype(bool)
+
+
+def arrow_table(x, y, tau, s, tile_size: int = 1 << 18, workers: int = 1):
+    """Arrows created by auto_arrows for the nodes at coordinates (x, y).
+
+    Every (a,b)/(c,d) pair of nodes is tested with array operations, tile_size
+    pairs at a time, the tiles run on workers threads. Returns the int32 arrays
+    (source, neighbor, out_node) of node indices, sorted by source node and,
+    for each node, in the order auto_arrows adds the arrows.
+    """
+    x = np.asarray(x, dtype=np.int64)
+    y = np.asarray(y, dtype=np.int64)
+    n = len(x)
+    if n == 0:
+        return tuple(np.zeros(0, dtype=np.int32) for _ in range(3))
+    # node index by coordinates, with a margin for the neighbors outside the graph
+    index = np.full((x.max() + 3, y.max() + 3), -1, dtype=np.int32)
+    index[x + 1, y + 1] = np.arange(n)
+
+    c, d = x[None, :], y[None, :]
+    cd = np.maximum(c + d, 1)
+    # c'è sempre una freccia di colore di (0,0)
+    r = np.where(c + d != 0, d / cd, 1.0)
+    w = np.where(c + d != 0, c / cd, 1.0)
+    # non uscire dal grafo
+    cd_ok = c + d < s
+
+    step = max(1, tile_size // max(n, 1))
+    tiles = [np.arange(start, min(start + step, n)) for start in range(0, n, step)]
+
+    def run(rows):
+        return _arrow_tile(rows, x, y, c, d, cd_ok, r, w, tau, s)
+
+    if workers > 1:
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            parts = list(pool.map(run, tiles))
+    else:
+        parts = [run(rows) for rows in tiles]
+
+    def node_at(xs, ys):
+        nodes = index[np.minimum(xs, x.max() + 1) + 1, np.minimum(ys, y.max() + 1) + 1]
+        assert (nodes >= 0).all(), \
+            f"No node at coordinates {(int(xs[nodes < 0][0]), int(ys[nodes < 0][0]))}, " \
+            f"the graph is not triangular with maximum coordinate {s}."
+        return nodes
+
+    # every pair gives an arrow of the outer node (a,b) and then one of the
+    # inner node (c,d): the arrows are counted by source, then each tile is
+    # placed after the arrows of the previous tiles (a stable counting sort)
+    counts = np.zeros(n, dtype=np.int64)
+    for outer, inner, _ in parts:
+        counts += np.bincount(outer, minlength=n) + np.bincount(inner, minlength=n)
+    fill = np.concatenate([[0], np.cumsum(counts)[:-1]])
+    neighbor = np.empty(int(counts.sum()), dtype=np.int32)
+    out_node = np.empty(int(counts.sum()), dtype=np.int32)
+    for k, (outer, inner, left) in enumerate(parts):
+        dx, dy = -left.astype(np.int64), left.astype(np.int64) - 1
+        source = np.empty(2 * len(outer), dtype=np.int32)
+        source[0::2], source[1::2] = outer, inner
+        order = np.argsort(source, kind="stable")
+        source = source[order]
+        # rank of each arrow among the arrows of its source in the tile
+        rank = np.arange(len(source)) - np.searchsorted(source, source)
+        position = fill[source] + rank
+        tile_neighbor = np.empty(len(order), dtype=np.int32)
+        tile_neighbor[0::2] = node_at(x[outer] + dx, y[outer] + dy)
+        tile_neighbor[1::2] = node_at(x[inner] - dx, y[inner] - dy)
+        neighbor[position] = tile_neighbor[order]
+        tile_out_node = np.empty(len(order), dtype=np.int32)
+        tile_out_node[0::2], tile_out_node[1::2] = inner, outer
+        out_node[position] = tile_out_node[order]
+        fill += np.bincount(source, minlength=n)
+        parts[k] = None
+    source = np.repeat(np.arange(n, dtype=np.int32), counts)
+    return source, neighbor, out_node
+
+
+def _merge_arrow_tables(first: tuple, second: tuple) -> tuple:
+    """Arrow table (arrow_ptr, arrow_neighbor, arrow_out_node) with, for every
+    node, its arrows in first and then its arrows in second."""
+    counts = [np.diff(ptr) for ptr, _, _ in (first, second)]
+    ptr = np.concatenate([[0], np.cumsum(counts[0] + counts[1])])
+    neighbor = np.empty(ptr[-1], dtype=np.int64)
+    out_node = np.empty(ptr[-1], dtype=np.int64)
+    for (table_ptr, table_neighbor, table_out_node), start in ((first, ptr[:-1]), (second, ptr[:-1] + counts[0])):
+        source = np.repeat(np.arange(len(table_ptr) - 1), np.diff(table_ptr))
+        position = start[source] + np.arange(len(source)) - table_ptr[source]
+        neighbor[position] = table_neighbor
+        out_node[position] = table_out_node
+    return ptr, neighbor, out_node
+
+
+def add_arrow_table(graph, source, neighbor, out_node, log=False):
+    """Add to graph the arrows of a table (source, neighbor, out_node) of node
+    indices, sorted by source node (see arrow_table).
+
+    The graph keeps the table, the Schelling_Arrow objects of node.arrows are
+    only created when the arrows of the node are accessed.
+    """
+    assert not graph.frozen, "The graph is frozen, call unfreeze() before changing its arrows."
+    nodes = graph.nodes
+    source = np.asarray(source)
+    neighbor = np.asarray(neighbor)
+    out_node = np.asarray(out_node)
+    table = (np.searchsorted(source, np.arange(len(nodes) + 1)), neighbor, out_node)
+    if graph._arrow_table is not None or any(node._arrows for node in nodes):
+        # the new arrows of every node come after the arrows it already has
+        compiled = graph.compile()
+        table = _merge_arrow_tables((compiled.arrow_ptr, compiled.arrow_neighbor, compiled.arrow_out_node), table)
+    graph._set_arrow_table(table)
+    if log:
+        for i, j, k in zip(source.tolist(), neighbor.tolist(), out_node.tolist()):
+            node, to = nodes[i], nodes[j]
+            print(f"({node.x}, {node.y}) {node.color} --{nodes[k].color}--> ({to.x}, {to.y}) {to.color}")
+
+
+def auto_arrows(graph, tau, log=False, tile_size: int = 1 << 18, workers: int = 1):
     """Automatically creates arrows in the graph based.
 
     tau: tollerance (tolerant=0 < tau < intollerant=1)
     graph: Schelling_Graph object
     log: if True, prints the created arrows.
+    tile_size, workers: see arrow_table, which computes the arrows in bulk.
     """
-    s = graph.matrix.shape[0]-1  # coordinata massima del grafo (dek palazzo)
-    τ = tau
-    for node in graph.nodes:
-        a = node.x
-        b = node.y
-
-        # s = b/(a+b) if (a+b)!=0 else 1
-
-        # crea le frecce del colore del node
-        for other in graph.nodes:
-            c = other.x
-            d = other.y
-
-            # c'è sempre una freccia di colore di (0,0)
-            r = d/(c+d) if (c+d) != 0 else 1
-            w = c/(c+d) if (c+d) != 0 else 1
-
-            # non uscire dal grafo
-            if c+d >= s:
-                continue
-
-            # freccia giu
-            if (b-1 >= 0) and (d+1 <= s) and (b/(a+b) < τ) and (b/(a+b) <= r):
-                if log:
-                    print(
-                        f"a,b({a}, {b}) {node.color} --{other.color}--> a,b-1({a}, {b-1}) {g[a, b-1].color}")
-                    print(
-                        f"c,d({c}, {d}) {other.color} --{node.color}--> c,d+1({c}, {d+1}) {g[c, d+1].color}")
-                    print()
-
-                graph.add_arrow(graph[a, b], graph[a, b-1],
-                                out_edge_node=graph[c, d])
-                graph.add_arrow(graph[c, d], graph[c, d+1],
-                                out_edge_node=graph[a, b])
-
-            # freccia sinistra
-            if (a-1 >= 0) and (c+1 <= s) and (a/(a+b) < τ) and (a/(a+b) <= w):
-                if log:
-                    print(
-                        f"a,b({a}, {b}) {node.color} --{other.color}--> a,b-1({a}, {b-1}) {graph[a, b-1].color}")
-                    print(
-                        f"c,d({c}, {d}) {other.color} --{node.color}--> c,d+1({c}, {d+1}) {graph[c, d+1].color}")
-                    print()
-
-                graph.add_arrow(graph[a, b], graph[a-1, b],
-                                out_edge_node=graph[c, d])
-                graph.add_arrow(graph[c, d], graph[c+1, d],
-                                out_edge_node=graph[a, b])
+    assert not graph.frozen, "The graph is frozen, call unfreeze() before changing its arrows."
+    s = max(graph.shape)-1  # coordinata massima del grafo (dek palazzo)
+    nodes = graph.nodes
+    source, neighbor, out_node = arrow_table(
+        [n.x for n in nodes], [n.y for n in nodes], tau, s, tile_size, workers)
+    add_arrow_table(graph, source, neighbor, out_node, log)
@@ -0,0 +1,367 @@
+from array import array
+import bisect
+import json
+import struct
+import numpy as np
+from schelling_graph.structures import Coordinate_Index
+
+# columns of the recorded moves
+ROUND, SOURCE, DESTINATION, OUT_NODE, OUT_DESTINATION, IDLE = range(6)
+N_COLUMNS = 6
+
+# trajectory files: MAGIC, header length (uint64), JSON header, then chunks
+# made of a (kind, count) uint64 pair and their payload
+MAGIC = b"SGTRAJ01"
+MOVES_CHUNK = 1  # payload: count rows of N_COLUMNS int64
+KEYFRAME_CHUNK = 2  # payload: move index (int64) and count chips (int64)
+
+
+class Trajectory:
+    """Compact record of a simulation: its moves, idle runs and keyframes.
+
+    Each move is stored as integers (round, source, destination, out_node,
+    out_destination), node indices refer to graph.nodes and out_node and
+    out_destination are -1 when only half of the move was done. idle[i] is the
+    number of idle rounds before move i. The chips vector is stored after every
+    keyframe_every moves (and before the first one), frame i (the chips after
+    move i) is rebuilt from the closest keyframe.
+    """
+
+    def __init__(self, chips: np.ndarray, x: np.ndarray, y: np.ndarray, shape: tuple, keyframe_every: int = 1000):
+        self.x = np.asarray(x)
+        self.y = np.asarray(y)
+        self.shape = tuple(shape)
+        self.keyframe_every = keyframe_every
+        self.keyframes: dict[int, np.ndarray] = {
+            0: np.array(chips, dtype=np.int64)}
+        # N_COLUMNS integers per move
+        self._data = array('q')
+
+    def record(self, round: int, idle: int, source: int, destination: int, out_node: int, out_destination: int):
+        self._data.extend(
+            (round, source, destination, out_node, out_destination, idle))
+
+    def add_keyframe(self, chips):
+        self.keyframes[len(self)] = np.array(chips, dtype=np.int64)
+
+    def __len__(self):
+        return len(self._data) // N_COLUMNS
+
+    def _rows(self, start: int, stop: int) -> np.ndarray:
+        """(stop - start, N_COLUMNS) array of the moves start:stop."""
+        rows = np.frombuffer(self._data, dtype=np.int64).reshape(-1, N_COLUMNS)
+        return rows[start:stop].copy()
+
+    def _keyframe_before(self, i: int) -> tuple[int, np.ndarray]:
+        """Last keyframe recorded before move i, and its move index."""
+        k = max(k for k in self.keyframes if k <= i)
+        return k, self.keyframes[k]
+
+    @property
+    def rounds(self) -> np.ndarray:
+        """Round of each move."""
+        return self._rows(0, len(self))[:, ROUND]
+
+    @property
+    def idle(self) -> np.ndarray:
+        """Number of idle rounds before each move."""
+        return self._rows(0, len(self))[:, IDLE]
+
+    @property
+    def moves(self) -> np.ndarray:
+        """(n_moves, 5) array of (round, source, destination, out_node, out_destination)."""
+        return self._rows(0, len(self))[:, :IDLE]
+
+    def _first_move_after(self, r: int, inclusive: bool) -> int:
+        """Index of the first move done after round r (or at round r, if inclusive)."""
+        lo, hi = 0, len(self)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            value = self._rows(mid, mid + 1)[0, ROUND]
+            if value < r or (not inclusive and value == r):
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def round_range(self, first: int, last: int) -> np.ndarray:
+        """Moves (as in moves) done in the rounds first to last, included."""
+        start = self._first_move_after(first, inclusive=True)
+        stop = self._first_move_after(last, inclusive=False)
+        return self._rows(start, stop)[:, :IDLE]
+
+    def _apply(self, chips: np.ndarray, start: int, stop: int):
+        """Replay the moves start:stop on chips, in place."""
+        rows = self._rows(start, stop)
+        paired = rows[:, OUT_NODE] >= 0
+        np.add.at(chips, rows[:, SOURCE], -1)
+        np.add.at(chips, rows[:, DESTINATION], 1)
+        np.add.at(chips, rows[paired, OUT_NODE], -1)
+        np.add.at(chips, rows[paired, OUT_DESTINATION], 1)
+
+    def chips(self, i: int) -> np.ndarray:
+        """Chips vector after move i."""
+        n = len(self)
+        if i < 0:
+            i += n
+        assert 0 <= i < n, f"Move index {i} out of range for {n} moves."
+        k, keyframe = self._keyframe_before(i + 1)
+        chips = np.array(keyframe, dtype=np.int64)
+        self._apply(chips, k, i + 1)
+        return chips
+
+    def chips_at_round(self, r: int) -> np.ndarray:
+        """Chips vector at the end of round r (the initial one for r = 0)."""
+        i = self._first_move_after(r, inclusive=False)
+        if i == 0:
+            return np.array(self._keyframe_before(0)[1], dtype=np.int64)
+        return self.chips(i - 1)
+
+    def chips_matrix(self, chips: np.ndarray) -> np.ndarray:
+        """Scatter a chips vector into a matrix indexed by node coordinates."""
+        if not hasattr(self, '_coords'):
+            self._coords = Coordinate_Index(self.x, self.y)
+        return self._coords.scatter(chips)
+
+    @property
+    def frames(self) -> 'Trajectory_Frames':
+        """Chips matrices after each move, rebuilt on demand."""
+        return Trajectory_Frames(self)
+
+
+class Trajectory_Frames:
+    """Lazy sequence of the chips matrices of a Trajectory.
+
+    Slicing it, e.g. frames[::10], gives the frames of a subset of the moves
+    without rebuilding the others.
+    """
+
+    def __init__(self, trajectory: Trajectory, indices: range | None = None):
+        self.trajectory = trajectory
+        self.indices = range(len(trajectory)) if indices is None else indices
+
+    def __len__(self):
+        return len(self.indices)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return type(self)(self.trajectory, self.indices[i])
+        return self.trajectory.chips_matrix(self.trajectory.chips(self.indices[i]))
+
+    def __iter__(self):
+        t = self.trajectory
+        if self.indices.step < 0:
+            for i in self.indices:
+                yield t.chips_matrix(t.chips(i))
+            return
+        if len(self.indices) == 0:
+            return
+        # replay the moves from the keyframe before the first frame
+        done, keyframe = t._keyframe_before(self.indices[0] + 1)
+        chips = np.array(keyframe, dtype=np.int64)
+        for i in self.indices:
+            t._apply(chips, done, i + 1)
+            done = i + 1
+            yield t.chips_matrix(chips)
+
+
+class Trajectory_Writer(Trajectory):
+    """Trajectory streamed to an append-only file instead of kept in memory.
+
+    Moves are written in chunks of chunk_size, each followed by the keyframes
+    added while it was filled.
+    close() flushes the file and returns it opened as a Trajectory_File.
+    With append_at, the (offset, n_moves) returned by cursor() for an
+    existing file, the file is truncated there and the recording goes on.
+    """
+
+    def __init__(self, path: str, chips: np.ndarray, x: np.ndarray, y: np.ndarray, shape: tuple,
+                 keyframe_every: int = 1000, chunk_size: int = 65536, append_at: tuple[int, int] | None = None):
+        super().__init__(chips, x, y, shape, keyframe_every)
+        self.path = path
+        self.chunk_size = chunk_size
+        self._n_written = 0
+        # keyframes of the current chunk, written after it
+        self._keyframes: list[tuple[int, np.ndarray]] = []
+
+        if append_at is not None:
+            offset, self._n_written = append_at
+            self.keyframes.pop(0)
+            self._file = open(path, 'r+b')
+            self._file.truncate(offset)
+            self._file.seek(offset)
+            return
+
+        header = json.dumps({
+            "format": "schelling_graph trajectory",
+            "n_nodes": len(self.x),
+            "x": self.x.tolist(),
+            "y": self.y.tolist(),
+            "shape": list(self.shape),
+            "keyframe_every": keyframe_every,
+        }).encode()
+        self._file = open(path, 'wb')
+        self._file.write(MAGIC + struct.pack('<Q', len(header)) + header)
+        self._write_keyframe(0, self.keyframes.pop(0))
+
+    def __len__(self):
+        return self._n_written + len(self._data) // N_COLUMNS
+
+    def record(self, round, idle, source, destination, out_node, out_destination):
+        super().record(round, idle, source, destination, out_node, out_destination)
+        if len(self._data) >= self.chunk_size * N_COLUMNS:
+            self.flush()
+
+    def add_keyframe(self, chips):
+        self._keyframes.append((len(self), np.array(chips, dtype=np.int64)))
+
+    def _write_keyframe(self, i: int, chips: np.ndarray):
+        self._file.write(struct.pack('<QQq', KEYFRAME_CHUNK, len(chips), i))
+        self._file.write(chips.astype('<i8').tobytes())
+
+    def flush(self):
+        n = len(self._data) // N_COLUMNS
+        if n:
+            self._file.write(struct.pack('<QQ', MOVES_CHUNK, n))
+            self._file.write(self._data.tobytes())
+            self._n_written += n
+            self._data = array('q')
+        for i, chips in self._keyframes:
+            self._write_keyframe(i, chips)
+        self._keyframes = []
+        self._file.flush()
+
+    def cursor(self) -> tuple[int, int]:
+        """Flush and return the end offset of the file and the number of moves written."""
+        self.flush()
+        return self._file.tell(), self._n_written
+
+    def _rows(self, start, stop):
+        raise NotImplementedError(
+            "A Trajectory_Writer can not be read, close it and use the returned Trajectory_File.")
+
+    def close(self) -> 'Trajectory_File':
+        self.flush()
+        self._file.close()
+        return Trajectory_File(self.path)
+
+
+class Trajectory_File(Trajectory):
+    """Trajectory read from a file written by Trajectory_Writer.
+
+    The file is memory-mapped once, so only the moves and keyframes that are
+    used are read from disk.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, 'rb') as f:
+            assert f.read(len(MAGIC)) == MAGIC, f"{path} is not a schelling_graph trajectory file."
+            (header_length,) = struct.unpack('<Q', f.read(8))
+            header = json.loads(f.read(header_length))
+            self.x = np.array(header["x"], dtype=np.int64)
+            self.y = np.array(header["y"], dtype=np.int64)
+            self.shape = tuple(header["shape"])
+            self.keyframe_every = header["keyframe_every"]
+
+            # first move index, count and offset of every chunk of moves
+            self._chunk_start: list[int] = []
+            self._chunks: list[tuple[int, int]] = []
+            self._keyframe_offsets: dict[int, tuple[int, int]] = {}
+            n_moves = 0
+            while True:
+                chunk_header = f.read(16)
+                if len(chunk_header) < 16:
+                    break
+                kind, count = struct.unpack('<QQ', chunk_header)
+                if kind == MOVES_CHUNK:
+                    self._chunk_start.append(n_moves)
+                    self._chunks.append((f.tell(), count))
+                    n_moves += count
+                    f.seek(count * N_COLUMNS * 8, 1)
+                else:
+                    (i,) = struct.unpack('<q', f.read(8))
+                    self._keyframe_offsets[i] = (f.tell(), count)
+                    f.seek(count * 8, 1)
+        self._n_moves = n_moves
+        self._map = np.memmap(path, dtype=np.uint8, mode='r')
+
+    def __len__(self):
+        return self._n_moves
+
+    def record(self, *args):
+        raise NotImplementedError("A Trajectory_File is read-only.")
+
+    def _view(self, offset: int, count: int) -> np.ndarray:
+        """The count int64 values at offset in the file."""
+        return self._map[offset:offset + count * 8].view('<i8')
+
+    def _chunk(self, c: int) -> np.ndarray:
+        offset, count = self._chunks[c]
+        return self._view(offset, count * N_COLUMNS).reshape(count, N_COLUMNS)
+
+    def _rows(self, start, stop):
+        stop = min(stop, len(self))
+        if start >= stop:
+            return np.zeros((0, N_COLUMNS), dtype=np.int64)
+        first = bisect.bisect_right(self._chunk_start, start) - 1
+        last = bisect.bisect_right(self._chunk_start, stop - 1) - 1
+        parts = []
+        for c in range(first, last + 1):
+            c_start = self._chunk_start[c]
+            parts.append(self._chunk(c)[max(start - c_start, 0):stop - c_start])
+        return np.concatenate(parts).astype(np.int64)
+
+    @property
+    def keyframes(self) -> dict[int, np.ndarray]:
+        return {i: self._keyframe(i) for i in self._keyframe_offsets}
+
+    def _keyframe(self, i: int) -> np.ndarray:
+        return self._view(*self._keyframe_offsets[i])
+
+    def _keyframe_before(self, i):
+        k = max(k for k in self._keyframe_offsets if k <= i)
+        return k, self._keyframe(k)
+
+    def iter_chunks(self):
+        """Iterate over the moves chunk by chunk, as (k, N_COLUMNS) arrays."""
+        for c in range(len(self._chunks)):
+            yield np.asarray(self._chunk(c))
+
+
+class Run_Result:
+    """Outcome of Schelling_Graph.run_rounds.
+
+    rounds: number of rounds run
+    n_moves: number of successful moves
+    reason: why the simulation stopped
+    trajectory: the Trajectory of the run, None if it was not recorded
+    stats: the Run_Stats of the run, None if it was not instrumented
+    """
+
+    def __init__(self, rounds: int, n_moves: int, reason: str, trajectory: Trajectory | None = None,
+                 stats=None):
+        self.rounds = rounds
+        self.n_moves = n_moves
+        self.reason = reason
+        self.trajectory = trajectory
+        self.stats = stats
+
+    @property
+    def message(self) -> str:
+        return f"{self.reason[0].upper()}{self.reason[1:]}, stopping simulation after {self.rounds} rounds."
+
+    @property
+    def logs(self) -> list[str]:
+        """Log messages of the run, in the format of the previous versions."""
+        logs = []
+        if isinstance(self.trajectory, Trajectory):
+            rows = self.trajectory._rows(0, len(self.trajectory))
+            for idle, out_node in zip(rows[:, IDLE].tolist(), rows[:, OUT_NODE].tolist()):
+                if idle > 0:
+                    logs.append(f"Idle ({idle} round{'s' if idle > 1 else ''}).")
+                logs.append("" if out_node >= 0 else None)
+        return logs + [self.message]
+
+    def __repr__(self):
+        return f"Run_Result: {self.message} {self.n_moves} moves."
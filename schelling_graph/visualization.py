@@ -4,7 +4,6 @@ import matplotlib as mpl
 import numpy as np
 from schelling_graph import Schelling_Node
 from schelling_graph.tools import create_vertex_matrix
-from IPython.display import HTML
 
 
 def _draw_graph(nodes: list[Schelling_Node], ax):
@@ -104,45 +103,77 @@ def draw_matrix(matrix: np.ndarray, ax):
     return fig, ax
 
 
-def _draw_matrix(matrix: np.ndarray, ax):
-    # if isinstance(matrix[0][0], Schelling_Node):
-    #     matrix = node_matrix_2_int_matrix(matrix)
-
-    # Flip the matrix horizontally for correct display
-    matrix = np.flip(matrix, axis=1)
-
-    max_chips = matrix.max()
-
-    rows, cols = matrix.shape
-    for i in range(rows):
-        for j in range(cols):
-            chips = matrix[i, j]
-            if chips:
-                intensity = chips / max_chips if max_chips > 0 else 0
-                facecolor = plt.cm.get_cmap('Greens')(intensity)
-                textcolor = 'white' if intensity > 0.5 else 'black'
-                ax.add_patch(
-
-                    plt.Rectangle((i, j), 1, 1,  # type: ignore
-                                  facecolor=facecolor,
-                                  edgecolor='white',
-                                  linewidth=1))
-
-                ax.text(i + 0.5, j + 0.5, str(chips),
-                        color=textcolor, fontsize=12, ha='center', va='center')
-            else:
-                # type: ignore
-                ax.add_patch(plt.Rectangle(  # type: ignore
-                    (i, j), 1, 1, color='lightgray', fill=False))
-    ax.set_xlim(0, cols)
-    ax.set_ylim(0, rows)
-    ax.set_aspect('equal')
-    ax.invert_yaxis()
-
-    ax.set_xticks(np.arange(0.5, cols + 0.5, 1))
-    ax.set_xticklabels(np.arange(0, cols))
-    ax.set_yticks(np.arange(0.5, rows + 0.5, 1))
-    ax.set_yticklabels(np.arange(0, rows)[::-1])
+# above this number of cells the chips are not written in the cells
+LABEL_LIMIT = 400
+
+
+class Chips_Renderer:
+    """Draws chips matrices on ax, creating the artists once.
+
+    The cells are a single image, and the chips are written in the cells with
+    a text artist each when labels is True (by default, when the matrix has
+    at most LABEL_LIMIT cells). update only changes the data of the artists,
+    and only of the texts whose cell changed, so a renderer can draw the
+    frames of an animation with blitting.
+    Node (x, y) is drawn in column x and row y, with y increasing upwards.
+    """
+
+    def __init__(self, ax, shape: tuple, labels: bool | None = None):
+        cols, rows = shape
+        self.ax = ax
+        self.cmap = mpl.colormaps['Greens'].with_extremes(bad='white')
+        self.image = ax.imshow(np.ma.masked_all((rows, cols)), cmap=self.cmap, vmin=0, vmax=1,
+                               origin='lower', extent=(0, cols, 0, rows), interpolation='nearest')
+
+        if labels is None:
+            labels = rows * cols <= LABEL_LIMIT
+        self.texts = []
+        if labels:
+            self.texts = [ax.text(i + 0.5, j + 0.5, '', fontsize=12, ha='center', va='center')
+                          for i in range(cols) for j in range(rows)]
+        # (label, color) drawn in each text
+        self._cells = [('', 'black')] * len(self.texts)
+
+        ax.set_xlim(0, cols)
+        ax.set_ylim(0, rows)
+        ax.set_aspect('equal')
+        # the ticks are labeled only when the cells are labeled
+        if labels:
+            ax.set_xticks(np.arange(0.5, cols + 0.5, 1))
+            ax.set_xticklabels(np.arange(0, cols))
+            ax.set_yticks(np.arange(0.5, rows + 0.5, 1))
+            ax.set_yticklabels(np.arange(0, rows))
+            ax.set_xticks(np.arange(0, cols + 1), minor=True)
+            ax.set_yticks(np.arange(0, rows + 1), minor=True)
+            ax.tick_params(which='minor', length=0)
+            ax.grid(which='minor', color='lightgray', linewidth=1)
+
+    @property
+    def artists(self) -> list:
+        return [self.image] + self.texts
+
+    def update(self, matrix: np.ndarray) -> list:
+        """Draw matrix (indexed by node coordinates), return the changed artists."""
+        max_chips = matrix.max()
+        intensity = matrix / max_chips if max_chips > 0 else np.zeros(matrix.shape)
+        self.image.set_data(np.ma.masked_equal(intensity, 0).T)
+        if self.texts:
+            # expected chips (run_mean_field) are floats
+            label = str if np.issubdtype(matrix.dtype, np.integer) else '{:.2g}'.format
+            cells = self._cells
+            for k, (chips, level) in enumerate(zip(matrix.ravel().tolist(), intensity.ravel().tolist())):
+                cell = (label(chips) if chips else '', 'white' if level > 0.5 else 'black')
+                if cell != cells[k]:
+                    cells[k] = cell
+                    self.texts[k].set_text(cell[0])
+                    self.texts[k].set_color(cell[1])
+        return self.artists
+
+
+def _draw_matrix(matrix: np.ndarray, ax, labels: bool | None = None) -> Chips_Renderer:
+    renderer = Chips_Renderer(ax, matrix.shape, labels)
+    renderer.update(matrix)
+    return renderer
 
 
 def draw_matrix_3D(matrix_or_vertices: list[Schelling_Node] | np.ndarray):
@@ -159,6 +190,7 @@ def draw_matrix_3D(matrix_or_vertices: list[Schelling_Node] | np.ndarray):
 
     max_chips = max(
         node.chips for node in matrix.flatten() if isinstance(node, Schelling_Node))
+    cmap = mpl.colormaps['Greens']
 
     rows, cols = matrix.shape
 
@@ -170,7 +202,7 @@ def draw_matrix_3D(matrix_or_vertices: list[Schelling_Node] | np.ndarray):
         vertex = matrix[i, j]
         if vertex:
             intensity = vertex.chips / max_chips if max_chips > 0 else 0
-            facecolor = plt.cm.get_cmap('Greens')(intensity)
+            facecolor = cmap(intensity)
             ax.bar3d(i, j, 0, 1, 1, vertex.chips,
                      color=facecolor, edgecolor=None)
 
@@ -190,23 +222,69 @@ def draw_matrix_3D(matrix_or_vertices: list[Schelling_Node] | np.ndarray):
     return fig, ax
 
 
-def animate_chips_matrices(animation_frames, interval=500, repeat_delay=1000, html=True):
-    if len(animation_frames) == 0:
+def _animation(frames, interval: int, repeat_delay: int, labels: bool | None, title: str = "Chips"):
+    if len(frames) == 0:
         raise ValueError(
-            "No animation frames available. Please run 'run_rounds()' with draw_frames=True before animating.")
+            "No animation frames available. Please run 'run_rounds()' with record=True before animating.")
 
+    first = frames[0]
     fig, ax = plt.subplots()
+    ax.set_title(title)
+    renderer = Chips_Renderer(ax, first.shape, labels)
 
-    def update(frame):
-        ax.clear()
-        _draw_matrix(frame, ax=ax)
-        ax.set_title("Chips")
+    def init():
+        return renderer.update(first)
 
     ani = animation.FuncAnimation(
-        fig, update, frames=animation_frames, interval=interval, repeat_delay=repeat_delay)  # type: ignore
+        fig, renderer.update, frames=frames, init_func=init, blit=True, cache_frame_data=False,
+        interval=interval, repeat_delay=repeat_delay)  # type: ignore
+    return fig, ani
+
+
+def animate_chips_matrices(animation_frames, interval=500, repeat_delay=1000, html=True,
+                           labels: bool | None = None):
+    """Animation of a sequence of chips matrices (e.g. Trajectory.frames).
+
+    The artists are created once and each frame only updates their data. With
+    html, the animation is converted to an HTML player, which holds all the
+    frames in memory: use export_animation for long simulations.
+    """
+    fig, ani = _animation(animation_frames, interval, repeat_delay, labels)
     plt.close(fig)  # Prevents duplicate static plot display
 
     if html:
+        from IPython.display import HTML
         ani = HTML(ani.to_jshtml())
 
     return ani
+
+
+def export_animation(animation_frames, path: str, fps: int = 10, every: int = 1, writer: str | None = None,
+                     dpi: int = 100, labels: bool | None = None):
+    """Write the animation of a sequence of chips matrices to a video or GIF file.
+
+    Only one frame in every is drawn (the frames of a Trajectory are sliced
+    without being rebuilt). The frames are drawn and passed to the writer one
+    at a time, so with a piping writer (ffmpeg, imagemagick) the memory used
+    does not grow with the length of the animation; the pillow writer, used
+    when ffmpeg is not available, keeps the encoded frames until the end.
+    """
+    assert every >= 1, f"every must be a positive integer, got {every}."
+    frames = animation_frames[::every]
+    if writer is None:
+        writer = 'ffmpeg' if animation.writers.is_available('ffmpeg') else 'pillow'
+    movie_writer = animation.writers[writer](fps=fps)
+
+    fig, ax = plt.subplots()
+    ax.set_title("Chips")
+    renderer = None
+    try:
+        with movie_writer.saving(fig, path, dpi):
+            for frame in frames:
+                if renderer is None:
+                    renderer = Chips_Renderer(ax, frame.shape, labels)
+                renderer.update(frame)
+                movie_writer.grab_frame()
+    finally:
+        plt.close(fig)
+    return path
@@ -0,0 +1,25 @@
+import pytest
+from schelling_graph import Schelling_Graph, Schelling_Node, auto_arrows
+
+COLORS = ["black", "red", "orange", "purple", "blue", "cyan", "green"]
+
+
+def triangle_nodes(s: int) -> list[Schelling_Node]:
+    """The nodes (a, b) with a+b <= s, colored in a fixed pattern."""
+    return [Schelling_Node(x=a, y=b, color=COLORS[(3 * a + b) % len(COLORS)])
+            for a in range(s + 1) for b in range(s + 1 - a)]
+
+
+def make_triangle(s: int, tau: float = 0.6, seed=0, chips: int | None = 2) -> Schelling_Graph:
+    """Graph of the nodes (a, b) with a+b <= s and the arrows of auto_arrows,
+    with uniform random chips between 0 and chips (none if chips is None)."""
+    g = Schelling_Graph(triangle_nodes(s), seed=seed)
+    auto_arrows(g, tau)
+    if chips is not None:
+        g.init_chips_uniform(0, chips)
+    return g
+
+
+@pytest.fixture
+def triangle():
+    return make_triangle
@@ -0,0 +1,75 @@
+import numpy as np
+from schelling_graph import Absorbing, run_lockstep
+from schelling_graph.batch import _Replica_Rows
+
+
+def _close(a: np.ndarray, b: np.ndarray, z: float = 5.0) -> bool:
+    """Whether the means of samples a and b (along axis 0) agree within z standard errors."""
+    error = np.sqrt(a.var(axis=0) / len(a) + b.var(axis=0) / len(b)) + 1e-9
+    return bool((np.abs(a.mean(axis=0) - b.mean(axis=0)) <= z * error).all())
+
+
+def test_lockstep_matches_serial_runs_in_distribution(triangle):
+    g = triangle(4, chips=2)
+    lockstep = run_lockstep(g, 400, max_rounds=300)
+    serial, chips = [], []
+    for _ in range(400):
+        replica = g.copy()
+        serial.append(replica.run_rounds(max_rounds=300, record=False))
+        chips.append(replica.chips_array)
+    rounds = np.array([r.rounds for r in serial])
+    moves = np.array([r.n_moves for r in serial])
+
+    assert set(lockstep.reasons) == {r.reason for r in serial}
+    assert _close(lockstep.rounds, rounds) and _close(lockstep.moves, moves)
+    assert _close(lockstep.chips, np.array(chips))
+    assert (lockstep.chips.sum(axis=1) == g.chips_array.sum()).all()
+
+
+def test_lockstep_stops_each_replica_on_its_own(triangle):
+    g = triangle(5, chips=2)
+    result = run_lockstep(g, 50, stop_when=g.is_segregated, max_rounds=10**5, stop_on_absorbing=False)
+    compiled = g.compile()
+    inside = (compiled.x != 0) & (compiled.y != 0)
+    assert result.reasons == ["graph segregated"] * 50
+    assert (result.chips[:, inside] == 0).all()
+    assert len(np.unique(result.rounds)) > 1
+
+
+def test_lockstep_stops_absorbing_replicas_at_round_zero(triangle):
+    g = triangle(4, chips=None)
+    g[2, 1].chips = 1
+    chips = np.zeros((3, g.compile().n_nodes), dtype=np.int64)
+    chips[0] = g.chips_array
+    chips[1] = triangle(4, chips=2).chips_array
+    result = run_lockstep(g, chips=chips, max_rounds=50)
+    assert result.reasons[0] == result.reasons[2] == Absorbing.reason
+    assert (result.rounds[[0, 2]] == 0).all() and (result.moves[[0, 2]] == 0).all()
+    assert (result.chips[0] == chips[0]).all() and (result.chips[2] == 0).all()
+    assert result.moves[1] > 0
+
+
+def test_replica_rows_keep_their_candidate_counts(triangle):
+    g = triangle(5, chips=2)
+    compiled = g.compile()
+    rng = np.random.default_rng(0)
+    chips = rng.integers(0, 3, size=(20, compiled.n_nodes))
+    chips[0] = 0
+    replicas = _Replica_Rows(compiled, chips)
+    rows = np.arange(20)
+    for _ in range(50):
+        node = rng.integers(compiled.n_nodes, size=20)
+        empty = chips[rows, node] == 0
+        replicas.add(rows[empty], node[empty])
+        replicas.remove(rows[~empty], node[~empty])
+        chips[rows, node] = np.where(empty, 1, 0)
+
+    occupied = chips > 0
+    counts = np.array([np.bincount(compiled.arrow_source, weights=o[compiled.arrow_out_node],
+                                   minlength=compiled.n_nodes) for o in occupied])
+    assert (replicas.candidates[:, :-1] == counts).all()
+    assert (replicas.count == occupied.sum(axis=1)).all()
+    for r in rows:
+        assert set(replicas.items[r, :replicas.count[r]].tolist()) == set(np.flatnonzero(occupied[r]).tolist())
+    enabled = np.array([compiled.enabled_arrows(c).any() for c in chips])
+    assert (replicas.absorbing(rows, chips) == ~enabled).all()
@@ -0,0 +1,30 @@
+import numpy as np
+import pytest
+
+
+def test_save_does_not_freeze(triangle, tmp_path):
+    g = triangle(5)
+    g.save_checkpoint(tmp_path / "a.ckpt")
+    assert not g.frozen
+    g.nodes[0].add_arrow(g.nodes[1], g.nodes[2])
+
+
+def test_resume_continues_the_trajectory(triangle, tmp_path):
+    g = triangle(6)
+    reference = g.copy(same_stream=True)
+    g.run_rounds(max_rounds=50, stop_on_absorbing=False)
+    g.save_checkpoint(tmp_path / "a.ckpt")
+    ref = reference.run_rounds(max_rounds=120, stop_on_absorbing=False)
+
+    other = triangle(6, seed=1)
+    result = other.resume(tmp_path / "a.ckpt", max_rounds=120, stop_on_absorbing=False)
+    assert result.rounds == ref.rounds
+    assert np.array_equal(other.chips_array, reference.chips_array)
+
+
+def test_resume_checks_the_topology(triangle, tmp_path):
+    g = triangle(5)
+    g.save_checkpoint(tmp_path / "a.ckpt")
+    other = triangle(5, tau=0.3)
+    with pytest.raises(AssertionError, match="different topology"):
+        other.resume(tmp_path / "a.ckpt", max_rounds=1)
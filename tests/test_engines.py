@@ -0,0 +1,70 @@
+import pickle
+import numpy as np
+import pytest
+from schelling_graph.engine import Enabled_Moves
+from schelling_graph.structures import Sum_Tree
+
+
+def test_sum_tree_samples_like_the_cumulative_sums():
+    rng = np.random.default_rng(0)
+    weights = rng.random(37) * (rng.random(37) < 0.5)
+    tree = Sum_Tree(weights)
+    tree.set(3, 0.0)
+    tree.set_many(np.array([4, 5, 30]), np.array([1.5, 0.0, 2.0]))
+    weights[[3, 4, 5, 30]] = [0.0, 1.5, 0.0, 2.0]
+    assert np.isclose(tree.total, weights.sum())
+    cumulative = np.cumsum(weights)
+    for u in rng.random(200) * tree.total:
+        i = tree.find(u)
+        assert weights[i] > 0
+        assert cumulative[i] - weights[i] <= u + 1e-12 and u < cumulative[i] + 1e-12
+    assert weights[tree.find(np.nextafter(tree.total, 0))] > 0
+
+    copy = pickle.loads(pickle.dumps(tree))
+    copy.set(7, 3.0)
+    assert copy.total == copy.tree[1] == pytest.approx(tree.total - weights[7] + 3.0)
+
+
+def test_kmc_keeps_the_enabled_moves_up_to_date(triangle):
+    g = triangle(8, chips=3)
+    moves = g.track_enabled_moves()
+    g.run_rounds(max_rounds=500, engine="kmc")
+    fresh = Enabled_Moves(g.compile(), g.chips_array)
+    assert np.allclose(moves.weight, fresh.weight)
+    assert moves.n_enabled == fresh.n_enabled
+    assert np.isclose(moves.total, fresh.weight.sum())
+    assert all(moves.tree[i] == moves.weight[i] for i in range(len(moves.weight)))
+
+
+def test_kmc_matches_the_python_engine_in_distribution(triangle):
+    def moves(engine, seed):
+        return triangle(5, seed=seed, chips=3).run_rounds(max_rounds=200, engine=engine).n_moves
+
+    python = np.mean([moves("python", seed) for seed in range(150)])
+    kmc = np.mean([moves("kmc", seed) for seed in range(150)])
+    assert abs(python - kmc) < 0.1 * python
+
+
+@pytest.mark.parametrize("s", [4, 12])
+def test_array_engine_follows_the_python_trajectory(triangle, s):
+    g = triangle(s, chips=3)
+    a, b = g.copy(same_stream=True), g.copy(same_stream=True)
+    ra = a.run_rounds(max_rounds=2000, engine="python")
+    rb = b.run_rounds(max_rounds=2000, engine="array")
+    assert (ra.rounds, ra.n_moves, ra.reason) == (rb.rounds, rb.n_moves, rb.reason)
+    assert np.array_equal(ra.trajectory.moves, rb.trajectory.moves)
+    assert np.array_equal(ra.trajectory.rounds, rb.trajectory.rounds)
+    assert np.array_equal(a.chips_array, b.chips_array)
+
+
+def test_array_engine_keeps_the_graph_state_up_to_date(triangle):
+    g = triangle(10, chips=1)
+    moves = g.track_enabled_moves()
+    g.run_rounds(max_rounds=3000, engine="array", stop_on_absorbing=False)
+    chips = g.chips_array
+    assert sorted(g._occupied.items) == np.flatnonzero(chips > 0).tolist()
+    assert all(g._occupied.pos[i] == k for k, i in enumerate(g._occupied.items))
+    inside = (g.compile().x != 0) & (g.compile().y != 0)
+    assert g.count_chips_not_segregated() == chips[inside].sum()
+    fresh = Enabled_Moves(g.compile(), g.chips_array)
+    assert np.allclose(moves.weight, fresh.weight) and moves.n_enabled == fresh.n_enabled
@@ -0,0 +1,31 @@
+from functools import partial
+import numpy as np
+import pytest
+from schelling_graph import Schelling_Graph, run_ensemble
+
+
+@pytest.mark.parametrize("engine", ["python", "array"])
+def test_results_do_not_depend_on_the_workers(triangle, engine):
+    g = triangle(5, chips=2)
+    kwargs = dict(init=partial(Schelling_Graph.init_chips_uniform, min=0, max=3), stop_when=g.is_segregated,
+                  max_rounds=2000, engine=engine, seed=7)
+    serial = run_ensemble(g, 12, workers=1, **kwargs)
+    pool = run_ensemble(g, 12, workers=2, chunksize=5, **kwargs)
+    assert np.array_equal(serial.rounds, pool.rounds)
+    assert np.array_equal(serial.moves, pool.moves)
+    assert np.array_equal(serial.chips, pool.chips)
+    assert serial.reasons == pool.reasons
+    assert serial.reason_counts() == {"graph segregated": 12}
+
+
+def test_replicas_have_independent_streams(triangle):
+    g = triangle(5, chips=2)
+    chips = g.chips_array.copy()
+    result = run_ensemble(g, 8, max_rounds=2000, workers=1, seed=1)
+    assert len(np.unique(result.rounds)) > 1
+    assert len(np.unique(result.chips, axis=0)) > 1
+    assert (result.chips.sum(axis=1) == chips.sum()).all()
+    # the replicas run on a copy of the graph
+    assert np.array_equal(g.chips_array, chips)
+    other = run_ensemble(g, 8, max_rounds=2000, workers=1, seed=2)
+    assert not np.array_equal(result.chips, other.chips)
@@ -0,0 +1,43 @@
+import numpy as np
+import pytest
+from schelling_graph import Schelling_Graph, Schelling_Node, Segregated
+
+pytest.importorskip("scipy")
+
+
+def branching() -> Schelling_Graph:
+    """From the start, a third of the rounds are idle (on (0,2)); (2,0) always
+    segregates the graph, (1,1) segregates it or gets stuck on (2,2) with
+    probability 1/2: P(segregated) = 3/4, expected rounds = 3/2."""
+    nodes = [Schelling_Node(x=1, y=1, chips=1, color="red"), Schelling_Node(x=2, y=0, chips=1, color="blue"),
+             Schelling_Node(x=0, y=2, chips=1, color="orange"), Schelling_Node(x=0, y=1, color="black"),
+             Schelling_Node(x=2, y=2, color="green")]
+    g = Schelling_Graph(nodes)
+    g.add_arrow(g[1, 1], g[0, 1], g[2, 0])
+    g.add_arrow(g[1, 1], g[2, 2], g[2, 0])
+    g.add_arrow(g[2, 0], g[2, 0], g[1, 1])
+    return g
+
+
+def test_hand_computed_outcome():
+    result = branching().solve_exact()
+    assert len(result) == 3
+    outcome = result.at([1, 1, 1, 0, 0])
+    assert outcome["p_segregated"] == pytest.approx(0.75)
+    assert outcome["p_stuck"] == pytest.approx(0.25)
+    assert outcome["p_never"] == pytest.approx(0.0)
+    assert outcome["expected_rounds"] == pytest.approx(1.5)
+    assert result.at([0, 1, 1, 0, 1]) == {"p_segregated": 0.0, "p_stuck": 1.0, "p_never": 0.0,
+                                          "expected_rounds": 0.0}
+
+
+def test_matches_monte_carlo(triangle):
+    g = triangle(4, chips=1, seed=2)
+    exact = g.solve_exact()
+    runs = [g.copy().run_rounds(stop_when=Segregated(), max_rounds=10**5, record=False)
+            for _ in range(2000)]
+    rounds = np.array([r.rounds for r in runs])
+    segregated = np.array([r.reason == Segregated.reason for r in runs])
+    assert abs(rounds.mean() - exact.expected_rounds[0]) < 5 * rounds.std() / np.sqrt(len(runs))
+    p = exact.p_segregated[0]
+    assert abs(segregated.mean() - p) < 5 * np.sqrt(p * (1 - p) / len(runs)) + 1e-9
@@ -0,0 +1,165 @@
+import pickle
+import numpy as np
+import pytest
+from schelling_graph import Schelling_Graph, Schelling_Node
+
+
+def test_pickled_graph_runs_like_the_original(triangle):
+    g = triangle(6)
+    h = pickle.loads(pickle.dumps(g))
+    h.nodes[0].chips += 1
+    assert h.chips_array[0] == h.nodes[0].chips
+    h.nodes[0].chips -= 1
+
+    for engine in ("python", "array"):
+        a, b = g.copy(same_stream=True), pickle.loads(pickle.dumps(g))
+        ra = a.run_rounds(max_rounds=3000, engine=engine)
+        rb = b.run_rounds(max_rounds=3000, engine=engine)
+        assert (ra.rounds, ra.n_moves, ra.reason) == (rb.rounds, rb.n_moves, rb.reason)
+        assert np.array_equal(a.chips_array, b.chips_array)
+        assert b.chips == b.chips_array.tolist()
+
+
+def test_nodes_of_another_graph_are_refused():
+    nodes = [Schelling_Node(x=i, y=i) for i in range(3)]
+    g = Schelling_Graph(nodes)
+    g.set_chips([1, 2, 3])
+    with pytest.raises(AssertionError, match="already belongs"):
+        Schelling_Graph(nodes)
+    assert g.chips == [1, 2, 3]
+
+
+def test_compiled_topology_is_kept_until_the_arrows_change(triangle):
+    g = triangle(4)
+    compiled = g.compile()
+    g.run_rounds(max_rounds=5)
+    assert g.compile() is compiled
+    g.nodes[0].add_arrow(g.nodes[1], g.nodes[2])
+    assert g.compile().n_arrows == compiled.n_arrows + 1
+
+
+def _pair_graph():
+    """(0,0) has an arrow to (0,1) with out node (1,0), which has no arrow
+    of the color of (0,0) yet."""
+    nodes = [Schelling_Node(x=0, y=0, color="red"), Schelling_Node(x=1, y=0, color="blue"),
+             Schelling_Node(x=0, y=1, color="green"), Schelling_Node(x=2, y=2, color="black")]
+    g = Schelling_Graph(nodes)
+    g.add_arrow(g[0, 0], g[0, 1], g[1, 0])
+    return g
+
+
+def test_freeze_rejects_incoherent_arrows():
+    g = _pair_graph()
+    issues = g.coherence_issues()
+    assert issues == ["arrow (0,0) --blue--> (0,1): out node (1,0) has no arrow of color red"]
+    assert not g.is_coherent()
+    with pytest.raises(ValueError, match="1 arrows can only move half"):
+        g.freeze()
+    assert not g.frozen
+    g.freeze(check=False)
+    assert g.frozen
+
+
+def test_freeze_fixes_the_arrows():
+    g = _pair_graph()
+    g.add_arrow(g[1, 0], g[0, 0], g[0, 0])
+    assert g.coherence_issues() == []
+    g.freeze()
+    assert g._arrows_by_color(1)[g.palette.code("red")] is g[1, 0].arrows[0]
+    with pytest.raises(AssertionError, match="frozen"):
+        g[0, 0].add_arrow(g[1, 0], g[0, 1])
+    with pytest.raises(AssertionError, match="frozen"):
+        g[0, 0].arrows = []
+    with pytest.raises(AssertionError, match="frozen"):
+        g.reset_arrows()
+    assert len(g[0, 0].arrows) == 1
+
+    g.unfreeze()
+    compiled = g.compile()
+    g[0, 0].arrows = []
+    assert g.compile() is not compiled and g.compile().n_arrows == 1
+
+
+def test_arrow_table_is_kept_by_copies_pickles_and_freeze(triangle):
+    g = triangle(5)
+    assert g._arrow_table is not None
+    for h in (g.copy(), pickle.loads(pickle.dumps(g))):
+        assert all(node._arrows is None for node in h.nodes)
+        assert np.array_equal(h.compile().arrow_out_arrow, g.compile().arrow_out_arrow)
+
+    frozen = g.copy(same_stream=True)
+    frozen.freeze()
+    assert all(node._arrows is None for node in frozen.nodes)
+    a = frozen.run_rounds(max_rounds=2000, engine="python")
+    b = g.run_rounds(max_rounds=2000, engine="python")
+    assert (a.rounds, a.n_moves, a.reason) == (b.rounds, b.n_moves, b.reason)
+    assert np.array_equal(frozen.chips_array, g.chips_array)
+    frozen.unfreeze()
+    assert frozen._arrow_table is not None
+
+
+def test_sparse_coordinates_are_indexed_by_a_dictionary():
+    nodes = [Schelling_Node(x=0, y=0), Schelling_Node(x=10**6, y=3), Schelling_Node(x=5, y=10**6)]
+    g = Schelling_Graph(nodes)
+    assert g._coords._grid is None
+    assert g[10**6, 3] is nodes[1] and g[5, 10**6] is nodes[2]
+    assert g._coords.get(5, 3) == -1
+    with pytest.raises(KeyError, match="No node at position"):
+        g[5, 3]
+    with pytest.raises(AssertionError, match="same position"):
+        Schelling_Graph([Schelling_Node(x=10**6, y=1), Schelling_Node(x=10**6, y=1)])
+
+
+def test_missing_nodes_raise_key_errors(triangle):
+    g = triangle(4, chips=None)
+    assert g._coords._grid is not None
+    assert g[1, 3].x == 1 and g[1, 3].y == 3
+    for x, y in ((3, 3), (5, 0), (-1, 0), (0, 100)):
+        with pytest.raises(KeyError):
+            g[x, y]
+
+
+def test_large_graph_is_built_from_its_coordinates():
+    n = 100_000
+    g = Schelling_Graph([Schelling_Node(x=i % 400, y=i // 400) for i in range(n)])
+    assert len(g.nodes) == n and g.shape == (400, 250)
+    assert g[399, 249] is g.nodes[-1] and g[7, 3] is g.nodes[3 * 400 + 7]
+    m = g.matrix
+    assert m.shape == g.shape and m[7, 3] is g.nodes[3 * 400 + 7]
+
+
+def test_palette_codes_round_trip(triangle):
+    g = triangle(4, chips=None)
+    assert [g.palette.name(n._color_code) for n in g.nodes] == [n.color for n in g.nodes]
+    assert g.palette.code(g.palette.name(2)) == 2
+    n, old = len(g.palette), g[1, 1].color
+    g[1, 1].color = "teal"
+    assert g.palette.code("teal") == g[1, 1]._color_code == n and len(g.palette) == n + 1
+    assert g[1, 1] in g.nbc["teal"] and g[1, 1] not in g.nbc[old]
+
+
+def test_frozen_graph_rejects_color_changes(triangle):
+    g = triangle(4, chips=None)
+    g.freeze()
+    old, code = g[1, 1].color, g[1, 1]._color_code
+    with pytest.raises(AssertionError, match="frozen"):
+        g[1, 1].color = "teal"
+    assert (g[1, 1].color, g[1, 1]._color_code) == (old, code)
+    g.unfreeze()
+    g[1, 1].color = "teal"
+    assert g[1, 1].color == "teal"
+
+
+def test_colors_survive_copies_and_pickles(triangle, tmp_path):
+    g = triangle(4)
+    g.compile()
+    g[1, 1].color = "teal"
+    g[0, 2].color = "red"
+    compiled = g.compile()
+    for h in (g.copy(), g.copy(same_stream=True), pickle.loads(pickle.dumps(g))):
+        assert [n.color for n in h.nodes] == [n.color for n in g.nodes]
+        assert h.palette.names == g.palette.names
+        assert np.array_equal(h.compile().color, compiled.color)
+        assert np.array_equal(h.compile().arrow_out_neighbor, compiled.arrow_out_neighbor)
+        h.save(tmp_path / "h.sgg")
+        assert [n.color for n in Schelling_Graph.load(tmp_path / "h.sgg").nodes] == [n.color for n in g.nodes]
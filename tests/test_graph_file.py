@@ -0,0 +1,80 @@
+import json
+import pickle
+import struct
+import numpy as np
+import pytest
+from schelling_graph import Schelling_Graph
+from schelling_graph.graph_file import MAGIC
+
+
+@pytest.mark.parametrize("frozen", [False, True])
+def test_round_trip(triangle, tmp_path, frozen):
+    g = triangle(6, chips=3)
+    if frozen:
+        g.freeze(check=False)
+    g.save(tmp_path / "g.sgg")
+    h = Schelling_Graph.load(tmp_path / "g.sgg", seed=3)
+
+    assert h.frozen == frozen
+    assert [(n.x, n.y, n.color) for n in h.nodes] == [(n.x, n.y, n.color) for n in g.nodes]
+    assert np.array_equal(h.chips_array, g.chips_array)
+    assert h.count_chips_not_segregated() == g.count_chips_not_segregated()
+    assert [[(a.neighbor._index, a.out_edge_node._index) for a in n.arrows] for n in h.nodes] == \
+        [[(a.neighbor._index, a.out_edge_node._index) for a in n.arrows] for n in g.nodes]
+    for name in ("arrow_ptr", "arrow_neighbor", "arrow_out_node", "arrow_out_neighbor"):
+        assert np.array_equal(getattr(h.compile(), name), getattr(g.compile(), name))
+    assert h.compile().fingerprint == g.compile().fingerprint
+
+    g.seed(3)
+    a = g.run_rounds(max_rounds=500, engine="array")
+    b = h.run_rounds(max_rounds=500, engine="array")
+    assert np.array_equal(a.trajectory.moves, b.trajectory.moves)
+
+
+def test_loaded_arrows_stay_in_the_file(triangle, tmp_path):
+    g = triangle(6, chips=3)
+    g.freeze()
+    g.save(tmp_path / "g.sgg")
+    h = Schelling_Graph.load(tmp_path / "g.sgg")
+    assert all(isinstance(a, np.memmap) for a in h._arrow_table)
+    assert all(n._arrows is None for n in h.nodes)
+
+    a = g.copy(same_stream=True).run_rounds(max_rounds=500, engine="python")
+    h._stream = g._stream.copy()
+    b = h.run_rounds(max_rounds=500, engine="python")
+    assert np.array_equal(a.trajectory.moves, b.trajectory.moves)
+    assert any(n._arrows is not None for n in h.nodes)
+    assert pickle.loads(pickle.dumps(h)).compile().fingerprint == g.compile().fingerprint
+
+    h.unfreeze()
+    h[2, 2].add_arrow(h[1, 2], h[0, 0])
+    assert h._arrow_table is None
+    assert h.compile().n_arrows == g.compile().n_arrows + 1
+
+
+def _rewrite_header(path, **changes):
+    """Rewrite the JSON header of the graph file path with changes."""
+    data = path.read_bytes()
+    (length,) = struct.unpack('<Q', data[len(MAGIC):len(MAGIC) + 8])
+    start = len(MAGIC) + 8
+    header = json.loads(data[start:start + length])
+    header.update(changes)
+    encoded = json.dumps(header).encode()
+    path.write_bytes(MAGIC + struct.pack('<Q', len(encoded)) + encoded + data[start + length:])
+
+
+def test_other_files_are_rejected(triangle, tmp_path):
+    path = tmp_path / "g.sgg"
+    triangle(3).save(path)
+
+    _rewrite_header(path, version=2)
+    with pytest.raises(AssertionError, match="newer version"):
+        Schelling_Graph.load(path)
+
+    _rewrite_header(path, version=1, format="schelling_graph benchmarks")
+    with pytest.raises(AssertionError, match="not a schelling_graph graph file"):
+        Schelling_Graph.load(path)
+
+    path.write_bytes(b"SGTRAJ01" + path.read_bytes()[len(MAGIC):])
+    with pytest.raises(AssertionError, match="not a schelling_graph graph file"):
+        Schelling_Graph.load(path)
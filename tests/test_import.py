@@ -0,0 +1,23 @@
+import subprocess
+import sys
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+
+PROBE = """
+import sys
+import schelling_graph as sg
+g = sg.Schelling_Graph([sg.Schelling_Node(x=0, y=0), sg.Schelling_Node(x=1, y=0)], seed=0)
+g.run_rounds(max_rounds=10)
+print(",".join(m for m in ("matplotlib", "scipy", "IPython") if m in sys.modules))
+"""
+
+
+def test_import_does_not_load_the_optional_dependencies():
+    loaded = subprocess.run([sys.executable, "-c", PROBE], cwd=ROOT, capture_output=True, text=True, check=True)
+    assert loaded.stdout.strip() == ""
+
+
+def test_valid_colors_are_loaded_on_first_use():
+    import schelling_graph as sg
+    assert "red" in sg.VALID_COLORS
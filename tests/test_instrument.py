@@ -0,0 +1,40 @@
+import pytest
+from schelling_graph import Callback, No_Progress
+from schelling_graph.instrument import NO_CANDIDATES, PHASES, SELF_REJECTED
+
+ENGINES = ("python", "array", "kmc")
+
+
+@pytest.mark.parametrize("engine", ENGINES)
+@pytest.mark.parametrize("stop_on_absorbing", [True, False])
+def test_rounds_are_moves_idle_or_skipped(triangle, engine, stop_on_absorbing):
+    g = triangle(6, chips=1)
+    result = g.run_rounds(No_Progress(40), max_rounds=5000, engine=engine, stop_on_absorbing=stop_on_absorbing,
+                          stats=True)
+    stats = result.stats
+    assert (stats.rounds, stats.moves) == (result.rounds, result.n_moves)
+    assert stats.rounds == stats.moves + sum(stats.idle.values()) + stats.skipped_rounds
+    if engine == "kmc":
+        assert stats.idle == {NO_CANDIDATES: 0, SELF_REJECTED: 0}
+    else:
+        assert stats.skipped_rounds == 0
+    assert set(stats.as_dict()["seconds"]) == set(PHASES)
+
+
+def test_python_and_array_count_the_same_idle_rounds(triangle):
+    g = triangle(8, chips=2)
+    a, b = g.copy(same_stream=True), g.copy(same_stream=True)
+    ra = a.run_rounds(max_rounds=4000, engine="python", stop_on_absorbing=False, stats=True)
+    rb = b.run_rounds(max_rounds=4000, engine="array", stop_on_absorbing=False, stats=True)
+    assert ra.stats.idle == rb.stats.idle
+    assert ra.stats.idle[NO_CANDIDATES] > 0 and ra.stats.idle[SELF_REJECTED] > 0
+    assert (ra.stats.moves, ra.stats.half_moves) == (rb.stats.moves, rb.stats.half_moves)
+
+
+@pytest.mark.parametrize("engine", ENGINES)
+def test_callbacks_see_the_stats(triangle, engine):
+    seen = []
+    g = triangle(6, chips=3)
+    g.run_rounds(Callback(lambda graph, run: seen.append(run.stats is not None and run.round_count), rounds=10), max_rounds=200,
+                 engine=engine, stop_on_absorbing=False, stats=True)
+    assert seen == list(range(10, 201, 10))
@@ -0,0 +1,29 @@
+import numpy as np
+
+
+def test_fractional_steps_keep_their_rounds(triangle):
+    g = triangle(5, chips=4)
+    result = g.run_mean_field(max_rounds=3, step=0.25, stop_on_segregated=False)
+    t = result.trajectory
+    assert t.rounds.dtype == np.float64
+    assert np.allclose(t.rounds, np.arange(13) * 0.25)
+    assert np.allclose(t.chips_at_round(0.5), t.chips(2))
+    assert result.rounds == 3
+
+
+def test_mean_field_conserves_the_chips_and_leaves_the_graph(triangle):
+    g = triangle(5, chips=4)
+    chips = g.chips_array.copy()
+    result = g.run_mean_field(max_rounds=50, method="euler")
+    assert np.array_equal(g.chips_array, chips)
+    assert np.isclose(result.trajectory.chips(-1).sum(), chips.sum())
+    assert len(list(result.trajectory.frames[::5])) == len(result.trajectory.frames[::5])
+
+
+def test_mean_field_frames_keep_the_fractional_chips(triangle):
+    g = triangle(5, chips=4)
+    t = g.run_mean_field(max_rounds=5, stop_on_segregated=False).trajectory
+    m = t.chips_matrix(t.chips(-1))
+    assert m.dtype == np.float64 and m.shape == g.shape
+    assert np.allclose(m[g.compile().x, g.compile().y], t.chips(-1))
+    assert np.isclose(m.sum(), g.chips_array.sum())
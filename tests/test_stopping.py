@@ -0,0 +1,107 @@
+import numpy as np
+import pytest
+from schelling_graph import Absorbing, Callback, No_Progress, Schelling_Graph, Schelling_Node, Segregated, Time_Budget
+
+ENGINES = ("python", "array", "kmc")
+
+
+def single_chip(triangle) -> Schelling_Graph:
+    """A graph in an absorbing state: a single chip can only take self arrows."""
+    g = triangle(4, chips=None)
+    g[2, 1].chips = 1
+    return g
+
+
+def pair() -> Schelling_Graph:
+    """Two nodes whose chips swap forever: every round is a move."""
+    a, b = Schelling_Node(x=1, y=1, color="red"), Schelling_Node(x=2, y=2, color="blue")
+    g = Schelling_Graph([a, b], seed=0)
+    g.add_arrow(a, b, b)
+    g.add_arrow(b, a, a)
+    g.set_chips([1, 1])
+    return g
+
+
+def not_segregated(graph) -> int:
+    """Chips off the x=0/y=0 boundary, counted from scratch."""
+    compiled = graph.compile()
+    return int(graph.chips_array[(compiled.x != 0) & (compiled.y != 0)].sum())
+
+
+def idle_rounds(stats) -> int:
+    return sum(stats.idle.values()) + stats.skipped_rounds
+
+
+@pytest.mark.parametrize("engine", ENGINES)
+def test_absorbing_does_not_count_the_revealing_round(triangle, engine):
+    g = triangle(6, chips=3)
+    result = g.run_rounds(max_rounds=10**6, engine=engine, stats=True)
+    assert result.reason == Absorbing.reason
+    assert result.n_moves > 0
+    assert result.rounds == result.trajectory.rounds[-1]
+    assert not g.compile().enabled_arrows(g.chips_array).any()
+    stats = result.stats
+    assert (stats.rounds, stats.moves) == (result.rounds, result.n_moves)
+    assert stats.rounds == stats.moves + idle_rounds(stats)
+
+
+@pytest.mark.parametrize("engine", ENGINES)
+def test_absorbing_is_checked_at_max_rounds(triangle, engine):
+    g = triangle(6, chips=3)
+    full = g.copy(same_stream=True).run_rounds(max_rounds=10**6, engine=engine)
+    result = g.run_rounds(max_rounds=full.rounds, engine=engine)
+    assert (result.rounds, result.n_moves, result.reason) == (full.rounds, full.n_moves, Absorbing.reason)
+
+
+@pytest.mark.parametrize("engine", ENGINES)
+def test_absorbing_from_the_start(triangle, engine):
+    result = single_chip(triangle).run_rounds(max_rounds=100, engine=engine, stats=True)
+    assert (result.rounds, result.n_moves, result.reason) == (0, 0, Absorbing.reason)
+    assert idle_rounds(result.stats) == 0
+
+
+@pytest.mark.parametrize("engine", ENGINES)
+def test_no_progress_without_moves(triangle, engine):
+    result = single_chip(triangle).run_rounds(No_Progress(50), max_rounds=1000, engine=engine,
+                                              stop_on_absorbing=False)
+    assert (result.rounds, result.n_moves, result.reason) == (50, 0, "no move in 50 rounds")
+
+
+@pytest.mark.parametrize("engine", ENGINES)
+def test_no_progress_counts_from_the_last_move(triangle, engine):
+    g = triangle(6, chips=3)
+    result = g.run_rounds(No_Progress(25), max_rounds=10**6, engine=engine, stop_on_absorbing=False)
+    rounds = result.trajectory.rounds
+    assert result.reason == "no move in 25 rounds"
+    assert result.n_moves == len(rounds) > 0
+    assert result.rounds == rounds[-1] + 25
+    assert np.diff(rounds).max() <= 25
+
+
+@pytest.mark.parametrize("engine", ENGINES)
+def test_time_budget(engine):
+    result = pair().run_rounds(Time_Budget(0), max_rounds=100, engine=engine)
+    assert (result.rounds, result.n_moves, result.reason) == (0, 0, "time budget of 0 s exhausted")
+
+    result = pair().run_rounds(Time_Budget(0.05), max_rounds=10**9, engine=engine, stats=True)
+    assert result.reason == "time budget of 0.05 s exhausted"
+    assert result.rounds == result.n_moves > 0
+    assert result.stats.wall_seconds >= 0.05
+
+
+@pytest.mark.parametrize("engine", ENGINES)
+def test_segregated_counter_matches_a_full_scan(triangle, engine):
+    mismatches = []
+
+    def compare(graph, run):
+        if graph.count_chips_not_segregated() != not_segregated(graph) or \
+                graph.is_segregated() != (not_segregated(graph) == 0):
+            mismatches.append(run.round_count)
+
+    g = triangle(6, chips=3)
+    assert not g.is_segregated()
+    result = g.run_rounds([Segregated(), Callback(compare)], max_rounds=10**6, engine=engine)
+    assert mismatches == []
+    assert result.reason == Segregated.reason
+    assert result.rounds == result.trajectory.rounds[-1]
+    assert not_segregated(g) == 0
@@ -0,0 +1,55 @@
+from conftest import triangle_nodes
+from schelling_graph import Sweep_Cache, run_sweep
+from schelling_graph.stopping import Callback
+
+GRID = dict(s=[6], tau=[1.0], p=[0.5], q=[0.5], chips=[20])
+
+
+def never():
+    return False
+
+
+def always():
+    return True
+
+
+def count(graph, run):
+    pass
+
+
+def sweep(cache, stop_when, **kwargs):
+    return run_sweep(GRID, triangle_nodes, stop_when=stop_when, max_rounds=200, workers=1, cache=cache, **kwargs)
+
+
+def test_sweep_reuses_the_cached_points():
+    cache = Sweep_Cache()
+    first = sweep(cache, never, n_replicas=2)
+    again = sweep(cache, never, n_replicas=3)
+    assert first.n_cached == 0 and again.n_cached == 2
+    assert (again["rounds"][:2] == first["rounds"]).all()
+
+
+def test_different_stop_functions_are_not_mixed_up():
+    cache = Sweep_Cache()
+    assert sweep(cache, never)["rounds"][0] > 0
+    other = sweep(cache, always)
+    assert other.n_cached == 0 and other["rounds"][0] == 0
+
+
+def test_callback_keys_are_stable():
+    cache = Sweep_Cache()
+    sweep(cache, [Callback(count, rounds=10)])
+    assert sweep(cache, [Callback(count, rounds=10)]).n_cached == 1
+    assert sweep(cache, [Callback(count, rounds=20)]).n_cached == 0
+
+
+def test_local_functions_are_not_cached():
+    cache = Sweep_Cache()
+    sweep(cache, lambda: False)
+    assert sweep(cache, lambda: False).n_cached == 0
+
+
+def test_sweep_cache_on_disk(tmp_path):
+    first = sweep(str(tmp_path), never)
+    again = sweep(Sweep_Cache(str(tmp_path)), never)
+    assert again.n_cached == 1 and again["rounds"][0] == first["rounds"][0]
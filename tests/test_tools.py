@@ -0,0 +1,118 @@
+import numpy as np
+import pytest
+from conftest import triangle_nodes
+from schelling_graph import Schelling_Graph, Schelling_Node, arrow_table, auto_arrows, calc_multinomial_pvals, node_multinomial_pvals
+from schelling_graph.tools import multinomial, multinomial_pvals_at
+
+
+def reference_arrows(x, y, tau, s):
+    """(source, neighbor, out_node) of the nested loops of the original auto_arrows."""
+    index = {(a, b): i for i, (a, b) in enumerate(zip(x, y))}
+    arrows = [[] for _ in x]
+
+    def add(a, b, to, out):
+        arrows[index[a, b]].append((index[a, b], index[to], out))
+
+    for a, b in zip(x, y):
+        for c, d in zip(x, y):
+            r = d/(c+d) if (c+d) != 0 else 1
+            w = c/(c+d) if (c+d) != 0 else 1
+            if c+d >= s:
+                continue
+            if (b-1 >= 0) and (d+1 <= s) and (b/(a+b) < tau) and (b/(a+b) <= r):
+                add(a, b, (a, b-1), index[c, d])
+                add(c, d, (c, d+1), index[a, b])
+            if (a-1 >= 0) and (c+1 <= s) and (a/(a+b) < tau) and (a/(a+b) <= w):
+                add(a, b, (a-1, b), index[c, d])
+                add(c, d, (c+1, d), index[a, b])
+    table = np.array([arrow for node in arrows for arrow in node], dtype=np.int64).reshape(-1, 3)
+    return table[:, 0], table[:, 1], table[:, 2]
+
+
+@pytest.mark.parametrize("s", [2, 3, 5, 7, 10])
+@pytest.mark.parametrize("tau", [0.3, 0.5, 0.6, 1.0])
+def test_arrow_table_matches_the_nested_loops(s, tau):
+    nodes = triangle_nodes(s)
+    x, y = [n.x for n in nodes], [n.y for n in nodes]
+    expected = reference_arrows(x, y, tau, s)
+    for tile_size, workers in ((1 << 22, 1), (7, 2)):
+        table = arrow_table(x, y, tau, s, tile_size=tile_size, workers=workers)
+        for got, want in zip(table, expected):
+            assert np.array_equal(got, want)
+
+
+def test_auto_arrows_adds_the_arrows_in_order():
+    nodes = triangle_nodes(6)[::-1]
+    g = Schelling_Graph(nodes)
+    auto_arrows(g, 0.6)
+    source, neighbor, out_node = reference_arrows([n.x for n in nodes], [n.y for n in nodes], 0.6, 6)
+    compiled = g.compile()
+    assert np.array_equal(compiled.arrow_source, source)
+    assert np.array_equal(compiled.arrow_neighbor, neighbor)
+    assert np.array_equal(compiled.arrow_out_node, out_node)
+
+
+def test_arrow_objects_are_created_on_first_access():
+    g = Schelling_Graph(triangle_nodes(6))
+    auto_arrows(g, 0.6)
+    assert all(node._arrows is None for node in g.nodes)
+    compiled = g.compile()
+    node = g[3, 1]
+    lo, hi = compiled.arrow_ptr[node._index], compiled.arrow_ptr[node._index + 1]
+    assert [(a.neighbor._index, a.out_edge_node._index) for a in node.arrows] == \
+        list(zip(compiled.arrow_neighbor[lo:hi].tolist(), compiled.arrow_out_node[lo:hi].tolist()))
+    assert node.arrows is node.arrows
+    assert sum(n._arrows is not None for n in g.nodes) == 1
+
+    # editing an arrow turns the whole table into arrow objects
+    g[0, 0].add_arrow(g[1, 0], g[0, 1])
+    assert g._arrow_table is None
+    assert all(isinstance(n._arrows, list) for n in g.nodes)
+    assert g.compile().n_arrows == compiled.n_arrows + 1
+    # after the arrows of (0, 0), the first node
+    assert np.array_equal(g.compile().arrow_out_node,
+                          np.insert(compiled.arrow_out_node, compiled.arrow_ptr[1], g[0, 1]._index))
+
+
+def test_add_arrow_table_keeps_the_existing_arrows():
+    g = Schelling_Graph(triangle_nodes(4))
+    g[1, 1].add_arrow(g[0, 1], g[1, 0])
+    auto_arrows(g, 0.6)
+    auto_arrows(g, 0.6)
+    once = Schelling_Graph(triangle_nodes(4))
+    auto_arrows(once, 0.6)
+    expected = once.compile()
+    for node, other in zip(g.nodes, once.nodes):
+        arrows = [(a.neighbor._index, a.out_edge_node._index) for a in other.arrows]
+        if (node.x, node.y) == (1, 1):
+            arrows = [(g[0, 1]._index, g[1, 0]._index)] + arrows
+        assert [(a.neighbor._index, a.out_edge_node._index) for a in node.arrows] == \
+            arrows + [(a.neighbor._index, a.out_edge_node._index) for a in other.arrows]
+    assert g.compile().n_arrows == 2 * expected.n_arrows + 1
+
+
+@pytest.mark.parametrize("p, q", [(0.3, 0.4), (0.5, 0.5), (0.0, 0.2), (0.9, 1.0)])
+def test_multinomial_pvals_match_the_formula(p, q):
+    s = 12
+    pvals = calc_multinomial_pvals(p, q, s)
+    assert len(pvals) == (s + 1) * (s + 2) // 2
+    for (a, b), pval in pvals.items():
+        exact = multinomial(s, a, b) * p**a * (1-p)**b * q**(s-a-b) * (1-q)**(a+b)
+        assert pval == pytest.approx(exact, rel=1e-9, abs=1e-300)
+
+
+@pytest.mark.parametrize("s", [1000, 3000])
+def test_multinomial_pvals_stay_finite_for_large_s(s):
+    a, b = np.nonzero(np.add.outer(np.arange(s + 1), np.arange(s + 1)) <= s)
+    pvals = multinomial_pvals_at(a, b, 0.3, 0.4, s)
+    assert np.isfinite(pvals).all()
+    assert pvals.sum() == pytest.approx(1.0, abs=1e-9)
+    assert pvals.max() > 0
+
+
+def test_multinomial_initialization_of_a_large_graph():
+    s = 1000
+    x, y = np.nonzero(np.add.outer(np.arange(s + 1), np.arange(s + 1)) <= s)
+    g = Schelling_Graph([Schelling_Node(x=a, y=b) for a, b in zip(x.tolist(), y.tolist())], seed=0)
+    g.init_chips_multinomial(10**6, node_multinomial_pvals(g, 0.3, 0.4))
+    assert g.chips_array.sum() == 10**6
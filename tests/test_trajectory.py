@@ -0,0 +1,58 @@
+import os
+import numpy as np
+import pytest
+from schelling_graph import Trajectory_File
+from schelling_graph.trajectory import Trajectory_Writer
+
+
+def _runs(triangle, tmp_path, **kwargs):
+    g = triangle(6, chips=6)
+    a, b = g.copy(same_stream=True), g.copy(same_stream=True)
+    memory = a.run_rounds(max_rounds=3000, stop_on_absorbing=False, keyframe_every=7).trajectory
+    path = tmp_path / "run.sgt"
+    stream = b.run_rounds(max_rounds=3000, stop_on_absorbing=False, keyframe_every=7, record_to=path,
+                          **kwargs).trajectory
+    return memory, stream
+
+
+def test_file_matches_memory(triangle, tmp_path):
+    memory, stream = _runs(triangle, tmp_path)
+    assert isinstance(stream, Trajectory_File)
+    assert len(stream) == len(memory) > 100
+    assert np.array_equal(stream.moves, memory.moves)
+    for i in (0, 6, 7, 50, len(memory) - 1):
+        assert np.array_equal(stream.chips(i), memory.chips(i))
+    assert np.array_equal(list(stream.frames[::25])[-1], list(memory.frames[::25])[-1])
+
+
+def test_keyframes_do_not_end_chunks(triangle, tmp_path):
+    g = triangle(6, chips=6)
+    result = g.run_rounds(max_rounds=3000, stop_on_absorbing=False, keyframe_every=7,
+                          record_to=tmp_path / "run.sgt")
+    t = result.trajectory
+    assert len(t._chunks) == 1
+    assert len(t._keyframe_offsets) == len(t) // 7 + 1
+
+
+@pytest.mark.skipif(not os.path.isdir("/proc/self/fd"), reason="needs /proc")
+def test_one_file_descriptor_for_many_chunks(tmp_path):
+    path = tmp_path / "many.sgt"
+    w = Trajectory_Writer(path, np.zeros(3, dtype=np.int64), np.arange(3), np.arange(3), (3, 3),
+                          chunk_size=4)
+    for r in range(2000):
+        w.record(r + 1, 0, r % 3, (r + 1) % 3, -1, -1)
+    t = w.close()
+    before = len(os.listdir("/proc/self/fd"))
+    assert len(t._chunks) == 500
+    assert len(list(t.iter_chunks())) == 500
+    assert t.moves.shape == (2000, 5)
+    assert len(os.listdir("/proc/self/fd")) <= before
+
+
+
+def test_chips_matrix_matches_the_graph(triangle):
+    g = triangle(6, chips=6)
+    t = g.run_rounds(max_rounds=500, stop_on_absorbing=False).trajectory
+    assert len(t) > 0
+    assert np.array_equal(t.chips_matrix(t.chips(-1)), g.chips_matrix)
+    assert np.array_equal(list(t.frames[-1:])[0], g.chips_matrix)
@@ -0,0 +1,70 @@
+import matplotlib
+import numpy as np
+import pytest
+
+matplotlib.use("Agg")
+from matplotlib import pyplot as plt  # noqa: E402
+from schelling_graph.visualization import Chips_Renderer, _animation, export_animation  # noqa: E402
+
+
+@pytest.fixture
+def frames(triangle):
+    g = triangle(4, chips=3)
+    return g.run_rounds(max_rounds=200, stop_on_absorbing=False).trajectory.frames
+
+
+def test_renderer_draws_the_chips(triangle):
+    g = triangle(4, chips=3)
+    fig, ax = plt.subplots()
+    renderer = Chips_Renderer(ax, g.shape)
+    artists = renderer.update(g.chips_matrix)
+    fig.canvas.draw()
+    plt.close(fig)
+
+    assert artists == renderer.artists and len(renderer.texts) == g.shape[0] * g.shape[1]
+    m = g.chips_matrix
+    texts = np.array([t.get_text() for t in renderer.texts]).reshape(m.shape)
+    assert (texts == np.where(m > 0, m.astype(str), '')).all()
+    assert (renderer.image.get_array().mask == (m == 0).T).all()
+
+
+def test_updates_touch_only_the_changed_cells(triangle):
+    g = triangle(4, chips=None)
+    g[1, 1].chips, g[2, 0].chips = 2, 4
+    fig, ax = plt.subplots()
+    renderer = Chips_Renderer(ax, g.shape)
+    renderer.update(g.chips_matrix)
+    fig.canvas.draw()
+    children = len(ax.get_children())
+    for text in renderer.texts:
+        # the empty texts are not drawn, so they stay stale
+        text.stale = False
+
+    g[0, 3].chips = 1
+    renderer.update(g.chips_matrix)
+    changed = [(i, j) for i in range(g.shape[0]) for j in range(g.shape[1])
+               if renderer.texts[i * g.shape[1] + j].stale]
+    plt.close(fig)
+    assert changed == [(0, 3)]
+    assert len(ax.get_children()) == children
+
+
+def test_blitted_animation_reuses_its_artists(frames):
+    fig, ani = _animation(frames, interval=1, repeat_delay=0, labels=True)
+    fig.canvas.draw()
+    children = len(fig.axes[0].get_children())
+    for frame in list(frames)[:5]:
+        drawn = ani._func(frame)
+        assert all(a.get_animated() for a in drawn)
+    plt.close(fig)
+    assert len(fig.axes[0].get_children()) == children
+
+
+def test_export_animation_writes_a_gif(frames, tmp_path):
+    path = tmp_path / "chips.gif"
+    assert export_animation(frames, path, fps=5, every=3, writer="pillow") == path
+    from PIL import Image
+    with Image.open(path) as image:
+        assert image.format == "GIF"
+        assert image.n_frames == len(frames[::3]) > 1
+    assert plt.get_fignums() == []